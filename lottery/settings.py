@@ -76,14 +76,29 @@ WSGI_APPLICATION = 'lottery.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/1.9/ref/settings/#databases
 
+# lotto.backends.sqlite3 is the sqlite3 backend tuned for concurrent use (WAL journal, memory mapping, busy timeout, BEGIN IMMEDIATE
+# for the transactions of lotto.backends.writeTransaction), whose pragmas and transaction_mode can be changed in OPTIONS. Use django.db.backends.sqlite3 for SQLite's own defaults.
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
+        'ENGINE': 'lotto.backends.sqlite3',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
     }
 }
 
 
+# Password hashing: LOTTO_PASSWORD_PROFILE 'secure' hashes punters' passwords at full cost, 'fast' cheaply (for tests, see lottery.test_settings).
+# It can be set in the environment. The secure profile doesnt accept passwords hashed cheaply, while the fast profile accepts both,
+# and rehashes secure hashes with the fast hasher when the punter signs in.
+LOTTO_PASSWORD_PROFILE = os.environ.get('LOTTO_PASSWORD_PROFILE', 'secure')
+PASSWORD_PROFILES = {
+    'secure': ['django.contrib.auth.hashers.PBKDF2PasswordHasher'],
+    'fast': ['lotto.hashers.FastPBKDF2PasswordHasher', 'django.contrib.auth.hashers.PBKDF2PasswordHasher'],
+}
+PASSWORD_HASHERS = PASSWORD_PROFILES[LOTTO_PASSWORD_PROFILE]
+
+# Punters stay signed in with a signed cookie session, which needs no database query to read
+SESSION_ENGINE = 'django.contrib.sessions.backends.signed_cookies'
+
 # Password validation
 # https://docs.djangoproject.com/en/1.9/ref/settings/#auth-password-validators
 
@@ -121,3 +136,29 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/1.9/howto/static-files/
 
 STATIC_URL = '/static/'
+
+
+# Lotto
+
+# Engine used to count the matches when a draw is made: 'python' checks each entry in turn,
+# 'numpy' counts the matches for all the entries of a draw in one batched step (needs numpy installed),
+# 'index' builds the draw's inverted number index (NumberIndex) when it is made, and counts the matches from the bitmaps of the winning numbers
+LOTTO_MATCH_ENGINE = 'python'
+
+# Views decorated with lotto.querybudget.queryBudget raise an exception when they run more queries than their budget
+# if this is true, otherwise they log a warning
+LOTTO_QUERY_BUDGET_FAIL = DEBUG
+
+# The list of open draws offered by the entry form is cached for this many seconds, or until a draw is saved.
+# (With more than one server process, configure CACHES with a cache they share, so that they all see it cleared.)
+LOTTO_OPEN_DRAWS_TIMEOUT = 300
+
+# Write-behind mode for sales spikes: if this is the path of a file, accepted entries are queued in it (an SQLite database of its own)
+# and the punter is answered at once, and the manage.py flush_entries worker moves them to the database in batches.
+# Making a draw closes it in the buffer and flushes its queued entries first. None writes each entry to the database as it is made.
+LOTTO_ENTRY_BUFFER = os.environ.get('LOTTO_ENTRY_BUFFER') or None
+
+# Each win is queued in the WinNotification outbox when a draw is made (if this is true), and the manage.py send_notifications worker
+# emails the winners over EMAIL_BACKEND, at most LOTTO_NOTIFICATION_RATE messages a second (None for no limit)
+LOTTO_NOTIFY_WINNERS = True
+LOTTO_NOTIFICATION_RATE = 10
@@ -0,0 +1,5 @@
+"""Settings for running the tests (python manage.py test --settings=lottery.test_settings), with cheap password hashing"""
+from .settings import *
+
+LOTTO_PASSWORD_PROFILE = 'fast'
+PASSWORD_HASHERS = PASSWORD_PROFILES[LOTTO_PASSWORD_PROFILE]
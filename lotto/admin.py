@@ -1,9 +1,20 @@
 from __future__ import unicode_literals
+import csv, itertools, json
+import six
 from django.forms import ModelForm
 from django.forms.widgets import PasswordInput
 from django.contrib import admin
-from django.http import HttpResponseRedirect
-from django.db.models import ObjectDoesNotExist
+from django.http import HttpResponseRedirect, Http404, StreamingHttpResponse
+from django.db.models import ObjectDoesNotExist, Q
+from django.conf.urls import url
+from django.contrib.admin.views.main import PAGE_VAR
+from django.core.exceptions import PermissionDenied
+from django.core.urlresolvers import reverse
+from django.shortcuts import get_object_or_404
+from django.template.response import TemplateResponse
+from django.utils.html import format_html, format_html_join
+from django.core.cache import cache
+from .pagination import keysetPage, EstimatedCountPaginator
 
 from .models import *
 
@@ -20,8 +31,8 @@ class DrawListFilter(admin.SimpleListFilter):
     parameter_name = 'result'
     def lookups(self, request, model_admin): return ( ('drawmade', 'draw made'), ('nodraw', 'draw not made yet'),)
     def queryset(self, request, queryset):
-        if self.value() == 'drawmade': return queryset.exclude(winning_combo='')
-        if self.value() == 'nodraw': return queryset.filter(winning_combo='')
+        if self.value() == 'drawmade': return queryset.filter(status=Draw.DRAWN)
+        if self.value() == 'nodraw': return queryset.filter(status=Draw.OPEN)
 
 class EntryListFilter(admin.SimpleListFilter):
     '''Filters the list of entries by whether or not they won a prize'''
@@ -32,29 +43,106 @@ class EntryListFilter(admin.SimpleListFilter):
         if self.value() == 'won': return queryset.filter(win__isnull=False)
         if self.value() == 'lost': return queryset.filter(win__isnull=True)
 
-class EntryAdmin(admin.ModelAdmin):
+RECENT_DRAWS = 20 # number of draws offered as choices by the filters below (others can still be chosen with ?draw=id)
+
+def recentDraws(made=False):
+    '''The most recent draws (or those already made), as (id, description) choices for a filter.
+       These are cached for a minute, rather than being read for every page of a changelist.'''
+    def choices():
+        draws = Draw.objects.select_related('lotterytype').order_by('-drawdate')
+        if made: draws = draws.filter(status=Draw.DRAWN)
+        return [(d.id, str(d)) for d in draws[:RECENT_DRAWS]]
+    return cache.get_or_set('lotto:admin:recentDraws:{}'.format(made), choices, 60)
+
+class EntryDrawFilter(admin.SimpleListFilter):
+    '''Filters the list of entries by draw, offering the most recent draws'''
+    title = 'draw'
+    parameter_name = 'draw'
+    def lookups(self, request, model_admin): return recentDraws()
+    def queryset(self, request, queryset):
+        if self.value(): return queryset.filter(draw=self.value())
+
+class EstimatedCountAdmin(admin.ModelAdmin):
+    '''The changelist of a big table, which doesnt count the whole table (see EstimatedCountPaginator),
+       and counts a filtered list from the page shown, so every page of it can be reached'''
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    def get_paginator(self, request, queryset, per_page, orphans=0, allow_empty_first_page=True):
+        try: number = int(request.GET.get(PAGE_VAR, 0)) + 1
+        except ValueError: number = 1
+        return self.paginator(queryset, per_page, orphans, allow_empty_first_page, number=number)
+
+class EntryAdmin(EstimatedCountAdmin):
+    '''The changelist reads the draw, punter and win of every entry in the query for the page, offers bounded filters, 
+       and doesnt count the whole table (see EstimatedCountAdmin), so it takes the same time however many entries there are'''
     fields = 'draw', 'punter', 'entry'
+    raw_id_fields = 'draw', 'punter'
     inlines = WinInline,
-    list_filter = 'draw__lotterytype', ('draw__drawdate', admin.AllValuesFieldListFilter), 'punter', EntryListFilter
+    list_filter = 'draw__lotterytype', ('draw__drawdate', admin.DateFieldListFilter), EntryDrawFilter, EntryListFilter
     list_display = 'draw', 'punter', 'won'
-
-class EntryInline(admin.TabularInline):
-    model = Entry
-    extra = 0
-    def result(self, instance): 
-        try: return 'won' if instance.win else 'lost'
-        except ObjectDoesNotExist: return 'lost'
-    def prize(self, instance):
-        try: return instance.win.prize
-        except ObjectDoesNotExist: return None
-    readonly_fields = 'result', 'prize', 
-    def has_delete_persission(self, request, obj=None): return False
+    list_select_related = 'draw__lotterytype', 'punter', 'win'
+    search_fields = '=punter__email',
+    def won(self, instance): return instance.won
+    won.boolean = True
 
 class DrawAdmin(admin.ModelAdmin):
-    fields = 'prize', 'winning_combo', 'drawdate', 'lotterytype'
-    inlines = EntryInline, #WinTable
+    '''The change page shows the result of the draw rather than its entries, which could run to millions,
+       with a link to a read only browser of the entries a page at a time'''
+    fields = 'prize', 'winning_combo', 'drawdate', 'lotterytype', 'result'
+    readonly_fields = 'result',
     list_filter = 'lotterytype', ('drawdate', admin.AllValuesFieldListFilter), DrawListFilter
-    list_display = 'lotterytype', 'drawdate', 'winning_combo'
+    list_display = 'lotterytype', 'drawdate', 'status', 'winning_combo'
+    entries_page_size = 100
+
+    def result(self, instance):
+        '''Summary of the result of the draw, read from the DrawResult saved when it was made'''
+        if instance.pk is None: return ''
+        browse = format_html('<a href="{}">Browse entries</a>', reverse('admin:lotto_draw_entries', args=(instance.pk,)))
+        try: r = instance.drawresult
+        except ObjectDoesNotExist: return format_html('Draw not made yet, {} entries. {}', instance.entry_set.count(), browse)
+        matches = format_html_join('', '<tr><td>{}</td><td>{}</td></tr>', enumerate(r.histogram))
+        return format_html('<table><tr><th>Matches</th><th>Entries</th></tr>{}<tr><th>Total</th><th>{}</th></tr></table>'
+                           '<p>Winners: {} main prize, {} spot prize, {} tier prize. Paid {} (including {} from the rollover), added {} to the rollover.</p>{}', 
+                           matches, r.entries, r.main_winners, r.spotprize_winners, r.tier_winners, r.paid,
+                           'an unknown amount' if r.rollover_in is None else r.rollover_in, r.rollover_out, browse)
+
+    def get_urls(self):
+        urls = [url(r'^(?P<object_id>[0-9]+)/entries/$', self.admin_site.admin_view(self.entries), name='lotto_draw_entries'),
+                url(r'^(?P<object_id>[0-9]+)/exportWinners/$', self.admin_site.admin_view(self.exportWinners), name='lotto_draw_exportwinners')]
+        return urls + super(DrawAdmin, self).get_urls()
+
+    def exportWinners(self, request, object_id):
+        '''The winners of the draw, with their punters' details, for staff who may change draws (see exportWinners)'''
+        draw = get_object_or_404(Draw, pk=object_id)
+        if not self.has_change_permission(request, draw): raise PermissionDenied
+        return exportWinners(request, draw)
+
+    def entries(self, request, object_id):
+        '''Read only list of the entries of a draw, newest first, a page at a time (see keysetPage), with their wins read in the same query.
+           ?q= searches for a punter's name or email, or if it is a number an entry id, or if it is numbers separated by commas
+           the entries which contain all of them (found, and counted, from the draw's number index once the draw has been made;
+           before that from the entries' bitmasks, or if the numbers can be too big for a bitmask from the entries themselves).'''
+        draw = get_object_or_404(Draw.objects.select_related('lotterytype'), pk=object_id)
+        if not self.has_change_permission(request, draw): raise PermissionDenied
+        entries, q, found = draw.entry_set.select_related('punter', 'win'), request.GET.get('q', '').strip(), None
+        before = request.GET.get('before')
+        numbers = [int(n) for n in q.split(',') if n.strip().isdigit()] if ',' in q else None
+        try:
+            if numbers and draw.status == Draw.DRAWN:
+                ids = draw.numberIndex().entryIds(numbers)
+                found = len(ids)
+                entries = entries.filter(pk__in=[i for i in reversed(ids) if not before or i < int(before)][:self.entries_page_size + 1])
+            elif numbers and max(numbers + [draw.lotterytype.max_val]) > LotteryNumberMaskField.MAX_NUMBER: entries = entries.containing(numbers)
+            elif numbers: entries = entries.withAtLeast(numbers, len(numbers))
+            elif q.isdigit(): entries = entries.filter(pk=q)
+            elif q: entries = entries.filter(Q(punter__name__icontains=q) | Q(punter__email__icontains=q))
+            page, next_page = keysetPage(entries, before, self.entries_page_size)
+        except ValueError: raise Http404("Invalid page")
+        winning = set(draw.winning_combo or [])
+        rows = [(e, len([n for n in e.entry if n in winning]) if winning else None, getattr(e, 'win', None)) for e in page]
+        context = dict(self.admin_site.each_context(request), opts=self.model._meta, original=draw, title='Entries in {}'.format(draw),
+                       rows=rows, q=q, found=found, next_page=next_page, first_page=not request.GET.get('before'))
+        return TemplateResponse(request, 'admin/lotto/draw/entries.html', context)
 
 class PunterListFilter(admin.SimpleListFilter):
     '''Filters the list of punters by whether or not they have won a prize'''
@@ -62,37 +150,75 @@ class PunterListFilter(admin.SimpleListFilter):
     parameter_name = 'result'
     def lookups(self, request, model_admin): return ( ('haswon', 'has won'), ('notwon', 'not won yet'),)
     def queryset(self, request, queryset):
-        if self.value() == 'haswon': return queryset.filter(entry__win__isnull=False).distinct()
-        if self.value() == 'notwon': return queryset.exclude(entry__win__isnull=False).distinct()
+        winners = Win.objects.values('entry__punter') # a subquery driven by the (smaller) win table, so no join or distinct is needed
+        if self.value() == 'haswon': return queryset.filter(pk__in=winners)
+        if self.value() == 'notwon': return queryset.exclude(pk__in=winners)
 
 class PunterListFilterWin(admin.SimpleListFilter):
-    '''Filters the list of punters to return only those who won a prize in a particular draw'''
+    '''Filters the list of punters to return only those who won a prize in a particular draw, offering the draws made most recently'''
     title = 'winners of specified lottery'
     parameter_name = 'draw'
-    def lookups(self, request, model_admin): 
-        return [(d.id, str(d)) for d in Draw.objects.all()]
+    def lookups(self, request, model_admin): return recentDraws(made=True)
     def queryset(self, request, queryset):
         draw = self.value()
-        if draw: return queryset.filter(entry__draw=draw, entry__win__isnull=False)
+        if draw: return queryset.filter(pk__in=Win.objects.filter(entry__draw=draw).values('entry__punter'))
         else: return queryset
 
 class PunterAdminForm(ModelForm):
+    def save(self, commit=True):
+        punter = super(PunterAdminForm, self).save(commit=False)
+        punter.setPassword(self.cleaned_data['password'])
+        if commit: punter.save()
+        return punter
     class Meta:
         model = Punter
         fields = '__all__'
         widgets = {'password': PasswordInput}
 
-class PunterAdmin(admin.ModelAdmin):
+class PunterAdmin(EstimatedCountAdmin):
     list_filter = PunterListFilter, PunterListFilterWin
     list_display = 'name', 'address', 'email'
+    search_fields = 'name', '=email'
     form = PunterAdminForm
 
+class WinAdmin(EstimatedCountAdmin):
+    raw_id_fields = 'entry',
+    list_display = '__str__', 'wintype', 'prize'
+    list_filter = 'wintype',
+    list_select_related = 'entry__punter', 'entry__draw__lotterytype'
+
+class PrizeTierInline(admin.TabularInline):
+    model = PrizeTier
+    extra = 1
+
+class TieredLotteryAdmin(admin.ModelAdmin):
+    inlines = PrizeTierInline,
+
+class RolloverLedgerAdmin(admin.ModelAdmin):
+    '''The rollover ledger is only added to by draws, so it can be looked at but not changed'''
+    list_display = 'draw', 'lotterytype', 'carried_in', 'added', 'paid_out', 'balance', 'time'
+    list_filter = 'lotterytype',
+    list_select_related = 'draw__lotterytype', 'lotterytype'
+    readonly_fields = list_display
+    def has_add_permission(self, request): return False
+    def has_delete_permission(self, request, obj=None): return False
+
+class WinNotificationAdmin(EstimatedCountAdmin):
+    '''The outbox of win notifications, to see which have failed (they are sent by the send_notifications worker)'''
+    raw_id_fields = 'entry',
+    list_display = 'entry', 'status', 'attempts', 'next_attempt', 'sent', 'error'
+    list_filter = 'status',
+    list_select_related = 'entry__punter', 'entry__draw__lotterytype'
+
 admin.site.register(MoreComplexLottery)
 admin.site.register(SimpleLottery)
+admin.site.register(TieredLottery, TieredLotteryAdmin)
 admin.site.register(Draw, DrawAdmin)
 admin.site.register(Punter, PunterAdmin)
 admin.site.register(Entry, EntryAdmin)
-admin.site.register(Win)
+admin.site.register(Win, WinAdmin)
+admin.site.register(RolloverLedger, RolloverLedgerAdmin)
+admin.site.register(WinNotification, WinNotificationAdmin)
 
 def allocateDraw(request, draw):
     '''Takes the winning combination from the admin/lotto/draw/change form and uses it to determine the winners of the draw,
@@ -100,3 +226,43 @@ def allocateDraw(request, draw):
     d = Draw.objects.get(id=draw)
     d.makeDraw(*[int(i) for i in request.POST.get('winning_combo').split(',')])
     return HttpResponseRedirect('/admin/lotto/draw/{}/change/'.format(draw))
+
+EXPORT_BATCH_SIZE = 2000 # number of winners read by each query of exportWinners
+EXPORT_FIELDS = 'win', 'wintype', 'prize', 'entry', 'numbers', 'punter', 'name', 'email', 'address'
+
+def winnerRows(draw):
+    '''Yield a tuple of EXPORT_FIELDS for each winner of the draw, in win id order.
+       The wins are read with their entries and punters in one query per batch, each starting after the id of the last win of the one before
+       (rather than an offset or a single cursor), so the memory used doesnt grow with the number of winners.'''
+    wintypes, last = dict(Win.wintypes), 0
+    wins = Win.objects.filter(entry__draw=draw).order_by('pk').values_list('pk', 'wintype', 'prize', 'entry', 'entry__entry', 'entry__punter',
+                                                                             'entry__punter__name', 'entry__punter__email', 'entry__punter__address')
+    while True:
+        batch = list(wins.filter(pk__gt=last)[:EXPORT_BATCH_SIZE])
+        for row in batch: yield (row[0], wintypes[row[1]], str(row[2]), row[3], ','.join(str(n) for n in row[4])) + row[5:]
+        if len(batch) < EXPORT_BATCH_SIZE: return
+        last = batch[-1][0]
+
+class Echo(object):
+    '''A file for csv.writer whose write returns the line written, so it can be streamed'''
+    def write(self, value): return value
+
+def csvLines(rows):
+    writer = csv.writer(Echo())
+    for row in rows:
+        if six.PY2: row = [six.text_type('' if c is None else c).encode('utf-8') for c in row]
+        yield writer.writerow(row)
+
+def jsonLines(rows):
+    for row in rows: yield json.dumps(dict(zip(EXPORT_FIELDS, row))) + '\n'
+
+def exportWinners(request, draw):
+    '''Download the winners of a draw, with their entries and punters' details, as csv (with a header row) or, with ?format=jsonl, json lines.
+       (It is served by DrawAdmin.exportWinners, which checks the user's permissions.)
+       The file is streamed as the winners are read, so it starts at once and the server's memory use stays the same however many winners there are.'''
+    fmt = request.GET.get('format', 'csv')
+    if fmt == 'csv': response = StreamingHttpResponse(csvLines(itertools.chain([EXPORT_FIELDS], winnerRows(draw))), content_type='text/csv')
+    elif fmt == 'jsonl': response = StreamingHttpResponse(jsonLines(winnerRows(draw)), content_type='application/x-ndjson')
+    else: raise Http404("Unknown format {}".format(fmt))
+    response['Content-Disposition'] = 'attachment; filename="draw-{}-winners.{}"'.format(draw.pk, fmt)
+    return response
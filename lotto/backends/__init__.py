@@ -0,0 +1,19 @@
+from __future__ import unicode_literals
+import contextlib
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+@contextlib.contextmanager
+def writeTransaction(using=None):
+    '''An atomic block for a transaction which reads and then writes, such as allocating a prize.
+       On lotto.backends.sqlite3 the transaction (if this is the outermost block) starts with BEGIN IMMEDIATE, so it takes the write lock
+       before it reads, and waits for another writer to finish instead of failing with "database is locked" when it comes to write.
+       Other atomic blocks start with a plain BEGIN, so readers never wait for the write lock. On other databases this is transaction.atomic.'''
+    db = connections[using or DEFAULT_DB_ALIAS]
+    immediate = hasattr(db, 'begin_mode') and not db.in_atomic_block
+    if immediate: db.begin_mode = 'IMMEDIATE'
+    try:
+        with transaction.atomic(using=db.alias):
+            if immediate: db.begin_mode = None # for this transaction only
+            yield
+    finally:
+        if immediate: db.begin_mode = None
@@ -0,0 +1,46 @@
+##############################################################################################################
+#
+# SQLite database backend tuned for concurrent readers and writers: WAL journal, memory mapping, larger cache, busy timeout,
+# and write transactions which take the write lock when they begin
+#
+##############################################################################################################
+
+from __future__ import unicode_literals
+from django.core.exceptions import ImproperlyConfigured
+from django.db.backends.sqlite3 import base
+
+# Applied in this order to each new connection; any of them can be changed with OPTIONS['pragmas'] in the database settings (or left out with None).
+# In WAL mode readers dont block the writer nor it them, and synchronous=NORMAL is still safe against corruption
+# (a commit can only be lost if the operating system crashes before the next checkpoint).
+PRAGMAS = (
+    ('busy_timeout', 5000),      # milliseconds to wait for a lock, rather than failing at once
+    ('journal_mode', 'WAL'),
+    ('synchronous', 'NORMAL'),
+    ('mmap_size', 256 * 2**20),  # read the database through a memory map of up to this many bytes
+    ('cache_size', -64 * 2**10), # page cache of 64MB (negative means KB)
+    ('temp_store', 'MEMORY'),
+)
+TRANSACTION_MODES = 'DEFERRED', 'IMMEDIATE', 'EXCLUSIVE'
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    '''The sqlite3 backend, with the PRAGMAS set on each connection. Atomic blocks start with BEGIN DEFERRED (OPTIONS['transaction_mode']),
+       so that readers never wait for the write lock, except those of lotto.backends.writeTransaction, which start with BEGIN IMMEDIATE.'''
+    begin_mode = None # set by writeTransaction for the transaction it starts
+
+    def get_connection_params(self):
+        kwargs = super(DatabaseWrapper, self).get_connection_params()
+        pragmas = dict(kwargs.pop('pragmas', {}))
+        self.pragmas = [(name, pragmas.pop(name, value)) for name, value in PRAGMAS] + sorted(pragmas.items())
+        self.transaction_mode = kwargs.pop('transaction_mode', 'DEFERRED').upper()
+        if self.transaction_mode not in TRANSACTION_MODES: 
+            raise ImproperlyConfigured("transaction_mode must be one of {}".format(', '.join(TRANSACTION_MODES)))
+        return kwargs
+
+    def get_new_connection(self, conn_params):
+        conn = super(DatabaseWrapper, self).get_new_connection(conn_params)
+        for name, value in self.pragmas:
+            if value is not None: conn.execute('PRAGMA {} = {}'.format(name, value))
+        return conn
+
+    def _start_transaction_under_autocommit(self):
+        self.cursor().execute('BEGIN {}'.format(self.begin_mode or self.transaction_mode))
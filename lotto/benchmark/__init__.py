@@ -0,0 +1,8 @@
+##############################################################################################################
+#
+# Benchmarks of the draw pipeline at production sizes, run with the benchmark management command
+#
+##############################################################################################################
+
+from __future__ import unicode_literals
+from . import data, scenarios, concurrency
@@ -0,0 +1,112 @@
+##############################################################################################################
+#
+# Concurrency benchmark: throughput of readers and writers running at the same time on a SQLite file, with each database profile
+#
+##############################################################################################################
+
+from __future__ import unicode_literals
+import contextlib, datetime, decimal, os, random, shutil, sqlite3, tempfile, threading, timeit
+from django.db import connection, connections, OperationalError
+from django.utils import timezone
+from lotto.backends import writeTransaction
+from lotto.models import Draw, Entry
+from . import data
+
+# The profiles compared: SQLite's own defaults (rollback journal, deferred transactions), and the tuned backend
+PROFILES = (
+    ('sqlite3', {'ENGINE': 'django.db.backends.sqlite3', 'OPTIONS': {}}),
+    ('tuned', {'ENGINE': 'lotto.backends.sqlite3', 'OPTIONS': {}}),
+)
+PAGE_SIZE = 50 # entries read by each reader query, as on a punter's entries page
+
+def prepare(punters, draws, seed=0):
+    '''Generate the benchmark punters, each with an entry in a draw already made (for the readers to read),
+       and the open draws for the writers to enter. Returns the ids of the punters and of the open draws.'''
+    history = data.draw(punters, seed)
+    lt = history.lotterytype
+    open_draws = list(Draw.objects.filter(lotterytype=lt, status=Draw.OPEN).exclude(pk=history.pk).values_list('pk', flat=True))
+    for i in range(len(open_draws), draws):
+        d = Draw(lotterytype=lt, drawdate=timezone.make_aware(datetime.datetime(2100, 1, 1) + datetime.timedelta(days=i)), prize=decimal.Decimal('1000.00'))
+        d.save()
+        open_draws.append(d.pk)
+    return list(data.punters(punters)), open_draws[:draws]
+
+def copyDatabase(path):
+    '''Copy the default database (which may be in memory) to a new SQLite file, with SQLite's default rollback journal'''
+    connection.ensure_connection()
+    copy = sqlite3.connect(path)
+    copy.executescript('\n'.join(connection.connection.iterdump()))
+    copy.close()
+
+@contextlib.contextmanager
+def database(alias, profile, path):
+    '''Add a database connection with the settings of the profile for the file while in the context'''
+    settings = dict(connection.settings_dict, NAME=path, **dict(PROFILES)[profile])
+    connections.databases[alias] = settings
+    connections.ensure_defaults(alias)
+    try: yield connections[alias]
+    finally: 
+        connections[alias].close()
+        del connections.databases[alias]
+
+def reader(alias, punters, stop, counts, seed):
+    '''Read a page of the entries of a random punter, until stopped'''
+    r = random.Random(seed)
+    while not stop.is_set():
+        try: 
+            list(Entry.objects.using(alias).filter(punter_id=r.choice(punters)).select_related('draw__lotterytype', 'win').order_by('-pk')[:PAGE_SIZE])
+            counts['reads'] += 1
+        except OperationalError: counts['failed_reads'] += 1
+    connections[alias].close()
+
+def writer(alias, pairs, stop, counts, seed):
+    '''Enter each punter in each draw of pairs, until stopped. Each entry is made in a transaction which first reads the draw's entries
+       (as a transaction which reads and then writes, such as making a draw, does), so it needs the write lock after it has started.'''
+    numbers = sorted(random.Random(seed).sample(range(1, data.MAX_VAL + 1), data.NUMBER_OF_NUMBERS))
+    for punter, draw in pairs:
+        if stop.is_set(): break
+        try:
+            with writeTransaction(using=alias):
+                Entry.objects.using(alias).filter(draw_id=draw).count()
+                Entry.objects.using(alias).enter(punter, draw, numbers)
+            counts['writes'] += 1
+        except OperationalError: counts['failed_writes'] += 1
+    connections[alias].close()
+
+def runProfile(profile, path, punters, draws, readers, writers, seconds, seed=0):
+    '''Run the readers and writers together for the given time on the file, with the profile's settings, and return their throughput'''
+    pairs = [(p, d) for p in punters for d in draws]
+    random.Random(seed).shuffle(pairs)
+    stop, counts = threading.Event(), [dict(reads=0, failed_reads=0, writes=0, failed_writes=0) for i in range(readers + writers)]
+    with database('concurrency_' + profile, profile, path) as db:
+        threads = [threading.Thread(target=reader, args=(db.alias, punters, stop, counts[i], seed + i)) for i in range(readers)]
+        threads += [threading.Thread(target=writer, args=(db.alias, pairs[i::writers], stop, counts[readers + i], seed + i)) for i in range(writers)]
+        start = timeit.default_timer()
+        for t in threads: t.start()
+        stop.wait(seconds)
+        stop.set()
+        for t in threads: t.join()
+        elapsed = timeit.default_timer() - start
+    result = {'profile': profile, 'readers': readers, 'writers': writers, 'seconds': elapsed}
+    for key in counts[0]: result[key] = sum(c[key] for c in counts)
+    result['reads_per_second'], result['writes_per_second'] = result['reads'] / elapsed, result['writes'] / elapsed
+    return result
+
+def run(punters=10000, draws=20, readers=4, writers=4, seconds=5, profiles=None, seed=0, log=None):
+    '''Generate the data in the default database, and run the readers and writers on a copy of it with each profile'''
+    if log: log('Generating {} punters and {} open draws'.format(punters, draws))
+    punters, draws = prepare(punters, draws, seed)
+    results, directory = [], tempfile.mkdtemp()
+    try:
+        for profile, settings in PROFILES:
+            if profiles and profile not in profiles: continue
+            path = os.path.join(directory, profile + '.sqlite3')
+            copyDatabase(path)
+            results.append(runProfile(profile, path, punters, draws, readers, writers, seconds, seed))
+            if log: log(describe(results[-1]))
+    finally: shutil.rmtree(directory)
+    return results
+
+def describe(result):
+    return ('{profile}: {reads_per_second:.0f} reads/s ({failed_reads} failed), {writes_per_second:.0f} writes/s ({failed_writes} failed), '
+            '{readers} readers and {writers} writers').format(**result)
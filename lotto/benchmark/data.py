@@ -0,0 +1,68 @@
+##############################################################################################################
+#
+# Generation of synthetic punters, draws and entries for the benchmarks
+#
+##############################################################################################################
+
+from __future__ import unicode_literals
+import datetime, decimal, random
+from django.db import transaction
+from django.contrib.auth.hashers import make_password
+from django.utils import timezone
+from lotto.models import MoreComplexLottery, Draw, Entry, Punter
+
+BATCH_SIZE = 10000 # rows inserted at a time
+NUMBER_OF_NUMBERS, MAX_VAL = 6, 49
+EMAIL = 'benchmark{}@example.com'
+
+def parseSize(size):
+    '''Convert a size such as 10000, '100k' or '10M' to a number of entries'''
+    size = str(size).strip()
+    multiplier = {'k': 1000, 'K': 1000, 'm': 1000000, 'M': 1000000}.get(size[-1:], 1)
+    return int(size.rstrip('kKmM')) * multiplier
+
+def lotteryType(size, seed=0):
+    '''The lottery type of the benchmark draw of the given size: 6 numbers from 49, with a spot prize for 3 matches'''
+    name = 'Benchmark {} ({})'.format(size, seed)
+    lt = MoreComplexLottery.objects.filter(name=name).first()
+    if lt is None:
+        lt = MoreComplexLottery(name=name, number_of_numbers=NUMBER_OF_NUMBERS, max_val=MAX_VAL, rollover=decimal.Decimal('0.00'),
+                                min_matches=3, spotprize_nummatches=3, spotprize_value=decimal.Decimal('10.00'))
+        lt.save()
+    return lt
+
+def punters(n):
+    '''Make sure there are at least n benchmark punters, and return the ids of the first n.
+       They are bulk inserted with one precomputed password hash, rather than being hashed one at a time by Punter.save.'''
+    existing = Punter.objects.filter(email__startswith='benchmark').count()
+    password = make_password('benchmark')
+    for start in range(existing, n, BATCH_SIZE):
+        with transaction.atomic():
+            Punter.objects.bulk_create([Punter(name='Benchmark {}'.format(i), email=EMAIL.format(i), password=password)
+                                        for i in range(start, min(n, start + BATCH_SIZE))])
+    return Punter.objects.filter(email__startswith='benchmark').order_by('pk').values_list('pk', flat=True)[:n]
+
+def draw(size, seed=0):
+    '''Return a draw (which has not been made) with size random entries, one for each of size punters.
+       The draw is reused if it was generated before (eg in a database kept between runs), so results can be compared between commits.'''
+    lt = lotteryType(size, seed)
+    d = Draw.objects.filter(lotterytype=lt).first()
+    if d is not None and d.entry_set.count() == size: return d
+    if d is None:
+        d = Draw(lotterytype=lt, drawdate=timezone.make_aware(datetime.datetime(2000, 1, 1)), prize=decimal.Decimal('1000000.00'))
+        d.save()
+    d.entry_set.all().delete()
+    r, batch = random.Random(seed), []
+    numbers = list(range(1, MAX_VAL + 1))
+    for p in punters(size).iterator():
+        batch.append(Entry(punter_id=p, draw=d, entry=r.sample(numbers, NUMBER_OF_NUMBERS)))
+        if len(batch) >= BATCH_SIZE:
+            with transaction.atomic(): Entry.objects.bulk_create(batch)
+            batch = []
+    if batch:
+        with transaction.atomic(): Entry.objects.bulk_create(batch)
+    return d
+
+def winningNumbers(seed=0):
+    '''The winning numbers used for the benchmark draws'''
+    return sorted(random.Random(seed).sample(range(1, MAX_VAL + 1), NUMBER_OF_NUMBERS))
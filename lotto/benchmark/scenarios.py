@@ -0,0 +1,164 @@
+##############################################################################################################
+#
+# Timed scenarios for each phase of making a draw, and the recording and comparison of their results
+#
+##############################################################################################################
+
+from __future__ import unicode_literals
+import datetime, platform, subprocess, timeit, os
+import django
+from django.conf import settings
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext, override_settings
+from lotto.models import Draw, LotteryNumberField, NumberIndex
+from lotto import matching, sharding
+from . import data
+
+try:
+    import tracemalloc
+except ImportError: # python 2, so peak memory is not recorded
+    tracemalloc = None
+
+CHUNK_SIZE, SHARDS = 10000, 4 # used for the streaming and sharded scenarios
+
+# Each scenario is set up on a draw with its winning numbers stored (but not yet resolved),
+# and returns the function to be timed. The setup is not included in the timings.
+
+def checkNumbers(draw):
+    '''LotteryType.checkNumbers for every entry'''
+    entries, lt = [list(e) for e in draw.entry_set.values_list('entry', flat=True)], draw.lotterytype
+    def run():
+        for e in entries: lt.checkNumbers(e)
+    return run
+
+def toPython(draw):
+    '''LotteryNumberField.to_python for every stored entry'''
+    entries = [e for i, e in draw._entryRows()]
+    def run():
+        for e in entries: LotteryNumberField.to_python(e)
+    return run
+
+def findWinners(engine='python', chunk_size=None, shards=None):
+    '''Finding the winners of the draw (including the streaming or sharded scan), with the given engine'''
+    def scenario(draw):
+        def run():
+            with override_settings(LOTTO_MATCH_ENGINE=engine):
+                draw.chunkSize, draw.shards = chunk_size, shards
+                if draw.streaming: draw.checkpoint = draw._streamMatches()
+                if draw.sharded: draw._matchcounts = draw._shardMatches()
+                draw.lotterytype.findWinners(draw)
+        return run
+    return scenario
+
+def buildIndex(draw):
+    '''Building the draw's inverted number index'''
+    return lambda: NumberIndex.build(draw)
+
+def findWinnersIndexed(draw):
+    '''Finding the winners from the draw's number index (built beforehand, as it is when the draw closes)'''
+    NumberIndex.build(draw)
+    return findWinners('index')(draw)
+
+def allocatePrize(draw):
+    '''Allocation of the prizes (the winners are found first, with the fastest engine available)'''
+    findWinners(fastestEngine())(draw)()
+    return lambda: draw.lotterytype.allocatePrize(draw)
+
+def makeDraw(draw):
+    '''The whole of Draw.makeDraw, with the default engine'''
+    numbers, draw.winning_combo, draw.status = draw.winning_combo, '', Draw.OPEN
+    return lambda: draw.makeDraw(*numbers)
+
+def fastestEngine(): return 'python' if matching.numpy is None else 'numpy'
+
+def needsNumpy():
+    if matching.numpy is None: return 'numpy is not installed'
+
+def needsSharedDatabase():
+    if sharding.ProcessPoolExecutor is None: return 'concurrent.futures is not available'
+    if connection.vendor == 'sqlite' and connection.is_in_memory_db(connection.settings_dict['NAME']):
+        return 'an in-memory SQLite database cant be read by the worker processes'
+    return needsNumpy()
+
+# name: (scenario, function returning why it cant be run, or None)
+SCENARIOS = [
+    ('checkNumbers', checkNumbers, None),
+    ('to_python', toPython, None),
+    ('findWinners.python', findWinners('python'), None),
+    ('findWinners.numpy', findWinners('numpy'), needsNumpy),
+    ('findWinners.streaming', findWinners(chunk_size=CHUNK_SIZE), None),
+    ('findWinners.sharded', findWinners('numpy', shards=SHARDS), needsSharedDatabase),
+    ('buildIndex', buildIndex, None),
+    ('findWinners.index', findWinnersIndexed, None),
+    ('allocatePrize', allocatePrize, None),
+    ('makeDraw', makeDraw, None),
+]
+
+def runOnce(scenario, draw, memory=False):
+    '''Run a scenario on a fresh copy of the draw, and roll back everything it changed in the database.
+       Return the time taken and the number of queries, or if memory is true the peak memory allocated instead of the number of queries
+       (the queries arent recorded then, as that would use memory too).
+       Counts above connection.queries_limit (9000 by default) cant be recorded, and are capped at that.'''
+    with transaction.atomic():
+        d = Draw.objects.get(pk=draw.pk)
+        d.winning_combo = data.winningNumbers()
+        d.save()
+        run, queries = scenario(d), CaptureQueriesContext(connection)
+        if memory: tracemalloc.start()
+        else: queries.__enter__()
+        try:
+            start = timeit.default_timer()
+            run()
+            seconds = timeit.default_timer() - start
+            used = tracemalloc.get_traced_memory()[1] if memory else None
+        finally:
+            if memory: tracemalloc.stop()
+            else: queries.__exit__(None, None, None)
+        transaction.set_rollback(True)
+    return seconds, used if memory else len(queries)
+
+def run(sizes, names=None, repeat=1, memory=True, seed=0, log=None):
+    '''Generate a draw of each size, run the scenarios on it, and return the results.
+       Each scenario is timed repeat times (counting the queries), and then run once more under tracemalloc to find its peak memory.
+       (Queries run by the worker processes of the sharded scenario are not counted.)'''
+    results = {'environment': environment(), 'results': []}
+    for size in sizes:
+        if log: log('Generating a draw with {} entries'.format(size))
+        draw = data.draw(size, seed)
+        for name, scenario, skip in SCENARIOS:
+            if names and name not in names: continue
+            result = {'scenario': name, 'size': size}
+            reason = skip() if skip else None
+            if reason: result['skipped'] = reason
+            else:
+                timings = [runOnce(scenario, draw) for i in range(repeat)]
+                result['seconds'], result['queries'], result['timings'] = min(t for t, q in timings), timings[0][1], [t for t, q in timings]
+                result['peak_memory'] = runOnce(scenario, draw, memory=True)[1] if memory and tracemalloc else None
+            if log: log(describe(result))
+            results['results'].append(result)
+    return results
+
+def environment():
+    '''Details of what the benchmarks were run on, so that results can be compared'''
+    return {'commit': commit(), 'date': datetime.datetime.utcnow().isoformat(), 'python': platform.python_version(),
+            'django': django.get_version(), 'numpy': matching.numpy.__version__ if matching.numpy else None,
+            'database': connection.vendor, 'engine': getattr(settings, 'LOTTO_MATCH_ENGINE', 'python'), 'platform': platform.platform()}
+
+def commit():
+    '''The git commit of the code being benchmarked, if it is in a git checkout'''
+    try: return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(__file__), stderr=subprocess.STDOUT).decode().strip()
+    except (OSError, subprocess.CalledProcessError): return None
+
+def describe(result):
+    if 'skipped' in result: return '{scenario} ({size}): skipped, {skipped}'.format(**result)
+    memory = '' if result.get('peak_memory') is None else ', peak memory {:.1f}MB'.format(result['peak_memory'] / 1e6)
+    return '{} ({}): {:.3f}s, {} queries{}'.format(result['scenario'], result['size'], result['seconds'], result['queries'], memory)
+
+def compare(old, new):
+    '''Yield a line comparing each result in new with the same scenario and size in old'''
+    before = dict(((r['scenario'], r['size']), r) for r in old['results'] if 'seconds' in r)
+    for r in new['results']:
+        b = before.get((r['scenario'], r['size']))
+        if 'seconds' not in r or b is None: continue
+        yield '{} ({}): {:.3f}s -> {:.3f}s ({:+.0%}), {} -> {} queries'.format(r['scenario'], r['size'], b['seconds'], r['seconds'],
+                                                                        r['seconds'] / b['seconds'] - 1 if b['seconds'] else 0, b['queries'], r['queries'])
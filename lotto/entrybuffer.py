@@ -0,0 +1,136 @@
+##############################################################################################################
+#
+# Write-behind buffer for entries: accepted entries are queued in a separate SQLite file, and flushed to Entry in batches
+#
+##############################################################################################################
+
+from __future__ import unicode_literals
+import contextlib, logging, sqlite3, threading
+from django.conf import settings
+from django.db import IntegrityError
+from .backends import writeTransaction
+from django.utils import timezone, dateparse
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS queued (id INTEGER PRIMARY KEY AUTOINCREMENT, punter INTEGER NOT NULL, draw INTEGER NOT NULL, entry TEXT NOT NULL,
+                                   time TEXT NOT NULL, UNIQUE (punter, draw));
+CREATE INDEX IF NOT EXISTS queued_draw ON queued (draw);
+CREATE TABLE IF NOT EXISTS rejected (id INTEGER PRIMARY KEY, punter INTEGER NOT NULL, draw INTEGER NOT NULL, entry TEXT NOT NULL,
+                                     time TEXT NOT NULL, reason TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS closed (draw INTEGER PRIMARY KEY);
+'''
+DUPLICATE_ENTRY, DRAW_CLOSED = 'duplicate_entry', 'draw_closed' # reasons for rejecting an entry when it is flushed
+
+class DrawClosed(Exception):
+    '''Raised when an entry is queued for a draw which is being made'''
+
+class EntryBuffer(object):
+    '''A durable queue of accepted entries in its own SQLite file (in WAL mode, with every commit synced to disk),
+       so that accepting an entry doesnt wait for the lock on the main database.
+       A punter can only have one entry for each draw in the queue, and no entries can be queued for a draw once it has been closed.'''
+    def __init__(self, path):
+        self.path, self.local = path, threading.local()
+
+    @property
+    def db(self):
+        '''A connection to the queue for this thread (sqlite3 connections cant be shared between threads)'''
+        if getattr(self.local, 'db', None) is None:
+            db = sqlite3.connect(self.path, timeout=30, isolation_level=None) # autocommit, so each statement is its own transaction
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=FULL')
+            db.executescript(SCHEMA)
+            self.local.db = db
+        return self.local.db
+
+    @contextlib.contextmanager
+    def transaction(self):
+        '''A transaction on the queue, which holds its write lock from the start'''
+        db = self.db
+        db.execute('BEGIN IMMEDIATE')
+        try: yield db
+        except:
+            db.execute('ROLLBACK')
+            raise
+        db.execute('COMMIT')
+
+    def add(self, punter_id, draw_id, numbers):
+        '''Queue an entry, and return its ticket number. Raises IntegrityError if the punter already has an entry for the draw in the queue,
+           or DrawClosed if the draw has been closed (the check and the insert are made holding the queue's write lock, so an entry is either
+           queued before the draw is closed, and flushed by it, or refused).'''
+        try:
+            with self.transaction() as db:
+                if db.execute('SELECT 1 FROM closed WHERE draw = ?', (draw_id,)).fetchone(): raise DrawClosed("Draw {} is closed".format(draw_id))
+                return db.execute('INSERT INTO queued (punter, draw, entry, time) VALUES (?, ?, ?, ?)', 
+                                  (punter_id, draw_id, ','.join(str(n) for n in sorted(numbers)), timezone.now().isoformat())).lastrowid
+        except sqlite3.IntegrityError as e: raise IntegrityError(str(e))
+
+    def close(self, draw_id):
+        '''Stop any more entries being queued for the draw'''
+        self.db.execute('INSERT OR IGNORE INTO closed (draw) VALUES (?)', (draw_id,))
+
+    def reopen(self, draw_id):
+        self.db.execute('DELETE FROM closed WHERE draw = ?', (draw_id,))
+
+    def pending(self, draw_id=None):
+        '''The number of entries waiting to be flushed (for the given draw, or for all draws)'''
+        if draw_id is None: return self.db.execute('SELECT COUNT(*) FROM queued').fetchone()[0]
+        return self.db.execute('SELECT COUNT(*) FROM queued WHERE draw = ?', (draw_id,)).fetchone()[0]
+
+    def take(self, limit, draw_id=None):
+        '''Return the oldest entries in the queue (for the given draw, or for all draws), as (ticket, punter, draw, entry, time) tuples
+           (they stay queued until removed)'''
+        if draw_id is None: return self.db.execute('SELECT id, punter, draw, entry, time FROM queued ORDER BY id LIMIT ?', (limit,)).fetchall()
+        return self.db.execute('SELECT id, punter, draw, entry, time FROM queued WHERE draw = ? ORDER BY id LIMIT ?', (draw_id, limit)).fetchall()
+
+    def remove(self, rows, rejected=()):
+        '''Remove flushed entries from the queue, recording those which were rejected (as (row, reason) pairs)'''
+        with self.transaction() as db:
+            db.executemany('INSERT OR IGNORE INTO rejected (id, punter, draw, entry, time, reason) VALUES (?, ?, ?, ?, ?, ?)', [tuple(r) + (reason,) for r, reason in rejected])
+            db.executemany('DELETE FROM queued WHERE id = ?', [(r[0],) for r in rows])
+
+    def rejected(self):
+        return self.db.execute('SELECT id, punter, draw, entry, time, reason FROM rejected ORDER BY id').fetchall()
+
+_buffers = {}
+def entryBuffer():
+    '''The entry buffer given by settings.LOTTO_ENTRY_BUFFER (the path of its file), or None if entries are written directly'''
+    path = getattr(settings, 'LOTTO_ENTRY_BUFFER', None)
+    if not path: return None
+    if path not in _buffers: _buffers[path] = EntryBuffer(path)
+    return _buffers[path]
+
+def closeDraw(buffer, draw_id):
+    '''Stop entries being queued for a draw which is about to be made, and flush those already queued for it (while it is still open)'''
+    buffer.close(draw_id)
+    flush(buffer, draw_id=draw_id)
+
+def alreadyFlushed(row):
+    '''True if the queued entry is already in the database, with the same numbers and the time it was accepted
+       (because it was flushed, but the flush stopped before removing it from the queue, or another flush took it at the same time)'''
+    from .models import Entry
+    ticket, punter, draw, entry, time = row
+    existing = Entry.objects.filter(punter_id=punter, draw_id=draw).values_list('time', 'entry').first()
+    return existing is not None and existing[0] == dateparse.parse_datetime(time) and ','.join(str(n) for n in existing[1]) == entry
+
+def flush(buffer, batch_size=500, draw_id=None):
+    '''Move the entries in the buffer (for the given draw, or for all draws) to the database, a batch at a time, each batch in one transaction.
+       The entries keep the time they were accepted. Those which cant be entered (because the punter has entered the draw since,
+       or the draw has been made) are recorded as rejected, unless they were entered by an earlier flush. 
+       Returns the number of entries flushed and rejected.'''
+    from .models import Entry
+    flushed = rejected = 0
+    while True:
+        rows = buffer.take(batch_size, draw_id)
+        if not rows: return flushed, rejected
+        failed = []
+        with writeTransaction():
+            for row in rows:
+                ticket, punter, draw, entry, time = row
+                try: reason = None if Entry.objects.enter(punter, draw, [int(n) for n in entry.split(',')], time=dateparse.parse_datetime(time)) else DRAW_CLOSED
+                except IntegrityError: reason = DUPLICATE_ENTRY
+                if reason and not alreadyFlushed(row): failed.append((row, reason))
+        buffer.remove(rows, failed)
+        for row, reason in failed: logger.warning("Entry {} for punter {} in draw {} rejected: {}".format(row[0], row[1], row[2], reason))
+        flushed, rejected = flushed + len(rows) - len(failed), rejected + len(failed)
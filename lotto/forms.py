@@ -1,17 +1,86 @@
+from django import forms
+from django.db import IntegrityError
 from django.forms import ModelForm
 from django.forms.widgets import PasswordInput
 from .models import *
+from .entrybuffer import entryBuffer, DrawClosed
 
 class PunterForm(ModelForm):
+    def save(self, commit=True):
+        punter = super(PunterForm, self).save(commit=False)
+        punter.setPassword(self.cleaned_data['password'])
+        if commit: punter.save()
+        return punter
     class Meta:
         model = Punter
         widgets = {'password': PasswordInput}
         exclude = []
 
-class EntryForm(ModelForm):
-    class Meta:
-        model = Entry
-        exclude = []
+class OpenDrawChoiceField(forms.ChoiceField):
+    '''Choice of one of the given draws, which cleans to the draw itself (so the choices dont need a queryset, and can be cached)'''
+    def __init__(self, draws=(), **kwargs):
+        self.draws = dict((str(d.pk), d) for d in draws)
+        super(OpenDrawChoiceField, self).__init__(choices=[('', '---------')] + [(d.pk, str(d)) for d in draws], **kwargs)
+    def clean(self, value):
+        value = super(OpenDrawChoiceField, self).clean(value)
+        return self.draws[value] if value else None
+
+class EntryForm(forms.Form):
+    '''Entry by a punter in one of the open draws (from the cached Draw.openDraws).
+       The numbers are checked once, against the cached lottery type of the draw, and save inserts the entry in a single statement
+       (see EntryQuerySet.enter), relying on the database to reject a duplicate entry rather than querying for one first.'''
+    draw = OpenDrawChoiceField()
+    entry = forms.CharField(max_length=30)
+
+    def __init__(self, *args, **kwargs):
+        self.punter = kwargs.pop('punter')
+        super(EntryForm, self).__init__(*args, **kwargs)
+        self.draws = Draw.openDraws()
+        self.fields['draw'] = OpenDrawChoiceField(self.draws, label='Draw')
+        if not self.is_bound: self.hideEntered()
+
+    def hideEntered(self):
+        '''Remove the draws which the punter has already entered from the choices (one lookup on the unique (punter, draw) index)'''
+        entered = set(Entry.objects.filter(punter=self.punter, draw__in=[d.pk for d in self.draws]).values_list('draw', flat=True))
+        self.fields['draw'] = OpenDrawChoiceField([d for d in self.draws if d.pk not in entered], label='Draw')
+
+    def clean_entry(self):
+        try: return [int(i) for i in LotteryNumberField.to_python(self.cleaned_data['entry'].replace(' ', ''))]
+        except ValueError: raise forms.ValidationError("Enter whole numbers separated by commas")
+
+    def clean(self):
+        cleaned_data = super(EntryForm, self).clean()
+        if cleaned_data.get('draw') and 'entry' in cleaned_data:
+            try: cleaned_data['draw'].lotterytype.checkNumbers(cleaned_data['entry'])
+            except ValueError as e: self.add_error('entry', str(e))
+        return cleaned_data
+
+    def save(self):
+        '''Insert the entry, and return it (or None, with the reason added to the form's errors, if it cant be made).
+           With an entry buffer (settings.LOTTO_ENTRY_BUFFER) the entry is queued instead, and the unsaved entry returned has its ticket number.'''
+        buffer = entryBuffer()
+        if buffer: return self.queue(buffer)
+        try: entry = Entry.objects.enter(self.punter, self.cleaned_data['draw'].pk, self.cleaned_data['entry'])
+        except IntegrityError: 
+            self.add_error('draw', "You have already entered this draw")
+            return None
+        if entry is None: self.add_error('draw', "This draw is no longer open")
+        return entry
+
+    def queue(self, buffer):
+        draw, numbers = self.cleaned_data['draw'], self.cleaned_data['entry']
+        try: 
+            if Entry.objects.filter(punter=self.punter, draw=draw).exists(): raise IntegrityError
+            ticket = buffer.add(self.punter, draw.pk, numbers)
+        except IntegrityError: 
+            self.add_error('draw', "You have already entered this draw")
+            return None
+        except DrawClosed:
+            self.add_error('draw', "This draw is no longer open")
+            return None
+        entry = Entry(punter_id=self.punter, draw=draw, entry=numbers)
+        entry.ticket = ticket
+        return entry
 
 class SigninForm(ModelForm):
     class Meta:
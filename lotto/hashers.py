@@ -0,0 +1,14 @@
+##############################################################################################################
+#
+# A cheap password hasher, for the 'fast' LOTTO_PASSWORD_PROFILE used by the tests (see settings)
+#
+##############################################################################################################
+
+from __future__ import unicode_literals
+from django.contrib.auth.hashers import PBKDF2PasswordHasher
+
+class FastPBKDF2PasswordHasher(PBKDF2PasswordHasher):
+    '''PBKDF2 with few iterations, for the tests.
+       It has its own algorithm name, so the secure profile (which doesnt list it) wont accept a password hashed with it.'''
+    algorithm = 'pbkdf2_sha256_fast'
+    iterations = 1000
@@ -0,0 +1,37 @@
+from __future__ import unicode_literals
+import io, json
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from lotto.benchmark import data, scenarios
+
+class Command(BaseCommand):
+    help = '''Benchmark each phase of making a draw, on synthetic draws of the given numbers of entries.
+              The benchmarks are run in a separate test database, and the results (time, queries and peak memory of each scenario) written as json.'''
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='10k', help="numbers of entries in the draws, separated by commas (eg 10k,100k,1M,10M)")
+        parser.add_argument('--scenario', action='append', dest='scenarios', choices=[name for name, s, skip in scenarios.SCENARIOS],
+                            help="scenario to run (may be repeated; by default all of them are run)")
+        parser.add_argument('--repeat', type=int, default=1, help="number of times each scenario is timed (the fastest is recorded)")
+        parser.add_argument('--no-memory', action='store_false', dest='memory', help="dont run each scenario again to record its peak memory")
+        parser.add_argument('--seed', type=int, default=0, help="seed for the random entries")
+        parser.add_argument('--output', help="file to write the results to (default: benchmark-<commit>.json)")
+        parser.add_argument('--compare', help="results file from an earlier run to compare the results with")
+        parser.add_argument('--db', help="SQLite file to use as the test database, which is kept so that the generated draws are reused by later runs")
+
+    def handle(self, *args, **options):
+        try: sizes = [data.parseSize(s) for s in options['sizes'].split(',')]
+        except ValueError: raise CommandError("Invalid sizes {}".format(options['sizes']))
+        if options['db']:
+            if connection.vendor != 'sqlite': raise CommandError("--db can only be used with a SQLite database")
+            connection.settings_dict.setdefault('TEST', {})['NAME'] = options['db']
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, keepdb=bool(options['db']))
+        try: results = scenarios.run(sizes, options['scenarios'], options['repeat'], options['memory'], options['seed'], log=self.stdout.write)
+        finally: connection.creation.destroy_test_db(old_name, verbosity=0, keepdb=bool(options['db']))
+        output = options['output'] or 'benchmark-{}.json'.format((results['environment']['commit'] or 'results')[:7])
+        with io.open(output, 'w') as f: f.write(json.dumps(results, indent=1, sort_keys=True))
+        self.stdout.write('Results written to {}'.format(output))
+        if options['compare']:
+            with io.open(options['compare']) as f: old = json.load(f)
+            for line in scenarios.compare(old, results): self.stdout.write(line)
@@ -0,0 +1,36 @@
+from __future__ import unicode_literals
+import io, json
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from lotto.benchmark import concurrency, data, scenarios
+
+class Command(BaseCommand):
+    help = '''Benchmark the throughput of readers and writers running at the same time on a SQLite database, with SQLite's default settings
+              and with the tuned backend (lotto.backends.sqlite3). The data is generated in a separate test database,
+              and copied to a file for each profile. The results are written as json.'''
+
+    def add_arguments(self, parser):
+        parser.add_argument('--punters', default='10k', help="number of punters (each with an entry for the readers to read)")
+        parser.add_argument('--draws', type=int, default=20, help="number of open draws for the writers to enter")
+        parser.add_argument('--readers', type=int, default=4, help="number of reader threads")
+        parser.add_argument('--writers', type=int, default=4, help="number of writer threads")
+        parser.add_argument('--seconds', type=float, default=5, help="how long the readers and writers run with each profile")
+        parser.add_argument('--profile', action='append', dest='profiles', choices=[name for name, settings in concurrency.PROFILES],
+                            help="profile to run (may be repeated; by default all of them are run)")
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help="file to write the results to (default: concurrency-<commit>.json)")
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite': raise CommandError("The concurrency benchmark is for SQLite databases")
+        try: punters = data.parseSize(options['punters'])
+        except ValueError: raise CommandError("Invalid number of punters {}".format(options['punters']))
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try: 
+            results = {'environment': scenarios.environment(), 
+                       'results': concurrency.run(punters, options['draws'], options['readers'], options['writers'], options['seconds'],
+                                                  options['profiles'], options['seed'], log=self.stdout.write)}
+        finally: connection.creation.destroy_test_db(old_name, verbosity=0)
+        output = options['output'] or 'concurrency-{}.json'.format((results['environment']['commit'] or 'results')[:7])
+        with io.open(output, 'w') as f: f.write(json.dumps(results, indent=1, sort_keys=True))
+        self.stdout.write('Results written to {}'.format(output))
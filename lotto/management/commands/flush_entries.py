@@ -0,0 +1,21 @@
+from __future__ import unicode_literals
+import time
+from django.core.management.base import BaseCommand, CommandError
+from lotto.entrybuffer import entryBuffer, flush
+
+class Command(BaseCommand):
+    help = '''Flush the entries queued in the entry buffer (settings.LOTTO_ENTRY_BUFFER) to the database, in batches.
+              With --interval it keeps running as the background worker, flushing the buffer every interval seconds.'''
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help="number of entries inserted in each transaction")
+        parser.add_argument('--interval', type=float, help="keep running, flushing the buffer every this many seconds")
+
+    def handle(self, *args, **options):
+        buffer = entryBuffer()
+        if buffer is None: raise CommandError("There is no entry buffer (set LOTTO_ENTRY_BUFFER)")
+        while True:
+            flushed, rejected = flush(buffer, options['batch_size'])
+            if flushed or rejected or not options['interval']: self.stdout.write('{} entries flushed, {} rejected'.format(flushed, rejected))
+            if not options['interval']: return
+            time.sleep(options['interval'])
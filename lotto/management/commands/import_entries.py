@@ -0,0 +1,111 @@
+from __future__ import unicode_literals
+import csv, io, json, sys
+import six
+from django.core.management.base import BaseCommand
+from django.db import transaction, IntegrityError
+from lotto.models import Draw, Entry, LotteryNumberField, Punter
+
+# reason codes written to the reject file
+NOT_A_NUMBER, WRONG_COUNT, OUT_OF_RANGE, DUPLICATE_NUMBER = 'not_a_number', 'wrong_count', 'out_of_range', 'duplicate_number'
+UNKNOWN_PUNTER, UNKNOWN_DRAW, DRAW_MADE, DUPLICATE_ENTRY, BAD_ROW = 'unknown_punter', 'unknown_draw', 'draw_made', 'duplicate_entry', 'bad_row'
+CHECK_ERRORS = {"Incorrect number of numbers": WRONG_COUNT, "Number out of range": OUT_OF_RANGE, "Duplicate Value": DUPLICATE_NUMBER}
+
+def openFile(path, mode, fmt):
+    '''Open a file in the mode the csv module needs (binary under python 2)'''
+    if fmt == 'csv': return open(path, mode + 'b') if six.PY2 else io.open(path, mode, newline='')
+    return io.open(path, mode)
+
+def readCsv(f):
+    '''Yield a record for each row of a csv file with a header row of punter,draw,entry'''
+    for row in csv.DictReader(f): yield row
+
+def readJsonl(f):
+    '''Yield a record for each line of a file with a json object on each line'''
+    for line in f:
+        if not line.strip(): continue
+        try: yield json.loads(line)
+        except ValueError: yield None
+
+def parseNumbers(value):
+    '''Convert the entry from a record to a list of ints, accepting a list or a string separated by commas, spaces or dashes'''
+    if isinstance(value, (list, tuple)): return [int(i) for i in value]
+    return [int(i) for i in LotteryNumberField.to_python(str(value).replace(' ', ',').replace('-', ','))]
+
+class Command(BaseCommand):
+    help = '''Import entries from a retail or agent sales feed (csv with a punter,draw,entry header, or jsonl), in batches.
+              Rows which cant be entered are written to a reject file with a reason code.'''
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="file to import, or - for standard input")
+        parser.add_argument('--format', choices=('csv', 'jsonl'), help="format of the file (by default taken from its extension)")
+        parser.add_argument('--rejects', help="file to write the rejected rows to (default: the input path with .rejects.csv added)")
+        parser.add_argument('--batch-size', type=int, default=500, help="number of rows checked and inserted together")
+
+    def handle(self, *args, **options):
+        path, fmt = options['path'], options['format'] or ('jsonl' if options['path'].endswith(('.jsonl', '.json')) else 'csv')
+        rejects = options['rejects'] or ('rejects.csv' if path == '-' else path + '.rejects.csv')
+        self.draws, self.imported, self.rejected = {}, 0, 0
+        f = sys.stdin if path == '-' else openFile(path, 'r', fmt)
+        try:
+            with openFile(rejects, 'w', 'csv') as r:
+                self.rejects = csv.writer(r)
+                self.rejects.writerow(['row', 'reason', 'punter', 'draw', 'entry'])
+                batch = []
+                for n, record in enumerate(readCsv(f) if fmt == 'csv' else readJsonl(f), 1):
+                    batch.append((n, record))
+                    if len(batch) >= options['batch_size']:
+                        self.importBatch(batch)
+                        batch = []
+                if batch: self.importBatch(batch)
+        finally:
+            if f is not sys.stdin: f.close()
+        self.stdout.write('Imported {} entries, rejected {} (see {})'.format(self.imported, self.rejected, rejects))
+
+    def reject(self, n, reason, record):
+        record = record if isinstance(record, dict) else {}
+        self.batchRejects.append([n, reason] + [record.get(k, '') for k in ('punter', 'draw', 'entry')])
+
+    def lotteryTypes(self, draw_ids):
+        '''Return the lottery type of each of the draws which are still open, loading any not seen before in one query'''
+        new = set(draw_ids) - set(self.draws)
+        if new:
+            for d in Draw.objects.filter(pk__in=new).select_related('lotterytype'): self.draws[d.pk] = None if d.status == Draw.DRAWN else d.lotterytype
+            for d in new - set(self.draws): self.draws[d] = False # unknown draw
+        return self.draws
+
+    def importBatch(self, batch):
+        '''Check a batch of rows, and insert the valid ones in one bulk insert'''
+        rows, self.batchRejects = [], []
+        for n, record in batch:
+            try: rows.append((n, record, int(record['punter']), int(record['draw']), parseNumbers(record['entry'])))
+            except (KeyError, TypeError): self.reject(n, BAD_ROW, record)
+            except ValueError: self.reject(n, NOT_A_NUMBER, record)
+        draws = self.lotteryTypes(r[3] for r in rows)
+        punters = set(Punter.objects.filter(pk__in=set(r[2] for r in rows)).values_list('pk', flat=True))
+        existing = set()
+        for draw in set(r[3] for r in rows):
+            existing.update(Entry.objects.filter(draw=draw, punter__in=set(r[2] for r in rows if r[3] == draw)).values_list('punter', 'draw'))
+        entries = []
+        for n, record, punter, draw, numbers in rows:
+            if draws[draw] is False: self.reject(n, UNKNOWN_DRAW, record)
+            elif draws[draw] is None: self.reject(n, DRAW_MADE, record)
+            elif punter not in punters: self.reject(n, UNKNOWN_PUNTER, record)
+            elif (punter, draw) in existing: self.reject(n, DUPLICATE_ENTRY, record)
+            else:
+                try: draws[draw].checkNumbers(numbers)
+                except ValueError as e:
+                    self.reject(n, CHECK_ERRORS.get(str(e), NOT_A_NUMBER), record)
+                    continue
+                existing.add((punter, draw)) # the same punter and draw later in the batch is a duplicate
+                entries.append((n, record, Entry(punter_id=punter, draw_id=draw, entry=numbers)))
+        try:
+            with transaction.atomic(): Entry.objects.bulk_create([e for n, record, e in entries])
+            self.imported += len(entries)
+        except IntegrityError: # another process has entered some of them since they were checked, so insert them one at a time
+            for n, record, e in entries:
+                try:
+                    with transaction.atomic(): Entry.objects.bulk_create([e])
+                    self.imported += 1
+                except IntegrityError: self.reject(n, DUPLICATE_ENTRY, record)
+        self.rejects.writerows(sorted(self.batchRejects))
+        self.rejected += len(self.batchRejects)
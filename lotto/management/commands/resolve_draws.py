@@ -0,0 +1,43 @@
+from __future__ import unicode_literals
+import csv, io, json, timeit
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import dateparse, timezone
+from lotto import resolution
+from lotto.models import LotteryNumberField
+
+class Command(BaseCommand):
+    help = '''Make every open draw whose draw date has passed, the draws of different lottery types at the same time, and those of each type
+              one after another in draw date order (as each passes its rollover to the next). The winning numbers are drawn at random,
+              unless a results file is given, when a due draw missing from it fails (and the later draws of its type are not made). A line is written for each draw with the time each step took.'''
+
+    def add_arguments(self, parser):
+        parser.add_argument('--now', help="make the draws due at this date and time (default: now)")
+        parser.add_argument('--results', help="csv file with a draw,numbers header, giving the winning numbers of some draws")
+        parser.add_argument('--workers', type=int, help="number of lottery types whose draws are made at the same time (default: all of them)")
+        parser.add_argument('--chunk-size', type=int, help="make the draws in streaming mode, reading this many entries at a time")
+        parser.add_argument('--dry-run', action='store_true', help="list the draws which are due, without making them")
+        parser.add_argument('--output', help="file to write the results to as json")
+
+    def handle(self, *args, **options):
+        now = options['now'] and dateparse.parse_datetime(options['now'])
+        if options['now'] and now is None: raise CommandError("Invalid date and time {}".format(options['now']))
+        if now and timezone.is_naive(now): now = timezone.make_aware(now)
+        if options['dry_run']:
+            for lt, draws in resolution.dueDraws(now):
+                for d in draws: self.stdout.write('Draw {} ({}): {}'.format(d.pk, d.drawdate.isoformat(), lt))
+            return
+        numbers = self.readResults(options['results']) if options['results'] else None
+        start = timeit.default_timer()
+        results = resolution.resolveDue(now, numbers, options['workers'], log=self.stdout.write,
+                                        **({'chunk_size': options['chunk_size']} if options['chunk_size'] else {}))
+        failed = len([r for r in results if 'error' in r])
+        self.stdout.write('{} draws made, {} failed, in {:.3f}s'.format(len(results) - failed, failed, timeit.default_timer() - start))
+        if options['output']:
+            with io.open(options['output'], 'w') as f: f.write(json.dumps(results, indent=1, sort_keys=True))
+        if failed: raise CommandError("{} draws failed".format(failed))
+
+    def readResults(self, path):
+        try:
+            with io.open(path, newline='') as f: 
+                return dict((int(row['draw']), [int(n) for n in LotteryNumberField.to_python(row['numbers'].replace(' ', ''))]) for row in csv.DictReader(f))
+        except (KeyError, ValueError) as e: raise CommandError("Invalid results file: {}".format(e))
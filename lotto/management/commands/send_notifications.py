@@ -0,0 +1,21 @@
+from __future__ import unicode_literals
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from lotto.notifications import send
+
+class Command(BaseCommand):
+    help = '''Send the win notifications queued when draws are made, in batches over one connection of the email backend,
+              retrying those which fail. With --interval it keeps running as the background worker, sending every interval seconds.'''
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100, help="number of notifications read and marked sent at a time")
+        parser.add_argument('--rate', type=float, default=getattr(settings, 'LOTTO_NOTIFICATION_RATE', None), help="most messages sent a second")
+        parser.add_argument('--interval', type=float, help="keep running, sending the notifications which are due every this many seconds")
+
+    def handle(self, *args, **options):
+        while True:
+            sent, failed = send(options['batch_size'], options['rate'])
+            if sent or failed or not options['interval']: self.stdout.write('{} notifications sent, {} failed'.format(sent, failed))
+            if not options['interval']: return
+            time.sleep(options['interval'])
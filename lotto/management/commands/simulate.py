@@ -0,0 +1,31 @@
+from __future__ import unicode_literals
+import io, json
+from django.core.management.base import BaseCommand, CommandError
+from lotto import matching, simulation
+from lotto.models import Draw
+
+class Command(BaseCommand):
+    help = '''Simulate a draw with random winning combinations, using its real entries and its lottery type's prize rules (or changed ones),
+              and report how often the prize rolls over and the distribution of the amount paid out.'''
+
+    def add_arguments(self, parser):
+        parser.add_argument('draw', type=int, help="id of the draw whose entries are used")
+        parser.add_argument('--draws', type=int, default=10000, help="number of draws to simulate")
+        parser.add_argument('--batch-size', type=int, help="number of draws simulated together (by default as many as fit in about 64MB)")
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--prize', type=float, help="prize of the draw (default: its actual prize)")
+        parser.add_argument('--rollover', type=float, help="rollover paid out with the main prize (default: the lottery type's rollover)")
+        parser.add_argument('--min-matches', type=int)
+        parser.add_argument('--spotprize-matches', type=int, dest='spotprize_nummatches')
+        parser.add_argument('--spotprize-value', type=float)
+        parser.add_argument('--output', help="file to write the results to as json")
+
+    def handle(self, *args, **options):
+        if matching.numpy is None: raise CommandError("numpy is needed to simulate draws")
+        try: draw = Draw.objects.select_related('lotterytype').get(pk=options['draw'])
+        except Draw.DoesNotExist: raise CommandError("There is no draw {}".format(options['draw']))
+        changes = dict((k, options[k]) for k in ('prize', 'rollover', 'min_matches', 'spotprize_nummatches', 'spotprize_value'))
+        result = simulation.simulate(draw, options['draws'], options['seed'], options['batch_size'], **changes)
+        for line in simulation.describe(result): self.stdout.write(line)
+        if options['output']:
+            with io.open(options['output'], 'w') as f: f.write(json.dumps(result, indent=1, sort_keys=True))
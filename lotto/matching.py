@@ -0,0 +1,107 @@
+##############################################################################################################
+#
+# Vectorised counting of matches between the entries of a draw and its winning combination
+#
+##############################################################################################################
+
+from __future__ import unicode_literals
+
+try:
+    import numpy
+except ImportError: # numpy is optional, without it draws are made with the plain python engine
+    numpy = None
+
+class MatchCounts(object):
+    '''The number of matches for every entry in a draw, held as two parallel arrays of entry ids and match counts.
+       (If only some of the entries are held, maxMatches and hist give the highest number of matches and the histogram over all of them.)'''
+    def __init__(self, ids, counts, maxMatches=None, hist=None):
+        self.ids, self.counts, self.maxMatches, self.hist = ids, counts, maxMatches, hist
+    def __len__(self): return len(self.ids)
+
+    def histogram(self, number_of_numbers=0):
+        '''Return a list of the number of entries with each number of matches, from 0 to at least number_of_numbers'''
+        hist = self.hist if self.hist is not None else numpy.bincount(self.counts).tolist()
+        return padHistogram(hist, number_of_numbers)
+
+    def max(self):
+        '''The highest number of matches achieved by any entry (0 if there are no entries)'''
+        if self.maxMatches is not None: return self.maxMatches
+        return int(self.counts.max()) if len(self.counts) else 0
+
+    def idsWith(self, n):
+        '''The ids of the entries with exactly n matches'''
+        return self.ids[self.counts == n]
+
+    def idsWithAtLeast(self, n):
+        '''The ids of the entries with n or more matches'''
+        return self.ids[self.counts >= n]
+
+    def candidates(self, best, min_matches, keep=None):
+        '''Return just the entries which could win a prize if best is the highest number of matches in the draw:
+           those with best matches (if that is at least min_matches), and those with at least keep matches'''
+        wanted = self.counts == best if best >= min_matches else numpy.zeros(len(self.counts), dtype=bool)
+        if keep is not None: wanted |= self.counts >= keep
+        return MatchCounts(self.ids[wanted], self.counts[wanted], best, self.histogram())
+
+def parseEntries(entries, number_of_numbers):
+    '''Convert a list of stored entry strings (eg '1,5,23') to a matrix with one row per entry.
+       Rows with the wrong number of numbers are padded with zeros (which never match) or truncated.
+       (They are all parsed at once if every row has the right number of commas, so that no numbers can be carried into the next row,
+       and otherwise, or if any number is missing, row by row.)'''
+    if not entries: return numpy.zeros((0, number_of_numbers), dtype=numpy.int64)
+    if all(e.count(',') == number_of_numbers - 1 for e in entries):
+        try: return numpy.array(','.join(entries).split(','), dtype=numpy.int64).reshape(len(entries), number_of_numbers)
+        except ValueError: pass # an empty number, eg '1,,3'
+    matrix = numpy.zeros((len(entries), number_of_numbers), dtype=numpy.int64)
+    for row, e in enumerate(entries):
+        numbers = [int(i) for i in e.split(',') if i][:number_of_numbers]
+        matrix[row, :len(numbers)] = numbers
+    return matrix
+
+def countMatches(rows, winning_combo, number_of_numbers, max_val):
+    '''Count the matches with winning_combo for every (id, entry) pair in rows, in one batched step.
+       The entries are loaded into a matrix, and each number is looked up in a table of the winning numbers.'''
+    if numpy is None: raise ImportError('numpy is required to count matches with the vectorised engine')
+    ids, entries = [], []
+    for i, e in rows:
+        ids.append(i)
+        entries.append(e)
+    matrix = parseEntries(entries, number_of_numbers)
+    size = max([max_val] + list(winning_combo) + ([int(matrix.max())] if matrix.size else []))
+    winning = numpy.zeros(size + 1, dtype=bool)
+    winning[list(winning_combo)] = True
+    winning[0] = False # padding never matches
+    return MatchCounts(numpy.array(ids, dtype=numpy.int64), winning[matrix].sum(axis=1))
+
+def iterMatches(rows, winning_combo):
+    '''Yield (id, matches) for every (id, entry) pair in rows, without numpy.
+       The stored entry strings are compared number by number with the winning numbers as strings, so they need not be converted to ints.'''
+    winning = set(str(n) for n in winning_combo)
+    for i, e in rows: yield i, sum(1 for n in e.split(',') if n in winning)
+
+def mergeCandidates(results, min_matches, keep=None):
+    '''Merge the (max matches, candidates) pairs found for separate parts of a draw into the candidates for the whole draw'''
+    best = max([0] + [m for m, c in results])
+    if not results: return MatchCounts(numpy.zeros(0, dtype=numpy.int64), numpy.zeros(0, dtype=numpy.int64), best, [])
+    merged = MatchCounts(numpy.concatenate([c.ids for m, c in results]), numpy.concatenate([c.counts for m, c in results]),
+                         hist=addHistograms(*[c.histogram() for m, c in results]))
+    return merged.candidates(best, min_matches, keep)
+
+def histogramOf(counts):
+    '''Return a histogram (a list of the number of entries with each number of matches) of the given match counts'''
+    hist = []
+    for m in counts:
+        if m >= len(hist): hist.extend([0] * (m + 1 - len(hist)))
+        hist[m] += 1
+    return hist
+
+def padHistogram(hist, number_of_numbers):
+    '''Extend a histogram of match counts with zeros so that it covers 0 to number_of_numbers matches'''
+    return list(hist) + [0] * (number_of_numbers + 1 - len(hist))
+
+def addHistograms(*hists):
+    '''Add histograms of match counts together'''
+    total = padHistogram([], max([-1] + [len(h) - 1 for h in hists]))
+    for h in hists:
+        for matches, n in enumerate(h): total[matches] += n
+    return total
@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.13 on 2026-10-18 02:46
+from __future__ import unicode_literals
+
+from django.db import migrations
+import lotto.models
+
+
+def backfill_masks(apps, schema_editor):
+    '''Set the bitmasks of the draws and entries which were saved before the mask fields existed, 10000 rows at a time'''
+    q = schema_editor.connection.ops.quote_name
+    for model_name, source, target in (('Draw', 'winning_combo', 'winning_mask'), ('Entry', 'entry', 'entry_mask')):
+        model = apps.get_model('lotto', model_name)
+        sql = 'UPDATE {} SET {} = %s WHERE {} = %s'.format(q(model._meta.db_table), q(target), q(model._meta.pk.column))
+        last = 0
+        while True:
+            rows = list(model.objects.filter(pk__gt=last).order_by('pk').values_list('pk', source)[:10000])
+            if not rows: break
+            with schema_editor.connection.cursor() as cursor:
+                cursor.executemany(sql, [(lotto.models.LotteryNumberMaskField.mask(numbers), pk) for pk, numbers in rows])
+            last = rows[-1][0]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lotto', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='draw',
+            name='winning_mask',
+            field=lotto.models.LotteryNumberMaskField(db_index=True, source='winning_combo'),
+        ),
+        migrations.AddField(
+            model_name='entry',
+            name='entry_mask',
+            field=lotto.models.LotteryNumberMaskField(db_index=True, source='entry'),
+        ),
+        migrations.RunPython(backfill_masks, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.13 on 2026-10-18 02:49
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lotto', '0002_lotterynumber_masks'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DrawCandidate',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('matches', models.PositiveIntegerField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='DrawCheckpoint',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_entry', models.PositiveIntegerField(default=0)),
+                ('scanned', models.PositiveIntegerField(default=0)),
+                ('max_matches', models.PositiveIntegerField(default=0)),
+                ('draw', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, to='lotto.Draw')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='drawcandidate',
+            name='checkpoint',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='lotto.DrawCheckpoint'),
+        ),
+        migrations.AddField(
+            model_name='drawcandidate',
+            name='entry',
+            field=models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, to='lotto.Entry'),
+        ),
+    ]
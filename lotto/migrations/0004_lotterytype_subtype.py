@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.13 on 2026-10-18 02:55
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+def backfill_subtype(apps, schema_editor):
+    '''Record the actual subclass of the lottery types saved before the subtype column existed'''
+    LotteryType = apps.get_model('lotto', 'LotteryType')
+    for name in 'SimpleLottery', 'MoreComplexLottery':
+        subclass = apps.get_model('lotto', name)
+        LotteryType.objects.filter(pk__in=subclass.objects.values('pk')).update(subtype=name.lower())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lotto', '0003_draw_checkpoints'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='lotterytype',
+            name='subtype',
+            field=models.CharField(blank=True, default='', editable=False, max_length=30),
+        ),
+        migrations.RunPython(backfill_subtype, migrations.RunPython.noop),
+    ]
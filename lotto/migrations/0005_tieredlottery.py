@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.13 on 2026-10-18 02:58
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lotto', '0004_lotterytype_subtype'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PrizeTier',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('matches', models.PositiveIntegerField()),
+                ('value', models.DecimalField(decimal_places=2, max_digits=20)),
+            ],
+            options={
+                'ordering': ('matches',),
+            },
+        ),
+        migrations.CreateModel(
+            name='TieredLottery',
+            fields=[
+                ('lotterytype_ptr', models.OneToOneField(auto_created=True, on_delete=django.db.models.deletion.CASCADE, parent_link=True, primary_key=True, serialize=False, to='lotto.LotteryType')),
+            ],
+            options={
+                'verbose_name': 'Tiered Lottery Type',
+                'verbose_name_plural': 'Tiered Lottery Types',
+            },
+            bases=('lotto.lotterytype',),
+        ),
+        migrations.AddField(
+            model_name='drawcheckpoint',
+            name='histogram',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.AlterField(
+            model_name='win',
+            name='wintype',
+            field=models.CharField(choices=[('M', 'main'), ('S', 'spotprize'), ('T', 'tier')], default='M', max_length=1),
+        ),
+        migrations.AddField(
+            model_name='prizetier',
+            name='lotterytype',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='lotto.TieredLottery'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='prizetier',
+            unique_together=set([('lotterytype', 'matches')]),
+        ),
+    ]
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.13 on 2026-10-18 03:00
+from __future__ import unicode_literals
+
+from decimal import Decimal
+from django.db import migrations, models
+import django.db.models.deletion
+import lotto.models
+
+
+def rolloverPaid(Draw, draw, main, winners):
+    '''The rollover paid out with the main prize of a draw, rebuilt from the history of its lottery type: the total of the prizes of the draws
+       of the type made since its last won draw, which nobody won. That is only the rollover if nothing but draws changed it, so it is checked
+       against the main winners' shares, which were each rounded to the cent: if they dont match, the rollover is not known, and None is returned.'''
+    made = Draw.objects.filter(lotterytype_id=draw.lotterytype_id, drawdate__lt=draw.drawdate).exclude(winning_combo__isnull=True).exclude(winning_combo='')
+    won = made.filter(entry__win__wintype='M')
+    last = won.aggregate(models.Max('drawdate'))['drawdate__max']
+    if last is not None: made = made.filter(drawdate__gt=last)
+    rollover = made.exclude(pk__in=won.values('pk')).aggregate(models.Sum('prize'))['prize__sum'] or Decimal('0.00')
+    share = ((draw.prize + rollover) / winners).quantize(Decimal('0.01'))
+    return rollover if share * winners == main else None
+
+
+def backfill_results(apps, schema_editor):
+    '''Summarise the draws made before results were saved, from their entries and wins (and the draws before them, for the rollover)'''
+    Draw, Entry, Win, DrawResult = [apps.get_model('lotto', name) for name in ('Draw', 'Entry', 'Win', 'DrawResult')]
+    fields = {'M': 'main_winners', 'S': 'spotprize_winners', 'T': 'tier_winners'}
+    for draw in Draw.objects.select_related('lotterytype').exclude(winning_combo__isnull=True).exclude(winning_combo='').filter(drawresult__isnull=True):
+        winning = set(draw.winning_combo)
+        result = DrawResult(draw=draw, histogram=[])
+        for entry in Entry.objects.filter(draw=draw).values_list('entry', flat=True).iterator():
+            matches = len([n for n in entry if n in winning])
+            result.histogram.extend([0] * (matches + 1 - len(result.histogram)))
+            result.histogram[matches] += 1
+        result.entries = sum(result.histogram)
+        result.max_matches = len(result.histogram) - 1 if result.histogram else 0
+        result.histogram.extend([0] * (draw.lotterytype.number_of_numbers + 1 - len(result.histogram)))
+        main = Decimal('0.00')
+        for wintype, n, paid in Win.objects.filter(entry__draw=draw).values_list('wintype').annotate(models.Count('pk'), models.Sum('prize')):
+            setattr(result, fields[wintype], n)
+            result.paid += paid
+            if wintype == 'M': main = paid
+        if result.main_winners: result.rollover_in = rolloverPaid(Draw, draw, main, result.main_winners)
+        else: result.rollover_out = draw.prize
+        result.save()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lotto', '0005_tieredlottery'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DrawResult',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('entries', models.PositiveIntegerField(default=0)),
+                ('histogram', lotto.models.HistogramField()),
+                ('max_matches', models.PositiveIntegerField(default=0)),
+                ('main_winners', models.PositiveIntegerField(default=0)),
+                ('spotprize_winners', models.PositiveIntegerField(default=0)),
+                ('tier_winners', models.PositiveIntegerField(default=0)),
+                ('paid', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=20)),
+                ('rollover_in', models.DecimalField(blank=True, decimal_places=2, default=Decimal('0.00'), max_digits=20, null=True)),
+                ('rollover_out', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=20)),
+                ('draw', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, to='lotto.Draw')),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='drawcheckpoint',
+            name='histogram',
+            field=lotto.models.HistogramField(),
+        ),
+        migrations.RunPython(backfill_results, migrations.RunPython.noop),
+    ]
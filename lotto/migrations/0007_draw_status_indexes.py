@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.13 on 2026-10-18 03:11
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+def backfill_status(apps, schema_editor):
+    '''Mark the draws which have already been made'''
+    apps.get_model('lotto', 'Draw').objects.exclude(winning_combo='').update(status='D')
+
+
+def add_open_draws_index(apps, schema_editor):
+    '''Add a partial index of the open draws on PostgreSQL.
+       (SQLite cant use a partial index for a query with the status as a parameter, as the ORM sends it, so it relies on the composite index.)'''
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute("CREATE INDEX lotto_draw_open ON lotto_draw (lotterytype_id, drawdate) WHERE status = 'O'")
+
+
+def remove_open_draws_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql': schema_editor.execute("DROP INDEX IF EXISTS lotto_draw_open")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lotto', '0006_drawresult'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='draw',
+            name='status',
+            field=models.CharField(choices=[('O', 'open'), ('D', 'drawn')], default='O', editable=False, max_length=1),
+        ),
+        migrations.RunPython(backfill_status, migrations.RunPython.noop),
+        migrations.AlterIndexTogether(
+            name='draw',
+            index_together=set([('status', 'drawdate')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='entry',
+            index_together=set([('punter', 'id'), ('draw', 'id')]),
+        ),
+        migrations.RunPython(add_open_draws_index, remove_open_draws_index),
+    ]
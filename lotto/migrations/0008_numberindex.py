@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.13 on 2026-10-18 03:25
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lotto', '0007_draw_status_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NumberBitmap',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('number', models.PositiveIntegerField()),
+                ('bitmap', models.BinaryField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='NumberIndex',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('base', models.PositiveIntegerField(default=0)),
+                ('entries', models.PositiveIntegerField(default=0)),
+                ('draw', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, to='lotto.Draw')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='numberbitmap',
+            name='index',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='lotto.NumberIndex'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='numberbitmap',
+            unique_together=set([('index', 'number')]),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.13 on 2026-10-18 03:34
+from __future__ import unicode_literals
+
+from decimal import Decimal
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lotto', '0008_numberindex'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RolloverLedger',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('carried_in', models.DecimalField(decimal_places=2, max_digits=20)),
+                ('added', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=20)),
+                ('paid_out', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=20)),
+                ('balance', models.DecimalField(decimal_places=2, max_digits=20)),
+                ('time', models.DateTimeField(auto_now_add=True)),
+                ('draw', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, to='lotto.Draw')),
+                ('lotterytype', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='lotto.LotteryType')),
+            ],
+            options={
+                'verbose_name': 'rollover ledger entry',
+                'verbose_name_plural': 'rollover ledger',
+                'ordering': ('lotterytype', 'pk'),
+            },
+        ),
+    ]
@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.13 on 2026-10-18 03:35
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lotto', '0009_rolloverledger'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WinNotification',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('P', 'pending'), ('S', 'sent'), ('F', 'failed')], default='P', max_length=1)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('next_attempt', models.DateTimeField(default=django.utils.timezone.now)),
+                ('sent', models.DateTimeField(blank=True, null=True)),
+                ('error', models.TextField(blank=True, default='')),
+                ('entry', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, to='lotto.Entry')),
+            ],
+        ),
+        migrations.AlterIndexTogether(
+            name='winnotification',
+            index_together=set([('status', 'next_attempt')]),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.13 on 2026-10-18 03:47
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lotto', '0010_winnotification'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='winnotification',
+            name='claim',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=32),
+        ),
+        migrations.AlterField(
+            model_name='winnotification',
+            name='status',
+            field=models.CharField(choices=[('P', 'pending'), ('L', 'sending'), ('S', 'sent'), ('F', 'failed')], default='P', max_length=1),
+        ),
+    ]
@@ -8,12 +8,19 @@
 
 from __future__ import unicode_literals
 from six import with_metaclass
-import decimal
+from six.moves import reduce
+import decimal, itertools, operator, timeit
 from django.utils.encoding import python_2_unicode_compatible
 from django.db.models.base import ModelBase
-from django.db import models, IntegrityError
+from django.conf import settings
+from django.db import models, connection, connections, router, transaction, IntegrityError
 from django.core import exceptions
-from django.contrib.auth.hashers import make_password
+from django.core.cache import cache
+from django.dispatch import receiver
+from django.utils import timezone
+from django.contrib.auth.hashers import make_password, check_password
+from . import matching, sharding, entrybuffer, numberindex
+from .backends import writeTransaction
 
 @python_2_unicode_compatible
 class LotteryNumberSet(list):
@@ -53,7 +60,62 @@ class LotteryNumberField(models.CommaSeparatedIntegerField):
         if not self.blank and value in self.empty_values: raise exceptions.ValidationError(self.error_messages['blank'], code='blank')
         v = LotteryNumberField.to_python(value)
         if hasattr(model_instance, 'lotterytype'): model_instance.lotterytype.checkNumbers(v) # check numbers before saving
-        else: model_instance.draw.lotterytype.checkNumbers(v)
+        elif model_instance.draw_id is not None: model_instance.draw.lotterytype.checkNumbers(v) # (the draw is reported if it isnt valid)
+
+class LotteryNumberMaskField(models.BigIntegerField):
+    '''Integer bitmask companion to a LotteryNumberField, set from the numbers in the source field whenever the model is saved.
+       Bit n-1 is set for each number n, so the database can count matches itself with a bitwise AND.
+       Numbers above MAX_NUMBER do not fit in a signed 64 bit integer, and leave the mask null.'''
+    MAX_NUMBER = 63
+    def __init__(self, source=None, *args, **kw):
+        self.source = source
+        kw['null'], kw['blank'], kw['editable'] = True, True, False
+        kw.setdefault('db_index', True)
+        super(LotteryNumberMaskField, self).__init__(*args, **kw)
+    def deconstruct(self):
+        name, path, args, kwargs = super(LotteryNumberMaskField, self).deconstruct()
+        for k in 'null', 'blank', 'editable': del kwargs[k]
+        kwargs['source'] = self.source
+        return name, path, args, kwargs
+
+    @staticmethod
+    def mask(value):
+        '''Convert a set of lottery numbers (or its string form) to a bitmask, or None if it cant be represented'''
+        numbers = [int(i) for i in LotteryNumberField.to_python(value)]
+        if not numbers or min(numbers) < 1 or max(numbers) > LotteryNumberMaskField.MAX_NUMBER: return None
+        return sum(1 << (n - 1) for n in set(numbers))
+
+    def pre_save(self, model_instance, add):
+        value = self.mask(getattr(model_instance, self.source))
+        setattr(model_instance, self.attname, value)
+        return value
+
+class HistogramField(models.TextField):
+    '''Field to hold a histogram of match counts: a list of the number of entries with 0, 1, 2... matches, stored separated by commas'''
+    def __init__(self, *args, **kw):
+        kw['blank'], kw['default'] = True, list
+        super(HistogramField, self).__init__(*args, **kw)
+    def deconstruct(self):
+        name, path, args, kwargs = super(HistogramField, self).deconstruct()
+        del kwargs['blank'], kwargs['default']
+        return name, path, args, kwargs
+
+    def from_db_value(self, value, expression, connection, context):
+        return self.to_python(value)
+    def to_python(self, value):
+        if isinstance(value, (list, tuple)): return list(value)
+        return [int(i) for i in (value or '').split(',') if i]
+    def get_prep_value(self, value):
+        return ','.join(str(i) for i in self.to_python(value))
+
+def countMatchesExpression(field, numbers):
+    '''Return an expression which counts how many of the given numbers are set in the bitmask field,
+       for use in a queryset annotation (as the sum of a bitwise AND for each number)'''
+    numbers = [int(n) for n in LotteryNumberField.to_python(numbers)]
+    if any(n < 1 or n > LotteryNumberMaskField.MAX_NUMBER for n in numbers): raise ValueError("Number out of range for a bitmask")
+    if not numbers: return models.Value(0, output_field=models.IntegerField())
+    terms = [models.F(field).bitand(1 << (n - 1)) / (1 << (n - 1)) for n in numbers] # each term is 1 if the number is set, otherwise 0
+    return models.ExpressionWrapper(reduce(operator.add, terms), output_field=models.IntegerField())
 
 class LotteryTypeMeta(ModelBase):
     '''Metaclass to collect the names of subclasses of LotteryType as they are created.
@@ -61,11 +123,16 @@ class LotteryTypeMeta(ModelBase):
        As written it will only work with direct subclasses of LotteryType'''
     def __new__(cls, name, parents, dct):
         '''When creating a new class, if it is a subclass of LotteryType, lowercase its name and 
-           store it in the LotteryType.subclasses class variable.'''
+           store it, with the class, in the LotteryType.subclasses class variable.
+           The lowercased name is also stored as the class's subtypeName, to be saved in the subtype column.'''
+        subclass = name != 'LotteryType' and 'LotteryType' in [p.__name__ for p in parents] and not dct.get('_deferred') # not the classes django makes for deferred fields
         if name == 'LotteryType':
-            if not 'subclasses' in dct: dct['subclasses'] = set()
-        elif 'LotteryType' in [p.__name__ for p in parents]: parents[0].subclasses.add(name.lower())
-        return super(LotteryTypeMeta, cls).__new__(cls, name, parents, dct)
+            if not 'subclasses' in dct: dct['subclasses'] = {}
+            dct['subtypeName'] = ''
+        elif subclass: dct['subtypeName'] = name.lower()
+        new = super(LotteryTypeMeta, cls).__new__(cls, name, parents, dct)
+        if subclass: parents[0].subclasses[new.subtypeName] = new
+        return new
 
 @python_2_unicode_compatible
 class LotteryType(with_metaclass(LotteryTypeMeta, models.Model)):
@@ -76,12 +143,41 @@ class LotteryType(with_metaclass(LotteryTypeMeta, models.Model)):
     max_val = models.PositiveIntegerField()
     rollover = models.DecimalField(decimal_places=2, default=decimal.Decimal('0.00'), max_digits=20)
     min_matches = models.PositiveIntegerField(default=1)
+    subtype = models.CharField(max_length=30, blank=True, editable=False, default='') # name of the actual subclass, set on save
+    _savedRollover = None # the rollover as loaded from the database or last saved, to tell whether it has been changed on this object
 
     @property
     def sub(self):
-        '''Return the current object downcast to an object of its actual type (which is a subclass of LotteryType)'''
-        for name in self.subclasses:
-            if hasattr(self, name): return getattr(self, name)
+        '''Return the current object downcast to an object of its actual type (which is a subclass of LotteryType).
+           No query is needed if the object is already of that type, otherwise the subtype column gives the subclass, so it takes one query.
+           The result is cached on the object.'''
+        if self.subtypeName: return self
+        if getattr(self, '_sub', None) is None:
+            if self.subtype in self.subclasses: self._sub = getattr(self, self.subtype)
+            else: # saved before the subtype column existed
+                for name in self.subclasses:
+                    if hasattr(self, name): self._sub = getattr(self, name)
+        return getattr(self, '_sub', None)
+
+    def save(self, *args, **kwargs):
+        '''Save the lottery type. Draws change the rollover by F() updates, so it is left out of the update unless it has been changed
+           on this object, and saving an object read before a draw cant put back the rollover there was then.'''
+        self.subtype = self.subtypeName or self.subtype
+        if not self._state.adding and not args and self.rollover == self._savedRollover and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [f.name for f in self._meta.concrete_fields if not f.primary_key and f.name != 'rollover']
+        super(LotteryType, self).save(*args, **kwargs)
+        self._savedRollover = self.rollover
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        lotterytype = super(LotteryType, cls).from_db(db, field_names, values)
+        lotterytype._savedRollover = lotterytype.__dict__.get('rollover')
+        return lotterytype
+
+    def _refreshRollover(self, balance):
+        '''Set the rollover, as a draw has just left it in the database, on this object and the one cached by sub'''
+        for lotterytype in (self, getattr(self, '_sub', None)):
+            if lotterytype is not None: lotterytype.rollover = lotterytype._savedRollover = balance
 
     def __str__(self): return 'Lottery Type {}'.format(self.name)
 
@@ -95,12 +191,12 @@ class LotteryType(with_metaclass(LotteryTypeMeta, models.Model)):
            To be valid it must have the correct number of integers which must be in the range 1 to max_val (inclusive).
            And the same number should not occur more than once.
            A value Error is raised if these conditions are not met.'''
-        seen = []
+        seen = set()
         if len(n) != self.number_of_numbers: raise ValueError("Incorrect number of numbers")
         for x in n: 
             if x < 1 or x > self.max_val: raise ValueError("Number out of range")
             if x in seen: raise ValueError("Duplicate Value")
-            seen.append(x)
+            seen.add(x)
         return True
 
     def checkMatches(self, draw, entry):
@@ -119,11 +215,28 @@ class LotteryType(with_metaclass(LotteryTypeMeta, models.Model)):
         '''Find the winners of this draw, and how many matches they have.
            Store the results in the object, and return them.
            The rule is that the punter(s) with the largest number of matches win(s) -- as long as they have at least the minimum number of matches.
-           If more than one punter has the winning number of matches, they share the prize between them.'''
-        draw.maxMatches, draw.winners = 0, set()
+           If more than one punter has the winning number of matches, they share the prize between them.
+           The number of entries with each number of matches is stored in draw.histogram, and in the same pass
+           the entries which could win other prizes (see _candidateMatches) are kept for draw._entriesWithMatches.'''
+        number_of_numbers = draw.lotterytype.number_of_numbers
+        if draw.streaming:
+            draw.maxMatches = draw.checkpoint.max_matches
+            draw.histogram = matching.padHistogram(draw.checkpoint.histogram, number_of_numbers)
+            draw.winners = set(draw._candidates(matches=draw.maxMatches)) if draw.maxMatches >= draw.lotterytype.min_matches else set()
+            return draw.maxMatches, draw.winners
+        if draw.vectorised or draw.sharded or draw.indexed:
+            counts = draw.matchCounts()
+            draw.maxMatches, draw.histogram = counts.max(), counts.histogram(number_of_numbers)
+            if draw.maxMatches >= draw.lotterytype.min_matches: draw.winners = draw._entriesWithIds(counts.idsWith(draw.maxMatches))
+            else: draw.winners = set()
+            return draw.maxMatches, draw.winners
+        keep = draw.lotterytype.sub._candidateMatches(draw)
+        draw.maxMatches, draw.winners, draw.histogram, draw.candidateMatches = 0, set(), [0] * (number_of_numbers + 1), {}
         for e in draw.entry_set.all():
             matches = draw._checkMatches(e)
-           
+            draw.histogram[matches] += 1
+            if keep is not None and matches >= keep: draw.candidateMatches[e] = matches
+
             if matches > draw.maxMatches: 
                 draw.maxMatches = matches
                 if matches >= draw.lotterytype.min_matches: # cant win with too few matches
@@ -136,14 +249,28 @@ class LotteryType(with_metaclass(LotteryTypeMeta, models.Model)):
     @staticmethod
     def _allocatePrize(draw):
         '''Divide the prize money (including any rollover) among the winners, if there are any winners.
-           Otherwise add the prize money to the rollover.'''
-        if not draw.winners: 
-            draw.lotterytype.rollover += draw.prize
-            return None
-        amount = (draw.prize + draw.lotterytype.rollover) / len(draw.winners)
-        draw.lotterytype.rollover = decimal.Decimal('0.00')
-        draw.lotterytype.save()
-        for w in draw.winners: Win(entry=w, prize=amount).save()
+           Otherwise add the prize money to the rollover.
+           This is done in one transaction, with the rollover changed by an F() expression on the locked lottery type row,
+           the change recorded in the RolloverLedger, and the wins inserted in batches.'''
+        lotterytype = draw.lotterytype
+        rollovers = LotteryType.objects.filter(pk=lotterytype.pk)
+        draw.rolloverIn, draw.rolloverOut = decimal.Decimal('0.00'), decimal.Decimal('0.00') # for the DrawResult
+        with writeTransaction():
+            if not draw.winners: 
+                rollovers.update(rollover=models.F('rollover') + draw.prize)
+                draw.rolloverOut = draw.prize
+            else:
+                rollover = draw.rolloverIn = rollovers.select_for_update().values_list('rollover', flat=True).get()
+                amount = (draw.prize + rollover) / len(draw.winners)
+                rollovers.update(rollover=models.F('rollover') - rollover) # anything added since it was read is kept
+            lotterytype._refreshRollover(RolloverLedger.record(draw, draw.rolloverOut, draw.rolloverIn).balance)
+            if draw.winners: Win.createMany(draw.winners, amount)
+
+    @staticmethod
+    def _candidateMatches(draw):
+        '''The number of matches with which an entry could win a prize other than the main prize, or None if there are no other prizes.
+           (When a draw is made in streaming mode these entries are kept, as well as those with the most matches.)'''
+        return None
 
     #class Meta:               
     #    abstract = True # dont tell django this is an abstract class, or we wont be able to use it in foreign keys
@@ -168,22 +295,71 @@ class MoreComplexLottery(LotteryType):
         # the additional prizes
         draw.spotprize_winners = set()
         if draw.lotterytype.sub.spotprize_nummatches < draw.maxMatches or not draw.winners:
-            for e in [e for e in draw.entry_set.all() if not draw.winners or e not in draw.winners]:
-                if draw._checkMatches(e) >= draw.lotterytype.sub.spotprize_nummatches:
-                    draw.spotprize_winners.add(e)
+            draw.spotprize_winners = draw._entriesWithMatches(draw.lotterytype.sub.spotprize_nummatches)
         return draw.maxMatches, draw.winners
 
     @staticmethod
     def _allocatePrize(draw):
-        # the main prize
-        super(MoreComplexLottery, draw.lotterytype.sub)._allocatePrize(draw)
-        # the additional prizes
-        for w in draw.spotprize_winners: Win(entry=w, prize=draw.lotterytype.sub.spotprize_value, wintype=Win.SPOTPRIZE).save()
+        with transaction.atomic():
+            # the main prize
+            super(MoreComplexLottery, draw.lotterytype.sub)._allocatePrize(draw)
+            # the additional prizes
+            Win.createMany(draw.spotprize_winners, draw.lotterytype.sub.spotprize_value, Win.SPOTPRIZE)
+
+    @staticmethod
+    def _candidateMatches(draw):
+        return draw.lotterytype.sub.spotprize_nummatches
 
     class Meta:
         verbose_name = 'More Complex Lottery Type'
         verbose_name_plural = 'More Complex Lottery Types'
 
+class TieredLottery(LotteryType):
+    '''A type of lottery which has a prize for the highest number of matching numbers.
+       And also a fixed prize, for each of its prize tiers, for any entry with exactly the number of matches of that tier.
+       The winners of every tier are found in the same pass over the entries as the main prize.'''
+    @property
+    def tiers(self):
+        '''The prize tiers of this lottery type (cached, since the same object is used throughout a draw)'''
+        if getattr(self, '_tiers', None) is None: self._tiers = list(self.prizetier_set.all())
+        return self._tiers
+
+    @staticmethod
+    def _findWinners(draw):
+        # the main prize
+        draw.maxMatches, draw.winners = super(TieredLottery, draw.lotterytype.sub)._findWinners(draw)
+        # the prizes for each tier
+        draw.tier_winners = [(tier, draw._entriesWithMatches(tier.matches, exact=True)) for tier in draw.lotterytype.sub.tiers]
+        return draw.maxMatches, draw.winners
+
+    @staticmethod
+    def _allocatePrize(draw):
+        with transaction.atomic():
+            # the main prize
+            super(TieredLottery, draw.lotterytype.sub)._allocatePrize(draw)
+            # the prizes for each tier
+            for tier, entries in draw.tier_winners: Win.createMany(entries, tier.value, Win.TIER)
+
+    @staticmethod
+    def _candidateMatches(draw):
+        tiers = draw.lotterytype.sub.tiers
+        return min(tier.matches for tier in tiers) if tiers else None
+
+    class Meta:
+        verbose_name = 'Tiered Lottery Type'
+        verbose_name_plural = 'Tiered Lottery Types'
+
+@python_2_unicode_compatible
+class PrizeTier(models.Model):
+    '''A fixed prize paid to each entry with the given number of matches in a draw of a TieredLottery (unless it wins the main prize)'''
+    lotterytype = models.ForeignKey(TieredLottery)
+    matches = models.PositiveIntegerField()
+    value = models.DecimalField(decimal_places=2, max_digits=20)
+    def __str__(self): return 'prize of {} for {} matches'.format(self.value, self.matches)
+    class Meta:
+        ordering = 'matches',
+        unique_together = (('lotterytype', 'matches'))
+
 @python_2_unicode_compatible
 class Draw(models.Model):
     '''A single draw which has a specific draw date, and will eventually have a winning combination'''
@@ -192,22 +368,189 @@ class Draw(models.Model):
     prize = models.DecimalField(decimal_places=2, max_digits=20)
     #_winning_combo = LotteryNumberField(db_column='winning_combo', blank=True)
     winning_combo = LotteryNumberField(blank=True) # use this field for in coding
+    winning_mask = LotteryNumberMaskField(source='winning_combo')
+    OPEN = 'O'
+    DRAWN = 'D'
+    statuses = ((OPEN, 'open'), (DRAWN, 'drawn'))
+    status = models.CharField(max_length=1, choices=statuses, default=OPEN, editable=False) # set from winning_combo when the draw is saved
 
     def __str__(self): return '{}, with draw on date {}'.format(self.lotterytype, self.drawdate)
+    class Meta:
+        index_together = (('status', 'drawdate'),) # for the open draws in the entry form, and the made draws in the admin
+
+    OPEN_DRAWS_KEY = 'lotto:openDraws'
+    @staticmethod
+    def openDraws():
+        '''Return a list of the open draws in draw date order, with their lottery types.
+           This is cached (for up to settings.LOTTO_OPEN_DRAWS_TIMEOUT seconds), and the cache is cleared when a draw or lottery type is saved or deleted.'''
+        draws = cache.get(Draw.OPEN_DRAWS_KEY)
+        if draws is None:
+            draws = list(Draw.objects.filter(status=Draw.OPEN).select_related('lotterytype').order_by('drawdate', 'pk'))
+            cache.set(Draw.OPEN_DRAWS_KEY, draws, getattr(settings, 'LOTTO_OPEN_DRAWS_TIMEOUT', 300))
+        return draws
 
     def _checkMatches(self, entry):
         return self.lotterytype.checkMatches(self, entry)
 
-    def makeDraw(self, *numbers):
-        '''Store the winning numbers, find the winners and allocate the prize'''
-        if self.winning_combo: raise RuntimeError("Draw has already been made")
+    @property
+    def vectorised(self):
+        '''True if the winners should be found with the vectorised (numpy) engine, as chosen by settings.LOTTO_MATCH_ENGINE'''
+        engine = getattr(settings, 'LOTTO_MATCH_ENGINE', 'python')
+        if engine in ('python', 'index'): return False
+        if engine != 'numpy': raise exceptions.ImproperlyConfigured("Unknown LOTTO_MATCH_ENGINE {}".format(engine))
+        if matching.numpy is None: raise exceptions.ImproperlyConfigured("LOTTO_MATCH_ENGINE 'numpy' needs numpy to be installed")
+        return True
+
+    @property
+    def indexed(self):
+        '''True if the winners should be found from the draw's NumberIndex (LOTTO_MATCH_ENGINE 'index')'''
+        return getattr(settings, 'LOTTO_MATCH_ENGINE', 'python') == 'index'
+
+    def numberIndex(self):
+        '''The inverted index of the numbers in the entries of the draw (see NumberIndex), which is built when the draw is made
+           with the 'index' engine, or otherwise the first time it is needed after the draw has been made'''
+        if self.status != Draw.DRAWN: raise RuntimeError("The number index is only built once the draw is closed")
+        try: return self.numberindex
+        except NumberIndex.DoesNotExist: return NumberIndex.build(self)
+
+    def _entryRows(self, after=0, limit=None):
+        '''Yield (id, entry) for the entries in the draw in id order, starting after the given id,
+           with the numbers left as the string stored in the database (the query is run directly, to skip LotteryNumberField.from_db_value)'''
+        entries = Entry.objects.filter(draw=self, pk__gt=after).order_by('pk').values_list('pk', 'entry')
+        if limit: entries = entries[:limit]
+        cursor = connection.cursor()
+        cursor.execute(*entries.query.sql_with_params())
+        for rows in iter(lambda: cursor.fetchmany(10000), []):
+            for r in rows: yield r
+
+    def matchCounts(self):
+        '''Return the number of matches for every entry in the draw, computed in one batched step (see lotto.matching),
+           or with the 'index' engine from the bitmaps of the winning numbers in the draw's NumberIndex'''
+        if getattr(self, '_matchcounts', None) is None and self.indexed: 
+            self._matchcounts = self.numberIndex().matchCounts(self.winning_combo)
+        if getattr(self, '_matchcounts', None) is None:
+            self._matchcounts = matching.countMatches(self._entryRows(), self.winning_combo, self.lotterytype.number_of_numbers, self.lotterytype.max_val)
+        return self._matchcounts
+
+    def _entriesWithIds(self, ids):
+        '''Return a set of the entries with the given ids, fetched in batches to keep within the database's parameter limits'''
+        ids, entries = [int(i) for i in ids], set()
+        for i in range(0, len(ids), 500): entries.update(Entry.objects.filter(pk__in=ids[i:i+500]))
+        return entries
+
+    @property
+    def streaming(self):
+        '''True if the draw is being made in streaming mode (see _streamMatches)'''
+        return bool(getattr(self, 'chunkSize', None))
+
+    def _streamMatches(self):
+        '''Scan the entries chunk by chunk in id order, keeping only the running max matches and the entries which could still win a prize.
+           The candidate entries are stored as DrawCandidate rows, and a DrawCheckpoint is saved after each chunk, in the same transaction,
+           so that memory use does not grow with the size of the draw and an interrupted scan can be resumed from the last chunk.'''
+        min_matches, keep = self.lotterytype.min_matches, self.lotterytype.sub._candidateMatches(self)
+        checkpoint = DrawCheckpoint.objects.get_or_create(draw=self)[0]
+        while True:
+            rows = list(self._entryRows(after=checkpoint.last_entry, limit=self.chunkSize))
+            if not rows: return checkpoint
+            if self.vectorised:
+                counts = matching.countMatches(rows, self.winning_combo, self.lotterytype.number_of_numbers, self.lotterytype.max_val)
+                counts = list(zip(counts.ids.tolist(), counts.counts.tolist()))
+            else: counts = list(matching.iterMatches(rows, self.winning_combo))
+            best = max([checkpoint.max_matches] + [m for i, m in counts])
+            checkpoint.histogram = matching.addHistograms(checkpoint.histogram, matching.histogramOf(m for i, m in counts))
+            with transaction.atomic():
+                if best > checkpoint.max_matches: # entries with the old max matches can no longer win the main prize
+                    old = checkpoint.drawcandidate_set.filter(matches__lt=best)
+                    if keep is not None: old = old.filter(matches__lt=keep)
+                    old.delete()
+                DrawCandidate.objects.bulk_create([DrawCandidate(checkpoint=checkpoint, entry_id=i, matches=m) for i, m in counts 
+                                                   if (m == best and m >= min_matches) or (keep is not None and m >= keep)])
+                checkpoint.last_entry, checkpoint.max_matches = rows[-1][0], best
+                checkpoint.scanned += len(rows)
+                checkpoint.save()
+
+    @property
+    def sharded(self):
+        '''True if the draw is being made in sharded mode (see _shardMatches)'''
+        return bool(getattr(self, 'shards', None))
+
+    def _shardMatches(self, database=None):
+        '''Split the entries into shards by primary key range, and count the matches for each shard in a separate process.
+           Each worker opens its own (for SQLite read-only) connection to the database (by default the one the draw is made in; see
+           sharding.workerDatabase), and returns only the entries which could win in its shard.
+           These are merged into the candidates for the whole draw, to be read by _findWinners in the same way as matchCounts.'''
+        if matching.numpy is None: raise exceptions.ImproperlyConfigured("Making a draw in shards needs numpy to be installed")
+        if sharding.ProcessPoolExecutor is None: raise exceptions.ImproperlyConfigured("Making a draw in shards needs concurrent.futures")
+        lt, keep = self.lotterytype, self.lotterytype.sub._candidateMatches(self)
+        bounds = self.entry_set.aggregate(low=models.Min('pk'), high=models.Max('pk'))
+        if bounds['low'] is None: return matching.mergeCandidates([], lt.min_matches, keep)
+        database, shards = database or sharding.workerDatabase(connection.settings_dict), []
+        for low, high in sharding.shardRanges(bounds['low'], bounds['high'], self.shards):
+            sql, params = Entry.objects.filter(draw=self, pk__range=(low, high)).values_list('pk', 'entry').query.sql_with_params()
+            shards.append((database, sql, params, list(self.winning_combo), lt.number_of_numbers, lt.max_val, lt.min_matches, keep))
+        with sharding.ProcessPoolExecutor(max_workers=len(shards)) as executor:
+            results = list(executor.map(sharding.scanShard, shards))
+        return matching.mergeCandidates(results, lt.min_matches, keep)
+
+    def _candidates(self, **matches):
+        '''Return a queryset of the entries kept as candidates by _streamMatches, filtered on their number of matches'''
+        return Entry.objects.filter(drawcandidate__checkpoint__draw=self, **dict(('drawcandidate__' + k, v) for k, v in matches.items()))
+
+    def _entriesWithMatches(self, n, exact=False):
+        '''Return the entries, other than the winners of the main prize, with at least (or exactly) n matches, after _findWinners has been run.
+           Only entries with at least the lottery type's _candidateMatches are kept in every mode, so n must not be lower than that.
+           (The result is a set of entries, or in streaming mode a queryset.)'''
+        if self.streaming:
+            entries = self._candidates(**{'matches' if exact else 'matches__gte': n})
+            return entries.exclude(drawcandidate__matches=self.maxMatches) if self.winners else entries
+        if self.vectorised or self.sharded or self.indexed:
+            counts = self.matchCounts()
+            return self._entriesWithIds(counts.idsWith(n) if exact else counts.idsWithAtLeast(n)) - self.winners
+        return set(e for e, m in self.candidateMatches.items() if (m == n if exact else m >= n)) - self.winners
+
+    def makeDraw(self, *numbers, **options):
+        '''Store the winning numbers, find the winners and allocate the prize.
+           If a chunk_size is given the draw is made in streaming mode, which reads that many entries at a time and can be resumed with resumeDraw.
+           If a number of shards is given the entries are split into that many shards, which are checked in separate processes.'''
+        chunk_size, shards = options.pop('chunk_size', None), options.pop('shards', None)
+        if options: raise TypeError("Unexpected options {}".format(', '.join(options)))
+        if chunk_size and shards: raise TypeError("A draw cant be made in both streaming and sharded mode")
+        if self.status == Draw.DRAWN: raise RuntimeError("Draw has already been made")
+        start, buffer = timeit.default_timer(), entrybuffer.entryBuffer()
+        if buffer: entrybuffer.closeDraw(buffer, self.pk) # so no entry can be accepted after the draw has been made
         self.winning_combo = numbers
-        self.save()
+        try: self.save()
+        except:
+            if buffer: buffer.reopen(self.pk)
+            raise
+        stored = timeit.default_timer() - start
+        self._resolve(chunk_size, shards)
+        self.timings['store'] = stored
+
+    def resumeDraw(self, chunk_size=10000):
+        '''Carry on making a draw which was interrupted in streaming mode, from its last checkpoint'''
+        if not DrawCheckpoint.objects.filter(draw=self).exists(): raise RuntimeError("Draw has no checkpoint to resume from")
+        self._resolve(chunk_size)
+
+    def _resolve(self, chunk_size=None, shards=None):
+        '''Find the winners and allocate the prize for a draw whose winning numbers have been stored.
+           The seconds taken by each step are kept in self.timings.'''
+        self.chunkSize, self.shards = chunk_size, shards
+        start = timeit.default_timer()
+        if self.streaming: self.checkpoint = self._streamMatches()
+        if self.sharded: self._matchcounts = self._shardMatches()
+        elif self.indexed and not self.streaming: NumberIndex.build(self) # as the draw has closed
         self.lotterytype.findWinners(self)
-        self.lotterytype.allocatePrize(self)
+        found = timeit.default_timer()
+        with writeTransaction():
+            self.lotterytype.allocatePrize(self)
+            self.result = DrawResult.summarise(self)
+            if self.streaming: self.checkpoint.delete() # the draw is complete, so there is nothing to resume
+        self.timings = {'findWinners': found - start, 'allocatePrize': timeit.default_timer() - found}
     def save(self, *args, **kwargs):
         '''validate and save the model'''
         self.full_clean()
+        self.status = Draw.DRAWN if self.winning_combo else Draw.OPEN
         super(Draw, self).save(*args, **kwargs)
 
 @python_2_unicode_compatible
@@ -217,11 +560,71 @@ class Punter(models.Model):
     address = models.TextField(null=True)
     email = models.EmailField(unique=True)
     password = models.CharField(max_length=100)
+    _hashedPassword = None # the password as loaded from the database or hashed by setPassword, which save doesnt hash again
     def __str__(self): return self.name
     def save(self,*a,**kw): 
-        self.password = make_password(self.password)
+        if self.password != self._hashedPassword: self.setPassword(self.password) # a password which has been set directly
         super(Punter,self).save(*a,**kw)
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        punter = super(Punter, cls).from_db(db, field_names, values)
+        punter._hashedPassword = punter.password
+        return punter
+
+    def setPassword(self, raw_password):
+        '''Hash and set a new password'''
+        self.password = self._hashedPassword = make_password(raw_password)
+
+    def checkPassword(self, raw_password):
+        '''Check the password, and if it was hashed with a hasher other than the preferred one, rehash and save it'''
+        def rehash(raw_password):
+            self.setPassword(raw_password)
+            Punter.objects.filter(pk=self.pk).update(password=self.password)
+        return check_password(raw_password, self.password, rehash)
+
+class EntryQuerySet(models.QuerySet):
+    def withMatches(self, numbers):
+        '''Annotate each entry with the number of matches it has with the given numbers, counted by the database from entry_mask.
+           (Entries with no entry_mask, because their numbers are too big for a bitmask, get None.)'''
+        return self.annotate(matches=countMatchesExpression('entry_mask', numbers))
+
+    def withAtLeast(self, numbers, k):
+        '''Return the entries which have at least k matches with the given numbers'''
+        return self.withMatches(numbers).filter(matches__gte=k)
+
+    def containing(self, numbers):
+        '''Return the entries which contain all the given numbers, matched in the stored entry strings rather than entry_mask,
+           so that numbers too big for a bitmask can be found (but each is a pattern match on every entry, which no index helps)'''
+        queryset = self
+        for n in set(str(int(n)) for n in numbers):
+            queryset = queryset.filter(models.Q(entry=n) | models.Q(entry__startswith=n + ',') | models.Q(entry__endswith=',' + n) |
+                                       models.Q(entry__contains=',' + n + ','))
+        return queryset
+
+    def enter(self, punter_id, draw_id, numbers, time=None):
+        '''Enter the numbers (which must already have been checked) in a draw for a punter, in one INSERT ... SELECT statement,
+           which only inserts the entry if the draw is still open and the punter exists. The time of the entry is now, unless given.
+           Returns the new entry, or None if it wasnt inserted. A duplicate entry raises IntegrityError from the unique constraint.'''
+        db = connections[self._db or router.db_for_write(self.model)]
+        fields, punter_id, draw_id = dict((f.name, f) for f in Entry._meta.concrete_fields), int(punter_id), int(draw_id)
+        now = time or timezone.now()
+        values = [punter_id, draw_id, now, numbers, LotteryNumberMaskField.mask(numbers)]
+        values = [fields[f].get_db_prep_save(v, db) for f, v in zip(('punter', 'draw', 'time', 'entry', 'entry_mask'), values)]
+        qn = db.ops.quote_name
+        sql = 'INSERT INTO {entry} ({columns}) SELECT {values} FROM {draw} WHERE {draw}.{id} = %s AND {draw}.{status} = %s AND EXISTS (SELECT 1 FROM {punter} WHERE {punter}.{id} = %s)'.format(
+              entry=qn(Entry._meta.db_table), draw=qn(Draw._meta.db_table), punter=qn(Punter._meta.db_table), id=qn('id'), status=qn('status'),
+              columns=', '.join(qn(fields[f].column) for f in ('punter', 'draw', 'time', 'entry', 'entry_mask')), values=', '.join(['%s'] * len(values)))
+        def insert():
+            with db.cursor() as cursor:
+                cursor.execute(sql, values + [draw_id, Draw.OPEN, punter_id])
+                return db.ops.last_insert_id(cursor, Entry._meta.db_table, 'id') if cursor.rowcount == 1 else None
+        if db.in_atomic_block: # a savepoint is needed so that a duplicate doesnt break the enclosing transaction
+            with transaction.atomic(using=db.alias): pk = insert()
+        else: pk = insert() # otherwise the statement is atomic on its own
+        if pk is None: return None
+        return Entry(pk=pk, punter_id=punter_id, draw_id=draw_id, time=now, entry=numbers)
+
 @python_2_unicode_compatible
 class Entry(models.Model):
     '''An entry to a draw made by a punter'''
@@ -230,12 +633,15 @@ class Entry(models.Model):
     time = models.DateTimeField(auto_now_add=True, blank=True)
     #_entry = LotteryNumberField(db_column='entry', default=None) # this field for db storage (default=None prevents blank field being automatically stored)
     entry = LotteryNumberField(blank=None) # use this field in coding
+    entry_mask = LotteryNumberMaskField(source='entry') # the same numbers as a bitmask, so matches can be counted by the database
+    objects = EntryQuerySet.as_manager()
     @property
-    def won(self): return True if self.win else False
+    def won(self): return hasattr(self, 'win') # reading win raises Win.DoesNotExist (an AttributeError) if there isnt one
     def __str__(self): return 'Entry by {} for draw {}'.format(self.punter, self.draw)
     class Meta:
         verbose_name_plural = "Entries"
         unique_together = (('punter', 'draw'))  # dont allow punter to enter draw more than once
+        index_together = (('punter', 'id'), ('draw', 'id')) # for reading the entries of a punter or a draw in id order
     def save(self, *args, **kwargs):
         '''validate and save the model'''
         self.full_clean()
@@ -248,6 +654,180 @@ class Win(models.Model):
     prize = models.DecimalField(decimal_places=2, max_digits=20)
     MAIN = 'M'
     SPOTPRIZE = 'S'
-    wintypes = ((MAIN, 'main'), (SPOTPRIZE, 'spotprize'))
+    TIER = 'T'
+    wintypes = ((MAIN, 'main'), (SPOTPRIZE, 'spotprize'), (TIER, 'tier'))
     wintype = models.CharField(max_length=1, choices=wintypes, blank=False, default=MAIN)
     def __str__(self): return 'win of {} for {}'.format(self.prize, self.entry)
+
+    BATCH_SIZE = 2000 # number of wins held in memory for each bulk insert
+    @classmethod
+    def createMany(cls, entries, prize, wintype=MAIN):
+        '''Create a win of the given prize for each of the entries, using bulk inserts rather than a query per win,
+           and queue a WinNotification for each (unless settings.LOTTO_NOTIFY_WINNERS is false) in the same batches.
+           (A queryset of entries is read an id at a time, rather than being loaded into memory.)'''
+        if isinstance(entries, models.QuerySet): ids = entries.values_list('pk', flat=True).iterator()
+        else: ids = (e.pk for e in entries)
+        notify = getattr(settings, 'LOTTO_NOTIFY_WINNERS', True)
+        for batch in iter(lambda: list(itertools.islice(ids, cls.BATCH_SIZE)), []):
+            cls.objects.bulk_create([cls(entry_id=i, prize=prize, wintype=wintype) for i in batch])
+            if notify: WinNotification.objects.bulk_create([WinNotification(entry_id=i) for i in batch])
+
+class WinNotification(models.Model):
+    '''A message to tell the punter of an entry that it has won, waiting in the outbox to be sent by the send_notifications worker
+       (see lotto.notifications), so that making a draw never waits for email to be delivered'''
+    entry = models.OneToOneField(Entry)
+    PENDING = 'P'
+    SENDING = 'L'
+    SENT = 'S'
+    FAILED = 'F'
+    statuses = ((PENDING, 'pending'), (SENDING, 'sending'), (SENT, 'sent'), (FAILED, 'failed'))
+    status = models.CharField(max_length=1, choices=statuses, default=PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt = models.DateTimeField(default=timezone.now) # not sent again before this time, after a failure or while it is leased to a worker
+    claim = models.CharField(max_length=32, blank=True, default='', db_index=True) # of the worker which last leased it
+    sent = models.DateTimeField(null=True, blank=True)
+    error = models.TextField(blank=True, default='') # of the last failed attempt
+    class Meta:
+        index_together = (('status', 'next_attempt'),) # for the worker's query of the notifications due to be sent
+
+class DrawCheckpoint(models.Model):
+    '''The progress of a draw being made in streaming mode, saved after each chunk of entries so that it can be resumed'''
+    draw = models.OneToOneField(Draw)
+    last_entry = models.PositiveIntegerField(default=0) # id of the last entry scanned
+    scanned = models.PositiveIntegerField(default=0)
+    max_matches = models.PositiveIntegerField(default=0)
+    histogram = HistogramField() # of the entries scanned so far
+
+class DrawCandidate(models.Model):
+    '''An entry which could still win a prize in a draw being made in streaming mode'''
+    checkpoint = models.ForeignKey(DrawCheckpoint)
+    entry = models.OneToOneField(Entry)
+    matches = models.PositiveIntegerField()
+
+class NumberIndex(models.Model):
+    '''An inverted index of the numbers in the entries of a closed draw: for each number, a compressed bitmap of the entries which contain it
+       (see lotto.numberindex). The number of entries with any combination of numbers, or with k matches, is found by intersecting
+       the bitmaps of the numbers, without reading the entries.'''
+    draw = models.OneToOneField(Draw)
+    base = models.PositiveIntegerField(default=0) # id of the entry for bit 0 of the bitmaps
+    entries = models.PositiveIntegerField(default=0)
+
+    @staticmethod
+    def build(draw):
+        '''Build (or rebuild) the index of a draw from its entries'''
+        base, bitmaps = numberindex.build(draw._entryRows(), draw.lotterytype.number_of_numbers)
+        with transaction.atomic():
+            NumberIndex.objects.filter(draw=draw).delete()
+            index = NumberIndex.objects.create(draw=draw, base=base, entries=numberindex.popcount(bitmaps.get(0, 0)))
+            NumberBitmap.objects.bulk_create([NumberBitmap(index=index, number=n, bitmap=numberindex.encode(b)) for n, b in sorted(bitmaps.items())])
+        index._bitmaps = bitmaps
+        return index
+
+    def bitmaps(self, numbers):
+        '''Return the bitmaps of the given numbers (0 for all the entries), reading those which havent been read already in one query'''
+        if getattr(self, '_bitmaps', None) is None: self._bitmaps = {}
+        missing = [n for n in numbers if n not in self._bitmaps]
+        if missing:
+            self._bitmaps.update((n, 0) for n in missing) # no entry has a number without a bitmap
+            self._bitmaps.update((n, numberindex.decode(b)) for n, b in self.numberbitmap_set.filter(number__in=missing).values_list('number', 'bitmap'))
+        return [self._bitmaps[n] for n in numbers]
+
+    def withAll(self, numbers):
+        '''The bitmap of the entries which contain all the given numbers'''
+        return reduce(operator.and_, self.bitmaps([0] + sorted(set(numbers))))
+
+    def count(self, numbers):
+        '''The number of entries which contain all the given numbers'''
+        return numberindex.popcount(self.withAll(numbers))
+
+    def entryIds(self, numbers):
+        '''The ids of the entries which contain all the given numbers, in order'''
+        return numberindex.ids(self.withAll(numbers), self.base)
+
+    def matchCounts(self, numbers):
+        '''The number of matches of every entry with the given numbers (see numberindex.BitmapMatchCounts)'''
+        bitmaps = self.bitmaps([0] + list(numbers))
+        return numberindex.BitmapMatchCounts(bitmaps[0], bitmaps[1:], self.base)
+
+class NumberBitmap(models.Model):
+    '''The compressed bitmap of the entries which contain a number, in a NumberIndex'''
+    index = models.ForeignKey(NumberIndex)
+    number = models.PositiveIntegerField()
+    bitmap = models.BinaryField()
+    class Meta:
+        unique_together = (('index', 'number'),)
+
+class DrawResult(models.Model):
+    '''A summary of the result of a draw, saved when the draw is made,
+       so that it can be shown without aggregate queries over the entries and wins of the draw'''
+    draw = models.OneToOneField(Draw)
+    entries = models.PositiveIntegerField(default=0)
+    histogram = HistogramField() # of the number of matches of the entries
+    max_matches = models.PositiveIntegerField(default=0)
+    main_winners = models.PositiveIntegerField(default=0)
+    spotprize_winners = models.PositiveIntegerField(default=0)
+    tier_winners = models.PositiveIntegerField(default=0)
+    paid = models.DecimalField(decimal_places=2, max_digits=20, default=decimal.Decimal('0.00'))
+    rollover_in = models.DecimalField(decimal_places=2, max_digits=20, default=decimal.Decimal('0.00'), null=True, blank=True) # rollover paid out with
+    # the main prize, or None if it could not be recovered for a draw made before results were saved
+    rollover_out = models.DecimalField(decimal_places=2, max_digits=20, default=decimal.Decimal('0.00')) # prize added to the rollover
+
+    @property
+    def winners(self):
+        '''The number of winners of each type of win'''
+        return {Win.MAIN: self.main_winners, Win.SPOTPRIZE: self.spotprize_winners, Win.TIER: self.tier_winners}
+
+    @staticmethod
+    def summarise(draw):
+        '''Save the result of a draw which has just been made, from the histogram and rollover stored on it by findWinners and allocatePrize,
+           and one aggregate query over its wins'''
+        result = DrawResult(draw=draw, histogram=draw.histogram, entries=sum(draw.histogram), max_matches=draw.maxMatches,
+                            rollover_in=draw.rolloverIn, rollover_out=draw.rolloverOut)
+        fields = {Win.MAIN: 'main_winners', Win.SPOTPRIZE: 'spotprize_winners', Win.TIER: 'tier_winners'}
+        for wintype, n, paid in Win.objects.filter(entry__draw=draw).values_list('wintype').annotate(models.Count('pk'), models.Sum('prize')):
+            setattr(result, fields[wintype], n)
+            result.paid += paid
+        result.save()
+        return result
+
+class RolloverLedger(models.Model):
+    '''The change made to the rollover of a lottery type by a draw: the balance carried in to the draw, the prize added to it
+       (when nobody won), the amount paid out with the main prize, and the balance after.
+       Rows are only ever added, in the transaction which changes the rollover, so they are the history of the balance.'''
+    lotterytype = models.ForeignKey(LotteryType)
+    draw = models.OneToOneField(Draw)
+    carried_in = models.DecimalField(decimal_places=2, max_digits=20)
+    added = models.DecimalField(decimal_places=2, max_digits=20, default=decimal.Decimal('0.00'))
+    paid_out = models.DecimalField(decimal_places=2, max_digits=20, default=decimal.Decimal('0.00'))
+    balance = models.DecimalField(decimal_places=2, max_digits=20)
+    time = models.DateTimeField(auto_now_add=True)
+    class Meta:
+        ordering = 'lotterytype', 'pk'
+        verbose_name = 'rollover ledger entry'
+        verbose_name_plural = 'rollover ledger'
+
+    def save(self, *args, **kwargs):
+        if self.pk is not None: raise ValueError('The rollover ledger can only be added to')
+        super(RolloverLedger, self).save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs): raise ValueError('The rollover ledger can only be added to')
+
+    @staticmethod
+    def record(draw, added, paid_out):
+        '''Add the change made by the draw to the ledger, with the balance read back from the lottery type row
+           (which the F() update that has just changed it keeps locked until the end of the transaction)'''
+        balance = LotteryType.objects.filter(pk=draw.lotterytype_id).values_list('rollover', flat=True).get()
+        return RolloverLedger.objects.create(lotterytype_id=draw.lotterytype_id, draw=draw, carried_in=balance - added + paid_out,
+                                             added=added, paid_out=paid_out, balance=balance)
+
+    @staticmethod
+    def gaps(lotterytype):
+        '''The pairs of consecutive ledger rows of the lottery type where the balance carried in differs from the balance before it,
+           because the rollover was changed outside a draw (for example in the admin)'''
+        rows = list(RolloverLedger.objects.filter(lotterytype=lotterytype).order_by('pk'))
+        return [(a, b) for a, b in zip(rows, rows[1:]) if a.balance != b.carried_in]
+
+@receiver([models.signals.post_save, models.signals.post_delete])
+def clearOpenDraws(sender, instance, **kwargs):
+    '''Clear the cached list of open draws (see Draw.openDraws) when a draw is created or made, or a lottery type changes'''
+    if isinstance(instance, (Draw, LotteryType)): cache.delete(Draw.OPEN_DRAWS_KEY)
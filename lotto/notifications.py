@@ -0,0 +1,104 @@
+##############################################################################################################
+#
+# Sending the win notifications queued in the outbox (WinNotification) when draws are made, in batches over one email connection
+#
+##############################################################################################################
+
+from __future__ import unicode_literals
+import datetime, logging, time, timeit, uuid
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db.models import F
+from django.utils import timezone
+from .models import Win, WinNotification
+
+logger = logging.getLogger(__name__)
+
+MAX_ATTEMPTS = 5 # a notification which has failed this many times is marked failed, and not sent again
+RETRY_DELAY = 60 # seconds before the first retry of a failed notification, doubled for each retry after it
+LEASE = 600 # seconds for which a batch is leased to the worker sending it, after which it is due to be sent again
+
+SUBJECT = 'You have won a prize in {lottery}'
+BODY = '''Dear {name},
+
+Congratulations! Your entry {numbers} in the draw on {date} has won a {wintype} prize of {prize}.
+'''
+
+class Throttle(object):
+    '''Limits a loop to rate iterations a second (or no limit if rate is None), by sleeping in wait() when it gets ahead'''
+    def __init__(self, rate=None, clock=timeit.default_timer, sleep=time.sleep):
+        self.interval, self.clock, self.sleep = 1.0 / rate if rate else 0, clock, sleep
+        self.next = None
+    def wait(self):
+        now = self.clock()
+        if self.next is not None and now < self.next:
+            self.sleep(self.next - now)
+            now = self.next
+        self.next = now + self.interval
+
+def message(notification):
+    '''The email telling the punter of the notification's entry that it has won'''
+    entry = notification.entry
+    wintypes = dict(Win.wintypes)
+    return EmailMessage(SUBJECT.format(lottery=entry.draw.lotterytype.name),
+                        BODY.format(name=entry.punter.name, numbers=entry.entry, date=entry.draw.drawdate.date(),
+                                    wintype=wintypes[entry.win.wintype], prize=entry.win.prize),
+                        getattr(settings, 'DEFAULT_FROM_EMAIL', None), [entry.punter.email])
+
+def due(now=None):
+    '''The notifications which are due to be sent, oldest first: those pending, and those whose lease has run out (as the worker sending them stopped)'''
+    return WinNotification.objects.filter(status__in=(WinNotification.PENDING, WinNotification.SENDING), next_attempt__lte=now or timezone.now(),
+                                          attempts__lt=MAX_ATTEMPTS).order_by('pk')
+
+def claim(limit, now=None, lease=LEASE):
+    '''Lease up to limit of the notifications which are due to this worker for lease seconds, and return them with their entries, wins, punters and draws.
+       They are leased by one update, which only changes those which are still due, so no other worker can lease the same ones.
+       The lease counts as an attempt to send them.'''
+    now, token = now or timezone.now(), uuid.uuid4().hex
+    ids = list(due(now).values_list('pk', flat=True)[:limit])
+    WinNotification.objects.filter(pk__in=ids, status__in=(WinNotification.PENDING, WinNotification.SENDING), next_attempt__lte=now).update(
+        status=WinNotification.SENDING, claim=token, attempts=F('attempts') + 1, next_attempt=now + datetime.timedelta(seconds=lease))
+    return list(WinNotification.objects.filter(claim=token, status=WinNotification.SENDING).order_by('pk')
+                .select_related('entry__punter', 'entry__win', 'entry__draw__lotterytype'))
+
+def expire(now=None):
+    '''Mark failed the notifications whose lease ran out on their last attempt, as it is not known whether they were sent'''
+    WinNotification.objects.filter(status=WinNotification.SENDING, next_attempt__lte=now or timezone.now(), attempts__gte=MAX_ATTEMPTS).update(
+        status=WinNotification.FAILED, error='The worker sending it stopped, so it may not have been sent')
+
+def failed(notification, error, now):
+    '''Record a failed attempt to send the notification, to be retried after a delay which doubles with each attempt, up to MAX_ATTEMPTS'''
+    status = WinNotification.FAILED if notification.attempts >= MAX_ATTEMPTS else WinNotification.PENDING
+    WinNotification.objects.filter(pk=notification.pk, claim=notification.claim).update(status=status, error='{}: {}'.format(type(error).__name__, error),
+        next_attempt=now + datetime.timedelta(seconds=RETRY_DELAY * 2 ** (notification.attempts - 1)))
+    logger.warning("Notification %s to %s failed (attempt %s): %s", notification.pk, notification.entry.punter.email, notification.attempts, error)
+
+def send(batch_size=100, rate=None, connection=None, throttle=None, lease=LEASE):
+    '''Send the notifications which are due, a batch at a time, over one connection of the email backend (settings.EMAIL_BACKEND,
+       or the connection given) kept open for them all, at most rate messages a second. Each batch is leased to this worker before it is sent
+       (see claim), so workers can run at the same time, and each notification is marked sent as soon as it has been, so if the worker stops
+       only the message it was sending can be sent again (when the lease runs out). Failures are retried later.
+       Returns the number of notifications sent and failed.'''
+    connection, throttle = connection or get_connection(), throttle or Throttle(rate)
+    sent = failures = 0
+    expire()
+    batch = claim(batch_size, lease=lease)
+    if not batch: return sent, failures
+    try: connection.open()
+    except Exception as e: # nothing can be sent, so the batch is retried later
+        for n in batch: failed(n, e, timezone.now())
+        return sent, len(batch)
+    try:
+        while batch:
+            for n in batch:
+                throttle.wait()
+                try: connection.send_messages([message(n)])
+                except Exception as e:
+                    failed(n, e, timezone.now())
+                    failures += 1
+                    continue
+                WinNotification.objects.filter(pk=n.pk, claim=n.claim).update(status=WinNotification.SENT, sent=timezone.now())
+                sent += 1
+            batch = claim(batch_size, lease=lease)
+    finally: connection.close()
+    return sent, failures
@@ -0,0 +1,106 @@
+##############################################################################################################
+#
+# Inverted index of the numbers in the entries of a draw: for each number, a compressed bitmap of the entries which contain it
+#
+##############################################################################################################
+
+from __future__ import unicode_literals
+import binascii, functools, operator, zlib
+from . import matching
+
+# A bitmap is a python int, whose bit i is set for the entry with id base + i (base being the id of the first entry in the draw).
+# So intersecting the bitmaps of some numbers is a single &, however many entries the draw has.
+
+def encode(bitmap):
+    '''Compress a bitmap for storage'''
+    digits = '{:x}'.format(bitmap)
+    return zlib.compress(binascii.unhexlify('0' * (len(digits) % 2) + digits))
+
+def decode(data):
+    '''The bitmap stored by encode'''
+    return int(binascii.hexlify(zlib.decompress(bytes(data))) or b'0', 16)
+
+def popcount(bitmap):
+    '''The number of entries in a bitmap'''
+    return bin(bitmap).count('1')
+
+def ids(bitmap, base):
+    '''The ids of the entries in a bitmap, in order'''
+    bits, found, i = bin(bitmap)[:1:-1], [], -1 # bits[i] is bit i
+    while True:
+        i = bits.find('1', i + 1)
+        if i < 0: return found
+        found.append(base + i)
+
+def fromBytes(data):
+    '''Convert a bytearray whose byte b holds bits 8b to 8b+7 to a bitmap'''
+    return int(binascii.hexlify(bytearray(reversed(data))) or b'0', 16)
+
+def build(rows, number_of_numbers):
+    '''Build the bitmaps of the entries which contain each number from (id, entry) rows in id order, with the entries kept as the strings stored
+       in the database. Returns the base id and a dict of the bitmaps, with the bitmap of all the entries as number 0.'''
+    rows = list(rows)
+    if not rows: return 0, {}
+    base = rows[0][0]
+    if matching.numpy is not None: return base, buildVectorised(rows, base, number_of_numbers)
+    bits = {}
+    for i, e in rows:
+        i -= base
+        byte, bit = i >> 3, 1 << (i & 7)
+        for n in ['0'] + e.split(','):
+            if not n: continue
+            b = bits.get(n)
+            if b is None: b = bits[n] = bytearray()
+            if len(b) <= byte: b.extend(bytearray(byte + 1 - len(b)))
+            b[byte] |= bit
+    return base, dict((int(n), fromBytes(b)) for n, b in bits.items())
+
+def buildVectorised(rows, base, number_of_numbers):
+    '''build, with the entries loaded into a matrix, and the bitmap of each number packed from a column of flags'''
+    numpy = matching.numpy
+    positions = numpy.array([i for i, e in rows], dtype=numpy.int64) - base
+    matrix = matching.parseEntries([e for i, e in rows], number_of_numbers)
+    size = int(positions[-1]) + 1
+    size += -size % 8
+    def pack(wanted):
+        flags = numpy.zeros(size, dtype=bool)
+        flags[positions[wanted]] = True
+        return int(binascii.hexlify(numpy.packbits(flags[::-1]).tobytes()) or b'0', 16) # the flags reversed and packed are the bitmap's bytes
+    bitmaps = {0: pack(numpy.ones(len(positions), dtype=bool))}
+    for n in numpy.unique(matrix).tolist():
+        if n > 0: bitmaps[n] = pack((matrix == n).any(axis=1))
+    return bitmaps
+
+class BitmapMatchCounts(object):
+    '''The number of matches of every entry in a draw with some numbers, counted from the bitmaps of the numbers.
+       The counts are held as bit slices: bit i of planes[j] is bit j of the number of matches of the entry base + i.
+       It has the methods of matching.MatchCounts, so the winners of a draw can be found from it in the same way.'''
+    def __init__(self, entries, bitmaps, base):
+        self.entries, self.base, self.planes = entries, base, []
+        for b in bitmaps: # add each bitmap to the counts, carrying as in binary addition
+            carry = b & entries
+            for j, p in enumerate(self.planes):
+                if not carry: break
+                self.planes[j], carry = p ^ carry, p & carry
+            if carry: self.planes.append(carry)
+    def __len__(self): return popcount(self.entries)
+
+    def bitmapWith(self, n):
+        '''The bitmap of the entries with exactly n matches'''
+        if n >> len(self.planes): return 0
+        bitmap = self.entries
+        for j, p in enumerate(self.planes): bitmap &= p if n >> j & 1 else ~p
+        return bitmap
+
+    def max(self):
+        for n in range((1 << len(self.planes)) - 1, 0, -1):
+            if self.bitmapWith(n): return n
+        return 0
+
+    def histogram(self, number_of_numbers=0):
+        return matching.padHistogram([popcount(self.bitmapWith(n)) for n in range(self.max() + 1)] if self.entries else [], number_of_numbers)
+
+    def idsWith(self, n): return ids(self.bitmapWith(n), self.base)
+
+    def idsWithAtLeast(self, n):
+        return ids(functools.reduce(operator.or_, [self.bitmapWith(m) for m in range(n, self.max() + 1)], 0), self.base)
@@ -0,0 +1,59 @@
+##############################################################################################################
+#
+# Keyset pagination, for lists too long to count or to page through by offset
+#
+##############################################################################################################
+
+from __future__ import unicode_literals
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Max
+from django.utils.functional import cached_property
+
+def keysetPage(queryset, before=None, size=50):
+    '''Return a page of up to size objects from the queryset in descending id order, starting before the id given (or with the newest),
+       and the id to start the next page before (None if this is the last page).
+       The cost of a page doesnt depend on how far through the list it is, as it is found by a filter on the id rather than an offset.
+       (Raises ValueError if before is not an id.)'''
+    queryset = queryset.order_by('-pk')
+    if before: queryset = queryset.filter(pk__lt=int(before))
+    page = list(queryset[:size + 1]) # one more than is shown, to tell whether there is another page
+    return page[:size], page[size - 1].pk if len(page) > size else None
+
+def estimatedCount(queryset):
+    '''An estimate of the number of rows in the table of the queryset's model, which doesnt scan the table:
+       from the planner statistics for PostgreSQL or MySQL, otherwise the highest id (which is close as long as few rows are deleted)'''
+    table, connection = queryset.model._meta.db_table, connections[queryset.db]
+    sql = {'postgresql': 'SELECT reltuples FROM pg_class WHERE relname = %s',
+           'mysql': 'SELECT table_rows FROM information_schema.tables WHERE table_schema = DATABASE() AND table_name = %s'}.get(connection.vendor)
+    if sql:
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [table])
+            row = cursor.fetchone()
+        if row and row[0] is not None: return int(row[0])
+    return queryset.model._default_manager.using(queryset.db).aggregate(n=Max('pk'))['n'] or 0
+
+class EstimatedCountPaginator(Paginator):
+    '''Paginator for the admin changelists of big tables, which never counts more than limit rows:
+       the count of the whole table is estimated (see estimatedCount), and a filtered list is counted up to the limit past the start of
+       page number (the page being shown), so the pages after it can always be reached, however long the list is.
+       estimated is set if the count is an estimate, and capped if it was cut off at the limit, so there may be more.
+       (Use it with show_full_result_count = False, which stops the admin counting the whole table as well.)'''
+    limit = 10000
+
+    def __init__(self, object_list, per_page, orphans=0, allow_empty_first_page=True, number=1):
+        super(EstimatedCountPaginator, self).__init__(object_list, per_page, orphans, allow_empty_first_page)
+        self.number, self.estimated, self.capped = max(1, number), False, False
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not queryset.query.where:
+            estimate = estimatedCount(queryset)
+            if estimate > self.limit:
+                self.estimated = True
+                return estimate
+        offset = (self.number - 1) * int(self.per_page)
+        count = queryset[offset:offset + self.limit].count()
+        self.capped = count == self.limit
+        return offset + count
@@ -0,0 +1,62 @@
+##############################################################################################################
+#
+# Checking that a view stays within the number of database queries declared for it
+#
+##############################################################################################################
+
+from __future__ import unicode_literals
+import contextlib, functools, logging
+from django.conf import settings
+from django.db import connections, DEFAULT_DB_ALIAS
+from django.db.backends.utils import CursorWrapper
+
+logger = logging.getLogger(__name__)
+
+class QueryBudgetExceeded(Exception):
+    '''Raised when a view runs more queries than its budget, if settings.LOTTO_QUERY_BUDGET_FAIL is true'''
+
+class CountingCursorWrapper(CursorWrapper):
+    '''Wraps a cursor made by the connection to count the queries run through it in counter (a one item list),
+       without keeping their sql and timings as the debug cursor does'''
+    def __init__(self, cursor, db, counter):
+        super(CountingCursorWrapper, self).__init__(cursor, db)
+        self.counter = counter
+    def execute(self, sql, params=None):
+        self.counter[0] += 1
+        return super(CountingCursorWrapper, self).execute(sql, params)
+    def executemany(self, sql, param_list):
+        self.counter[0] += 1
+        return super(CountingCursorWrapper, self).executemany(sql, param_list)
+
+@contextlib.contextmanager
+def countQueries(using=DEFAULT_DB_ALIAS):
+    '''Count the queries run on the connection to the database (for this thread) in the context, in the one item list it gives.
+       Unlike CaptureQueriesContext it doesnt force the debug cursor, which would keep the sql of every query, so it can be used in production.'''
+    connection = connections[using]
+    counter, patched = [0], connection.__dict__.get('cursor') # another count the context is inside
+    cursor = connection.cursor
+    connection.cursor = lambda: CountingCursorWrapper(cursor(), connection, counter)
+    try: yield counter
+    finally:
+        if patched: connection.cursor = patched
+        else: del connection.cursor
+
+def queryBudget(budget):
+    '''Decorator for a view function, which counts the queries run by the view (including rendering its template),
+       and if there are more than budget logs a warning, or raises QueryBudgetExceeded if settings.LOTTO_QUERY_BUDGET_FAIL is true.
+       The queries are counted by countQueries, so the budget can be checked in production.
+       For a class based view use method_decorator(queryBudget(n), name='dispatch').'''
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(request, *args, **kwargs):
+            with countQueries() as queries:
+                response = view(request, *args, **kwargs)
+                if hasattr(response, 'render') and not getattr(response, 'is_rendered', True): response.render()
+            if queries[0] > budget:
+                message = "{} ran {} queries, over its budget of {}".format(request.path, queries[0], budget)
+                if getattr(settings, 'LOTTO_QUERY_BUDGET_FAIL', False): raise QueryBudgetExceeded(message)
+                logger.warning(message)
+            return response
+        wrapper.query_budget = budget
+        return wrapper
+    return decorator
@@ -0,0 +1,89 @@
+##############################################################################################################
+#
+# Resolution of all the draws which are due, concurrently across lottery types, and in draw date order within each type
+#
+##############################################################################################################
+
+from __future__ import unicode_literals
+import contextlib, logging, random, threading, timeit
+from django.db import connection
+from django.utils import timezone
+from .models import Draw
+
+try:
+    from concurrent.futures import ThreadPoolExecutor
+except ImportError: # python 2 needs the futures package installed for this
+    ThreadPoolExecutor = None
+
+logger = logging.getLogger(__name__)
+
+def dueDraws(now=None):
+    '''Return the open draws whose draw date has passed, as a list of (lottery type, draws in draw date order) pairs'''
+    groups = []
+    for draw in Draw.objects.filter(status=Draw.OPEN, drawdate__lte=now or timezone.now()).select_related('lotterytype').order_by('lotterytype', 'drawdate', 'pk'):
+        if not groups or groups[-1][0] != draw.lotterytype: groups.append((draw.lotterytype, []))
+        groups[-1][1].append(draw)
+    return groups
+
+def randomNumbers(lotterytype):
+    '''A winning combination for a draw of the lottery type, from the operating system's random number generator'''
+    return sorted(random.SystemRandom().sample(range(1, lotterytype.max_val + 1), lotterytype.number_of_numbers))
+
+def resolveDraws(draws, numbers=None, started=None, lock=None, **options):
+    '''Make the draws (all of one lottery type) one after another, in the order given, since each passes its rollover to the next,
+       yielding a result for each as it is made, with the seconds after started at which it began and the seconds each step took.
+       The winning numbers are taken from the numbers dict (of draw id to numbers) if one is given, when a draw missing from it fails,
+       or otherwise drawn at random. If a draw fails the later ones are left unmade, as their rollover would be wrong. Each draw is made holding the lock, if one is given.'''
+    for n, draw in enumerate(draws):
+        start = timeit.default_timer()
+        result = {'draw': draw.pk, 'lotterytype': draw.lotterytype.pk, 'drawdate': draw.drawdate.isoformat(), 'started': start - (started or start)}
+        try:
+            with lock or noLock():
+                draw = Draw.objects.select_related('lotterytype').get(pk=draw.pk) # with the rollover left by the draw before
+                if numbers is not None and draw.pk not in numbers: raise ValueError('No winning numbers given for draw {}'.format(draw.pk))
+                result['numbers'] = list(numbers[draw.pk] if numbers is not None else randomNumbers(draw.lotterytype))
+                draw.makeDraw(*result['numbers'], **options)
+        except Exception as e:
+            logger.exception("Draw %s failed", draw.pk)
+            result['error'] = '{}: {}'.format(type(e).__name__, e)
+            yield result
+            for later in draws[n + 1:]:
+                yield {'draw': later.pk, 'lotterytype': later.lotterytype.pk, 'drawdate': later.drawdate.isoformat(), 
+                       'error': 'Not made, as draw {} before it failed'.format(draw.pk)}
+            return
+        result.update(draw.timings, total=timeit.default_timer() - start, entries=draw.result.entries, paid=str(draw.result.paid),
+                      winners=draw.result.main_winners + draw.result.spotprize_winners + draw.result.tier_winners,
+                      rollover=str(draw.lotterytype.rollover))
+        yield result
+
+@contextlib.contextmanager
+def noLock(): yield
+
+def resolveDue(now=None, numbers=None, workers=None, log=None, **options):
+    '''Make every draw which is due, with the draws of each lottery type in a separate thread (at most workers at a time),
+       and return the results of the draws in the order they finished. Other options are passed to makeDraw (chunk_size or shards).
+       (The threads of an in-memory SQLite database make their draws one at a time, as its connections fail rather than wait for a lock.)'''
+    groups, results, lock = dueDraws(now), [], threading.Lock()
+    if not groups: return results
+    started = timeit.default_timer()
+    sqlite_memory = connection.vendor == 'sqlite' and connection.is_in_memory_db(connection.settings_dict['NAME'])
+    drawLock = threading.Lock() if sqlite_memory else None
+    def resolveType(draws):
+        for result in resolveDraws(draws, numbers, started, drawLock, **options):
+            with lock:
+                results.append(result)
+                if log: log(describe(result))
+    def inThread(draws):
+        try: resolveType(draws)
+        finally: connection.close() # the connection opened by this thread
+    if ThreadPoolExecutor is None or workers == 1 or len(groups) == 1:
+        for lt, draws in groups: resolveType(draws)
+    else:
+        with ThreadPoolExecutor(max_workers=workers or len(groups)) as executor: list(executor.map(inThread, [draws for lt, draws in groups]))
+    return results
+
+def describe(result):
+    '''A line describing the result of a draw'''
+    if 'error' in result: return 'Draw {draw} ({drawdate}): {error}'.format(**result)
+    return ('Draw {draw} ({drawdate}): {numbers}, {entries} entries, {winners} winners, paid {paid}, rollover {rollover}; '
+            'started at {started:.3f}s, store {store:.3f}s, findWinners {findWinners:.3f}s, allocatePrize {allocatePrize:.3f}s, total {total:.3f}s').format(**result)
@@ -0,0 +1,52 @@
+##############################################################################################################
+#
+# Counting the matches of a single draw in several worker processes, one for each range of entry ids
+#
+##############################################################################################################
+
+from __future__ import unicode_literals
+import os
+import six
+from six.moves.urllib.parse import quote
+from django.db.utils import load_backend
+from . import matching
+from .backends.sqlite3.base import DatabaseWrapper as TunedDatabaseWrapper
+
+try:
+    from concurrent.futures import ProcessPoolExecutor
+except ImportError: # python 2 needs the futures package installed for this
+    ProcessPoolExecutor = None
+
+def shardRanges(low, high, shards):
+    '''Split the ids from low to high (inclusive) into at most the given number of contiguous (low, high) ranges'''
+    size = max(1, -(-(high - low + 1) // shards))
+    return [(start, min(start + size - 1, high)) for start in range(low, high + 1, size)]
+
+def workerDatabase(settings_dict):
+    '''Return the settings for a worker to open its own connection to the database.
+       A SQLite database file is opened read-only, so that the workers cant interfere with the process making the draw.
+       An in-memory SQLite database cant be read by other processes, so it raises RuntimeError.'''
+    database = dict(settings_dict, OPTIONS=dict(settings_dict.get('OPTIONS', {})))
+    backend = load_backend(database['ENGINE']).DatabaseWrapper
+    if backend.vendor == 'sqlite':
+        name = database['NAME']
+        if name == ':memory:' or 'mode=memory' in name: raise RuntimeError("An in-memory SQLite database cant be read by worker processes")
+        if six.PY3: # python 2's sqlite3 module cant open uris
+            if name.startswith('file:'): name += ('&' if '?' in name else '?') + 'mode=ro'
+            else: name = 'file:{}?mode=ro'.format(quote(os.path.abspath(name)))
+            database['NAME'], database['OPTIONS']['uri'] = name, True
+        if issubclass(backend, TunedDatabaseWrapper): # a read only connection cant set the journal mode (which the database already has)
+            database['OPTIONS']['pragmas'] = dict(database['OPTIONS'].get('pragmas', {}), journal_mode=None)
+    return database
+
+def scanShard(shard):
+    '''Run in a worker process: count the matches for one range of the entries of a draw.
+       Returns the highest number of matches in the range, and the entries which could win a prize (see MatchCounts.candidates).'''
+    database, sql, params, winning_combo, number_of_numbers, max_val, min_matches, keep = shard
+    connection = load_backend(database['ENGINE']).DatabaseWrapper(database, 'shard')
+    try:
+        cursor = connection.cursor()
+        cursor.execute(sql, params)
+        counts = matching.countMatches(cursor.fetchall(), winning_combo, number_of_numbers, max_val)
+    finally: connection.close()
+    return counts.max(), counts.candidates(counts.max(), min_matches, keep)
@@ -0,0 +1,112 @@
+##############################################################################################################
+#
+# Monte Carlo simulation of the payouts and rollovers of a draw, for random winning combinations, with numpy
+#
+##############################################################################################################
+
+from __future__ import unicode_literals
+import math
+from . import matching
+from .models import MoreComplexLottery, TieredLottery
+
+BATCH_ELEMENTS = 2**24 # the simulated draws in a batch are chosen so that their matrix of match counts has about this many elements
+PERCENTILES = 5, 50, 95, 99
+
+def choose(n, r):
+    return math.factorial(n) // (math.factorial(r) * math.factorial(n - r)) if 0 <= r <= n else 0
+
+_odds = {}
+def hypergeometricOdds(number_of_numbers, max_val):
+    '''The probability of an entry having each number of matches, from 0 to number_of_numbers, with a random winning combination
+       (cached for each number_of_numbers and max_val)'''
+    key = number_of_numbers, max_val
+    if key not in _odds:
+        combinations = choose(max_val, number_of_numbers)
+        _odds[key] = [float(choose(number_of_numbers, m) * choose(max_val - number_of_numbers, number_of_numbers - m)) / combinations
+                      for m in range(number_of_numbers + 1)]
+    return _odds[key]
+
+def rules(lotterytype, **changes):
+    '''The prize rules of the lottery type, as used by _findWinners and _allocatePrize, with any of them changed
+       (the prize of the draw, rollover, min_matches, spotprize_nummatches, spotprize_value, or tiers as a list of (matches, value) pairs)'''
+    lt = lotterytype.sub
+    r = {'number_of_numbers': lt.number_of_numbers, 'max_val': lt.max_val, 'rollover': float(lt.rollover), 'min_matches': lt.min_matches,
+         'spotprize_nummatches': None, 'spotprize_value': 0.0, 'tiers': []}
+    if isinstance(lt, MoreComplexLottery): r['spotprize_nummatches'], r['spotprize_value'] = lt.spotprize_nummatches, float(lt.spotprize_value)
+    if isinstance(lt, TieredLottery): r['tiers'] = [(t.matches, float(t.value)) for t in lt.tiers]
+    r.update((k, v) for k, v in changes.items() if v is not None)
+    return r
+
+def incidence(draw):
+    '''Load the entries of the draw as a matrix with a row for each entry and a column for each number, which is 1 if the entry has the number'''
+    numpy, lt = matching.numpy, draw.lotterytype
+    entries = matching.parseEntries([e for i, e in draw._entryRows()], lt.number_of_numbers)
+    matrix = numpy.zeros((len(entries), lt.max_val + 1), dtype=numpy.float32) # column 0 for the padding of short entries
+    matrix[numpy.arange(len(entries))[:, None], numpy.clip(entries, 0, lt.max_val)] = 1
+    return matrix[:, 1:]
+
+def randomCombos(random, count, number_of_numbers, max_val):
+    '''count random winning combinations, as a matrix with a row of numbers for each'''
+    return random.random_sample((count, max_val)).argsort(axis=1)[:, :number_of_numbers] + 1
+
+def histograms(matrix, combos, number_of_numbers):
+    '''The number of entries with each number of matches (a row for each of the combos), from one matrix product of the entries and combos'''
+    numpy = matching.numpy
+    winning = numpy.zeros((matrix.shape[1] + 1, len(combos)), dtype=numpy.float32)
+    winning[combos, numpy.arange(len(combos))[:, None]] = 1
+    counts = matrix.dot(winning[1:]).astype(numpy.int8)
+    hists = numpy.stack([numpy.zeros(len(combos), dtype=numpy.int64)] + [(counts == m).sum(axis=0) for m in range(1, number_of_numbers + 1)], axis=1)
+    hists[:, 0] = len(matrix) - hists.sum(axis=1) # the rest of the entries have no matches
+    return hists
+
+def outcomes(hists, rules):
+    '''Apply the rules of _findWinners and _allocatePrize to the histograms of simulated draws, returning arrays (with an element for each draw)
+       of the numbers of winners of each type and the amount paid. When there are no main winners the prize rolls over.'''
+    numpy, draws, n = matching.numpy, len(hists), hists.shape[1] - 1
+    best = n - (hists[:, ::-1] > 0).argmax(axis=1) # the highest number of matches in each draw
+    main = numpy.where(best >= rules['min_matches'], hists[numpy.arange(draws), best], 0)
+    spot = numpy.zeros(draws, dtype=numpy.int64)
+    if rules['spotprize_nummatches'] is not None:
+        k = rules['spotprize_nummatches']
+        spot = hists[:, k:].sum(axis=1) - numpy.where((main > 0) & (best >= k), main, 0) # the main winners dont also win a spot prize
+        spot[(main > 0) & (best <= k)] = 0 # and there are only spot prizes for fewer matches than the main prize, unless nobody won it
+    tiers = numpy.zeros(draws, dtype=numpy.int64)
+    paid = numpy.where(main > 0, rules['prize'] + rules['rollover'], 0.0) + spot * rules['spotprize_value']
+    for m, value in rules['tiers']:
+        won = numpy.where((main > 0) & (best == m), 0, hists[:, m]) if m <= n else numpy.zeros(draws, dtype=numpy.int64)
+        tiers, paid = tiers + won, paid + won * value
+    return {'main_winners': main, 'spotprize_winners': spot, 'tier_winners': tiers, 'paid': paid, 'rolled_over': main == 0}
+
+def simulate(draw, draws=10000, seed=0, batch_size=None, **changes):
+    '''Simulate the draw with draws random winning combinations (the entries being read once), with the lottery type's rules with any changes,
+       and return a summary: the probability of the prize rolling over, the distribution of the amount paid, the mean numbers of winners,
+       and the frequency of each number of matches beside its exact (hypergeometric) probability.'''
+    numpy = matching.numpy
+    if numpy is None: raise ImportError('numpy is required to simulate draws')
+    r = rules(draw.lotterytype, **changes)
+    r.setdefault('prize', float(draw.prize))
+    matrix, random = incidence(draw), numpy.random.RandomState(seed)
+    batch_size = batch_size or max(1, min(draws, BATCH_ELEMENTS // max(1, len(matrix))))
+    results = []
+    for start in range(0, draws, batch_size):
+        hists = histograms(matrix, randomCombos(random, min(batch_size, draws - start), r['number_of_numbers'], r['max_val']), r['number_of_numbers'])
+        results.append((hists, outcomes(hists, r)))
+    hists = numpy.concatenate([h for h, o in results])
+    o = dict((k, numpy.concatenate([o[k] for h, o in results])) for k in results[0][1])
+    frequency = (hists.sum(axis=0) / float(draws * len(matrix))).tolist() if len(matrix) else [0.0] * len(hists[0])
+    odds = hypergeometricOdds(r['number_of_numbers'], r['max_val'])
+    return {'draw': draw.pk, 'draws': draws, 'entries': len(matrix), 'seed': seed, 'rules': r,
+            'rollover_probability': float(o['rolled_over'].mean()),
+            'paid': dict([('mean', float(o['paid'].mean())), ('std', float(o['paid'].std())), ('max', float(o['paid'].max()))] +
+                         [('p{}'.format(p), float(numpy.percentile(o['paid'], p))) for p in PERCENTILES]),
+            'mean_winners': dict((k, float(o[k].mean())) for k in ('main_winners', 'spotprize_winners', 'tier_winners')),
+            'matches': [{'matches': m, 'frequency': f, 'exact': e} for m, (f, e) in enumerate(zip(frequency, odds))],
+            'max_error': max(abs(f - e) for f, e in zip(frequency, odds))}
+
+def describe(result):
+    '''Yield the lines of a report of a simulation'''
+    yield 'Draw {draw}: {entries} entries, {draws} simulated draws'.format(**result)
+    yield 'Rollover probability {:.2%}'.format(result['rollover_probability'])
+    yield 'Paid: mean {mean:.2f}, std {std:.2f}, p5 {p5:.2f}, median {p50:.2f}, p95 {p95:.2f}, p99 {p99:.2f}, max {max:.2f}'.format(**result['paid'])
+    yield 'Mean winners: {main_winners:.2f} main, {spotprize_winners:.2f} spot prize, {tier_winners:.2f} tier'.format(**result['mean_winners'])
+    for m in result['matches']: yield '{matches} matches: simulated {frequency:.6f}, exact {exact:.6f}'.format(**m)
@@ -1,8 +1,30 @@
 from __future__ import unicode_literals
-from django.test import TestCase
-from django.db import IntegrityError
-import datetime, decimal
+from django.test import TestCase, TransactionTestCase, RequestFactory
+from django.http import HttpResponse
+from django.contrib.auth.models import User
+from django.utils import timezone
+from django.db import IntegrityError, OperationalError, connection, connections, transaction
+from django.test.utils import CaptureQueriesContext
+from django.core.cache import cache
+from django.conf import settings
+from django.core import mail
+from unittest import skipIf
+try: from unittest import mock
+except ImportError: import mock # python 2
+from django.core.management import call_command, CommandError
+from django.apps import apps as django_apps
+import csv, datetime, decimal, importlib, io, json, os, random, shutil, six, sqlite3, tempfile
 from .models import *
+from . import matching, sharding, benchmark, querybudget, pagination, entrybuffer, numberindex, simulation, resolution, notifications
+from .views import EntriesView
+from .admin import PunterAdminForm, EntryAdmin
+from .backends import writeTransaction
+try: from concurrent.futures import ThreadPoolExecutor
+except ImportError: ThreadPoolExecutor = None
+
+def signIn(client, punter, password=''):
+    '''Sign the test client in as the punter'''
+    return client.post('/', {'email': punter.email, 'password': password})
 
 class SimpleLotteryTestCase(TestCase):
 
@@ -148,6 +170,8 @@ class SimpleLotteryResultTestCase(TestCase):
         self.assertEqual(len(winning_entries), 0)
         # test that the prize money has rolled over
         self.assertEqual(self.draw.prize, self.draw.lotterytype.rollover)
+        # test that the rollover has been saved
+        self.assertEqual(LotteryType.objects.get(pk=self.draw.lotterytype.pk).rollover, self.draw.prize)
 
     def testRolloverAllocated(self):
         '''test that when there is a rollover it is correctly applied and then reset'''
@@ -165,6 +189,88 @@ class SimpleLotteryResultTestCase(TestCase):
         # test that the rollover has been reset
         self.assertEqual(self.draw.lotterytype.rollover, decimal.Decimal(0.00))
 
+    def testResult(self):
+        '''test that a summary of the draw is saved when it is made'''
+        self.draw.lotterytype.rollover = decimal.Decimal('1000.00')
+        self.draw.lotterytype.save()
+        self.draw.makeDraw(2,3,5)
+        r = DrawResult.objects.get(draw=self.draw)
+        self.assertEqual((r.entries, r.histogram, r.max_matches), (3, [0, 1, 2, 0], 2))
+        self.assertEqual(r.winners, {Win.MAIN: 2, Win.SPOTPRIZE: 0, Win.TIER: 0})
+        self.assertEqual((r.paid, r.rollover_in, r.rollover_out), (decimal.Decimal('1100.00'), decimal.Decimal('1000.00'), 0))
+
+    def testNoWinResult(self):
+        self.draw.makeDraw(6,7,8)
+        r = DrawResult.objects.get(draw=self.draw)
+        self.assertEqual((r.histogram, r.main_winners, r.paid, r.rollover_out), ([3, 0, 0, 0], 0, 0, self.draw.prize))
+
+    def testRolloverLedger(self):
+        '''test that each draw adds a row to the rollover ledger, which can't be changed, and that a change outside a draw shows as a gap'''
+        lt = self.draw.lotterytype
+        draw2 = Draw.objects.create(lotterytype=lt, drawdate=datetime.datetime(2016,2,12,10,00), prize=decimal.Decimal('50.00'))
+        Entry.objects.create(punter=self.e1.punter, draw=draw2, entry='1,2,3')
+        self.draw.makeDraw(6,7,8)
+        LotteryType.objects.filter(pk=lt.pk).update(rollover=models.F('rollover') + 10) # an adjustment outside a draw
+        Draw.objects.get(pk=draw2.pk).makeDraw(1,2,3)
+        ledger = list(RolloverLedger.objects.filter(lotterytype=lt).values_list('draw', 'carried_in', 'added', 'paid_out', 'balance'))
+        self.assertEqual(ledger, [(self.draw.pk, 0, 100, 0, 100), (draw2.pk, 110, 0, 110, 0)])
+        self.assertEqual(Win.objects.get(entry__draw=draw2).prize, decimal.Decimal('160.00'))
+        self.assertEqual([(a.draw_id, b.draw_id) for a, b in RolloverLedger.gaps(lt)], [(self.draw.pk, draw2.pk)])
+        row = RolloverLedger.objects.get(draw=self.draw)
+        self.assertRaises(ValueError, row.save)
+        self.assertRaises(ValueError, row.delete)
+
+    def testStaleSave(self):
+        '''test that saving a lottery type read before a draw doesnt put back the rollover it had then, unless it was changed on purpose'''
+        stale = LotteryType.objects.get(pk=self.draw.lotterytype.pk)
+        self.assertEqual(stale.sub.rollover, 0)
+        self.draw.makeDraw(6,7,8)
+        stale.sub.save()
+        stale.name = 'Renamed'
+        stale.save()
+        self.assertEqual(LotteryType.objects.values_list('name', 'rollover').get(pk=stale.pk), ('Renamed', self.draw.prize))
+        self.assertEqual((self.draw.lotterytype.rollover, self.draw.lotterytype.sub.rollover), (self.draw.prize, self.draw.prize))
+        lt = Draw.objects.get(pk=self.draw.pk).lotterytype
+        lt.sub # cached
+        draw2 = Draw.objects.create(lotterytype=lt, drawdate=datetime.datetime(2016,2,12,10,00), prize=decimal.Decimal('50.00'))
+        draw2.makeDraw(6,7,8)
+        self.assertEqual((lt.rollover, lt.sub.rollover), (150, 150))
+        stale.rollover = decimal.Decimal('10.00') # an adjustment
+        stale.save()
+        self.assertEqual(LotteryType.objects.get(pk=stale.pk).rollover, 10)
+
+    def testBackfillResult(self):
+        '''test that the migration which adds results summarises the draws already made in the same way,
+           with the rollover rebuilt from the prizes of the draws since the last won draw, although the shares it was split into were rounded'''
+        lt = self.draw.lotterytype
+        won = Draw.objects.create(lotterytype=lt, drawdate=datetime.datetime(2016,1,22,10,00), prize=decimal.Decimal('50.00'))
+        Entry.objects.create(punter=self.e1.punter, draw=won, entry='1,2,3')
+        won.makeDraw(1,2,3)
+        Draw.objects.create(lotterytype=lt, drawdate=datetime.datetime(2016,1,29,10,00), prize=decimal.Decimal('13.32')).makeDraw(1,2,3)
+        self.draw.lotterytype = LotteryType.objects.get(pk=lt.pk)
+        self.draw.makeDraw(3,9,10) # each entry has one match
+        self.assertEqual(set(Win.objects.filter(entry__draw=self.draw).values_list('prize', flat=True)), set([decimal.Decimal('37.77')]))
+        made = list(DrawResult.objects.order_by('draw__drawdate').values())
+        self.assertEqual(made[2]['rollover_in'], decimal.Decimal('13.32'))
+        DrawResult.objects.all().delete()
+        importlib.import_module('lotto.migrations.0006_drawresult').backfill_results(django_apps, None)
+        backfilled = list(DrawResult.objects.order_by('draw__drawdate').values())
+        for r in made + backfilled: del r['id']
+        self.assertEqual(backfilled, made)
+
+    def testBackfillUnknownRollover(self):
+        '''test that the backfilled rollover is left unknown if it was changed outside the draws'''
+        self.draw.lotterytype.rollover = decimal.Decimal('1000.00')
+        self.draw.lotterytype.save()
+        self.draw.makeDraw(2,3,5)
+        made = DrawResult.objects.values().get(draw=self.draw)
+        DrawResult.objects.all().delete()
+        importlib.import_module('lotto.migrations.0006_drawresult').backfill_results(django_apps, None)
+        backfilled = DrawResult.objects.values().get(draw=self.draw)
+        self.assertIsNone(backfilled['rollover_in'])
+        del made['id'], backfilled['id'], made['rollover_in'], backfilled['rollover_in']
+        self.assertEqual(backfilled, made)
+
 class MoreComplexLotteryTestCase(TestCase):
 
     def setUp(self):
@@ -329,6 +435,14 @@ class MoreComplexLotteryResultTestCase(TestCase):
         self.assertEqual(self.e3.win.wintype, Win.SPOTPRIZE)
         self.assertEqual(self.e3.win.prize, decimal.Decimal('10.00'))
 
+    def testManySpotPrizes(self):
+        '''test that spot prizes for more entries than fit in one bulk insert are all allocated'''
+        Punter.objects.bulk_create([Punter(name = 'Extra {}'.format(i), email='x{}@b.cd'.format(i)) for i in range(Win.BATCH_SIZE + 1)])
+        Entry.objects.bulk_create([Entry(punter=p, draw=self.draw, entry=(5,6,7)) for p in Punter.objects.filter(name__startswith='Extra')])
+        self.draw.makeDraw(1,2,5)
+        self.assertEqual(list(Win.objects.filter(wintype=Win.MAIN)), [self.e1.win])
+        self.assertEqual(Win.objects.filter(wintype=Win.SPOTPRIZE).count(), Win.BATCH_SIZE + 3)
+
     def testNoWin(self):
         '''test that if the conditions for a win are not met, no winning entries are selected, and the prize is rolled over'''
         self.draw.makeDraw(6,7,8)
@@ -353,3 +467,1054 @@ class MoreComplexLotteryResultTestCase(TestCase):
         self.assertEqual(winning_entries[0].win.prize, self.draw.prize+decimal.Decimal(1000.00))
         # test that the rollover has been reset
         self.assertEqual(self.draw.lotterytype.rollover, decimal.Decimal(0.00))
+
+class RandomDrawsTestCase(TestCase):
+    '''Base class for test cases which compare different ways of making draws, on a set of random entries'''
+
+    def setUp(self):
+        self.simple = SimpleLottery(name = "Simple", number_of_numbers = 4, max_val = 12, min_matches=2)
+        self.simple.save()
+        self.complex = MoreComplexLottery(name = "Complex", number_of_numbers = 4, max_val = 12, min_matches=3, spotprize_nummatches=2, spotprize_value=decimal.Decimal('5.00'))
+        self.complex.save()
+        rand = random.Random(1)
+        self.punters = []
+        for i in range(25):
+            p = Punter(name = 'Punter {}'.format(i), email='p{}@b.cd'.format(i))
+            p.save()
+            self.punters.append(p)
+        self.entries = {}
+        for lt in self.simple, self.complex:
+            for day in range(1, 6):
+                draw = Draw(lotterytype = lt, drawdate = datetime.datetime(2016,2,day,10,00), prize = decimal.Decimal('100.00'))
+                draw.save()
+                self.entries[draw.pk] = [rand.sample(range(1, 13), 4) for p in self.punters]
+                for p, numbers in zip(self.punters, self.entries[draw.pk]):
+                    Entry(punter=p, draw=draw, entry=numbers).save()
+        self.combos = [rand.sample(range(1, 13), 4) for day in range(5)]
+
+    def findWinners(self, draw, engine):
+        with self.settings(LOTTO_MATCH_ENGINE=engine):
+            d = Draw.objects.get(pk=draw.pk)
+            d.winning_combo = LotteryNumberSet(draw.winning_combo)
+            d.lotterytype.findWinners(d)
+            return d.maxMatches, d.winners, getattr(d, 'spotprize_winners', set())
+
+@skipIf(matching.numpy is None, 'numpy is not installed')
+class VectorisedEngineTestCase(RandomDrawsTestCase):
+    '''Check that the numpy engine finds exactly the same winners as the python engine'''
+
+    def testSameWinners(self):
+        for draw in Draw.objects.all():
+            draw.winning_combo = LotteryNumberSet(self.combos[draw.drawdate.day - 1])
+            self.assertEqual(self.findWinners(draw, 'python'), self.findWinners(draw, 'numpy'))
+
+    def testMatchCounts(self):
+        draw = Draw.objects.filter(lotterytype=self.simple).first()
+        draw.winning_combo = LotteryNumberSet(self.combos[0])
+        counts = draw.matchCounts()
+        self.assertEqual(len(counts), len(self.punters))
+        for i, c in zip(counts.ids, counts.counts):
+            self.assertEqual(c, draw._checkMatches(Entry.objects.get(pk=i)))
+
+    def testParseEntries(self):
+        '''test that rows with the wrong number of numbers are padded or truncated, even when their lengths add up to the right total'''
+        self.assertEqual(matching.parseEntries(['1,2', '3,4,5,6'], 3).tolist(), [[1,2,0], [3,4,5]])
+        self.assertEqual(matching.parseEntries(['1,2,3', '4,5,6'], 3).tolist(), [[1,2,3], [4,5,6]])
+        self.assertEqual(matching.parseEntries(['1,,3', '4,5,6,7', '8'], 3).tolist(), [[1,3,0], [4,5,6], [8,0,0]])
+        self.assertEqual(matching.parseEntries(['1,,3', '4,5,6'], 3).tolist(), [[1,3,0], [4,5,6]]) # the right number of commas
+
+    def testMakeDraw(self):
+        '''test that a draw made with the numpy engine allocates the prizes'''
+        draw = Draw.objects.filter(lotterytype=self.complex).first()
+        with self.settings(LOTTO_MATCH_ENGINE='numpy'): draw.makeDraw(*self.combos[0])
+        self.assertEqual(Win.objects.filter(entry__draw=draw, wintype=Win.MAIN).count(), len(draw.winners))
+        self.assertEqual(Win.objects.filter(entry__draw=draw, wintype=Win.SPOTPRIZE).count(), len(draw.spotprize_winners))
+
+class NumberIndexTestCase(RandomDrawsTestCase):
+    '''Check that counts and winners found from the inverted number index are the same as from the entries'''
+
+    def contain(self, draw, numbers):
+        return sorted(e.pk for e in draw.entry_set.all() if set(numbers) <= set(e.entry))
+
+    def testCounts(self):
+        draw = Draw.objects.filter(lotterytype=self.simple).first()
+        index = NumberIndex.build(draw)
+        self.assertEqual((index.entries, NumberIndex.objects.get().numberbitmap_set.count()), (len(self.punters), 13)) # numbers 1 to 12, and all the entries
+        index = NumberIndex.objects.get() # the bitmaps are read from the database
+        for numbers in (1,), (3,7), (2,5,9), (1,2,3,4), (13,):
+            self.assertEqual(index.entryIds(numbers), self.contain(draw, numbers))
+            self.assertEqual(index.count(numbers), len(self.contain(draw, numbers)))
+        draw.winning_combo = LotteryNumberSet(self.combos[0])
+        counts = index.matchCounts(draw.winning_combo)
+        matches = dict((e.pk, draw._checkMatches(e)) for e in draw.entry_set.all())
+        self.assertEqual(counts.histogram(4), [list(matches.values()).count(n) for n in range(5)])
+        for n in range(5): self.assertEqual(counts.idsWith(n), sorted(pk for pk, m in matches.items() if m == n))
+        self.assertEqual(counts.idsWithAtLeast(2), sorted(pk for pk, m in matches.items() if m >= 2))
+
+    def testBuild(self):
+        '''test that the bitmaps are the same built with or without numpy, and survive being stored'''
+        draw = Draw.objects.first()
+        with mock.patch.object(matching, 'numpy', None): base, bitmaps = numberindex.build(draw._entryRows(), 4)
+        self.assertEqual(numberindex.ids(bitmaps[0], base), sorted(draw.entry_set.values_list('pk', flat=True)))
+        if matching.numpy is not None: self.assertEqual(numberindex.build(draw._entryRows(), 4), (base, bitmaps))
+        for b in bitmaps.values(): self.assertEqual(numberindex.decode(numberindex.encode(b)), b)
+        self.assertEqual(numberindex.build([], 4), (0, {}))
+
+    def testSameWinners(self):
+        Draw.objects.update(status=Draw.DRAWN) # the index is only built for closed draws
+        for draw in Draw.objects.all():
+            draw.winning_combo = LotteryNumberSet(self.combos[draw.drawdate.day - 1])
+            self.assertEqual(self.findWinners(draw, 'index'), self.findWinners(draw, 'python'))
+        self.assertRaises(RuntimeError, Draw(status=Draw.OPEN).numberIndex)
+
+    def testMakeDraw(self):
+        draw = Draw.objects.filter(lotterytype=self.complex).first()
+        with self.settings(LOTTO_MATCH_ENGINE='index'): draw.makeDraw(*self.combos[0])
+        self.assertEqual(NumberIndex.objects.get().draw, draw)
+        self.assertEqual(Win.objects.filter(entry__draw=draw, wintype=Win.MAIN).count(), len(draw.winners))
+        self.assertEqual(Win.objects.filter(entry__draw=draw, wintype=Win.SPOTPRIZE).count(), len(draw.spotprize_winners))
+        self.assertEqual(draw.result.histogram, [sum(1 for e in self.entries[draw.pk] if len(set(e) & set(self.combos[0])) == n) for n in range(5)])
+
+@skipIf(matching.numpy is None, 'numpy is not installed')
+class SimulationTestCase(RandomDrawsTestCase):
+    '''Check that simulated draws follow the same prize rules as real ones, and match the exact odds'''
+
+    def testOdds(self):
+        odds = simulation.hypergeometricOdds(6, 49)
+        self.assertAlmostEqual(sum(odds), 1)
+        self.assertAlmostEqual(odds[6], 1.0 / 13983816)
+        self.assertIs(simulation.hypergeometricOdds(6, 49), odds)
+
+    def testSameRules(self):
+        for draw in Draw.objects.all():
+            matrix, rules = simulation.incidence(draw), simulation.rules(draw.lotterytype, prize=100.0)
+            combos = matching.numpy.array([self.combos[draw.drawdate.day - 1]])
+            o = simulation.outcomes(simulation.histograms(matrix, combos, 4), rules)
+            draw.winning_combo = LotteryNumberSet(combos[0].tolist())
+            maxMatches, winners, spotprize_winners = self.findWinners(draw, 'python')
+            self.assertEqual((o['main_winners'][0], o['spotprize_winners'][0], o['rolled_over'][0]), (len(winners), len(spotprize_winners), not winners))
+            self.assertEqual(o['paid'][0], (100.0 if winners else 0) + len(spotprize_winners) * rules['spotprize_value'])
+
+    def testTiers(self):
+        hists = matching.numpy.array([[5, 3, 2, 1, 0], [5, 3, 2, 0, 0]])
+        o = simulation.outcomes(hists, dict(min_matches=2, prize=100.0, rollover=10.0, spotprize_nummatches=None, spotprize_value=0, tiers=[(2, 1.0), (3, 5.0)]))
+        self.assertEqual(o['main_winners'].tolist(), [1, 2])
+        self.assertEqual(o['tier_winners'].tolist(), [2, 0]) # the main winners dont win a tier prize too
+        self.assertEqual(o['paid'].tolist(), [112.0, 110.0])
+
+    def testSimulate(self):
+        draw = Draw.objects.filter(lotterytype=self.complex).first()
+        result = simulation.simulate(draw, draws=3000, batch_size=700)
+        self.assertEqual((result['draws'], result['entries']), (3000, len(self.punters)))
+        self.assertLess(result['max_error'], 0.01)
+        self.assertTrue(0 < result['rollover_probability'] < 1)
+        self.assertTrue(result['paid']['p5'] <= result['paid']['p50'] <= result['paid']['p95'] <= result['paid']['max'])
+        self.assertGreater(simulation.simulate(draw, draws=3000, min_matches=4)['rollover_probability'], result['rollover_probability'])
+        out = io.StringIO()
+        call_command('simulate', str(draw.pk), '--draws', '100', stdout=out)
+        self.assertIn('Rollover probability', out.getvalue())
+
+class BitmaskTestCase(TestCase):
+    '''Check the bitmask companion fields, and counting matches in the database'''
+
+    def setUp(self):
+        lt = SimpleLottery(name = "Test Lottery", number_of_numbers = 3, max_val = 10, min_matches=1)
+        lt.save()
+        self.draw = Draw(lotterytype = lt, drawdate = datetime.datetime(2016,2,5,10,00), prize = decimal.Decimal('100.00'))
+        self.draw.save()
+        self.entries = []
+        for i, numbers in enumerate(((1,2,3), (2,3,4), (1,3,4), (8,9,10))):
+            p = Punter(name = 'Punter {}'.format(i), email='p{}@b.cd'.format(i))
+            p.save()
+            e = Entry(punter=p, draw=self.draw, entry=numbers)
+            e.save()
+            self.entries.append(e)
+
+    def testMaskSetOnSave(self):
+        self.assertEqual(Entry.objects.get(pk=self.entries[0].pk).entry_mask, 0b111)
+        self.assertEqual(Entry.objects.get(pk=self.entries[3].pk).entry_mask, 0b1110000000)
+        self.assertEqual(Draw.objects.get(pk=self.draw.pk).winning_mask, None)
+        self.draw.winning_combo = 10,2,3
+        self.draw.save()
+        self.assertEqual(Draw.objects.get(pk=self.draw.pk).winning_mask, 0b1000000110)
+        self.assertEqual(LotteryNumberMaskField.mask('1,64'), None)
+
+    def testWithMatches(self):
+        self.draw.winning_combo = 2,3,5
+        counts = dict(self.draw.entry_set.withMatches(self.draw.winning_combo).values_list('pk', 'matches'))
+        for e in self.entries: self.assertEqual(counts[e.pk], self.draw._checkMatches(e))
+        self.assertEqual(set(self.draw.entry_set.withAtLeast(self.draw.winning_combo, 2)), {self.entries[0], self.entries[1]})
+        with self.assertRaises(ValueError): Entry.objects.withMatches((1,2,64))
+
+class StreamingTestCase(RandomDrawsTestCase):
+    '''Check that draws made in streaming mode have the same winners, and can be resumed'''
+
+    def streamWinners(self, draw, chunk_size):
+        d = Draw.objects.get(pk=draw.pk)
+        d.winning_combo = LotteryNumberSet(draw.winning_combo)
+        d.chunkSize = chunk_size
+        d.checkpoint = d._streamMatches()
+        d.lotterytype.findWinners(d)
+        result = d.maxMatches, d.winners, set(getattr(d, 'spotprize_winners', set()))
+        d.checkpoint.delete()
+        return result
+
+    def testSameWinners(self):
+        for draw in Draw.objects.all():
+            draw.winning_combo = LotteryNumberSet(self.combos[draw.drawdate.day - 1])
+            expected = self.findWinners(draw, 'python')
+            for chunk_size in 1, 7, 1000: self.assertEqual(self.streamWinners(draw, chunk_size), expected)
+
+    def testResume(self):
+        '''test that a draw interrupted part way through can be resumed from its checkpoint'''
+        draw = Draw.objects.filter(lotterytype=self.complex).first()
+        draw.winning_combo = LotteryNumberSet(self.combos[0])
+        maxMatches, winners, spotprize_winners = self.findWinners(draw, 'python')
+        draw.winning_combo = ''
+        save, saves = DrawCheckpoint.save, []
+        def crash(checkpoint, *args, **kwargs):
+            saves.append(checkpoint.last_entry)
+            if len(saves) == 3: raise RuntimeError("crash")
+            save(checkpoint, *args, **kwargs)
+        with mock.patch.object(DrawCheckpoint, 'save', crash):
+            with self.assertRaises(RuntimeError): draw.makeDraw(*self.combos[0], chunk_size=5)
+        self.assertEqual(DrawCheckpoint.objects.get(draw=draw).scanned, 5)
+        draw = Draw.objects.get(pk=draw.pk)
+        draw.resumeDraw(chunk_size=5)
+        self.assertFalse(DrawCheckpoint.objects.exists())
+        self.assertFalse(DrawCandidate.objects.exists())
+        # the prizes are the same as for the draw made in one go
+        self.assertEqual(set(draw.entry_set.filter(win__wintype=Win.MAIN)), winners)
+        self.assertEqual(set(draw.entry_set.filter(win__wintype=Win.SPOTPRIZE)), spotprize_winners)
+        self.assertTrue(spotprize_winners)
+
+@skipIf(matching.numpy is None, 'numpy is not installed')
+class ShardingTestCase(TransactionTestCase):
+    '''Check that draws made in shards have the same winners as those made in one process.
+       (The test database is in memory, so testSameWinners runs the shards in threads, which can share it, rather than processes,
+       and testProcesses runs real worker processes on a copy of it in a file.)'''
+
+    def setUp(self):
+        rand = random.Random(2)
+        self.lt = MoreComplexLottery(name = "Complex", number_of_numbers = 4, max_val = 12, min_matches=3, spotprize_nummatches=2, spotprize_value=decimal.Decimal('5.00'))
+        self.lt.save()
+        Punter.objects.bulk_create([Punter(name = 'Punter {}'.format(i), email='p{}@b.cd'.format(i)) for i in range(30)])
+        self.draws = []
+        for day in range(1, 6):
+            draw = Draw(lotterytype = self.lt, drawdate = datetime.datetime(2016,2,day,10,00), prize = decimal.Decimal('100.00'))
+            draw.save()
+            Entry.objects.bulk_create([Entry(punter=p, draw=draw, entry=rand.sample(range(1, 13), 4)) for p in Punter.objects.all()])
+            draw.winning_combo = LotteryNumberSet(rand.sample(range(1, 13), 4))
+            self.draws.append(draw)
+
+    def testMergeCandidates(self):
+        for draw in self.draws:
+            counts = draw.matchCounts()
+            parts = [matching.MatchCounts(counts.ids[i::3], counts.counts[i::3]) for i in range(3)]
+            merged = matching.mergeCandidates([(p.max(), p.candidates(p.max(), 3, 2)) for p in parts], 3, 2)
+            self.assertEqual(merged.max(), counts.max())
+            self.assertEqual(set(merged.idsWith(counts.max())), set(counts.idsWith(counts.max())))
+            self.assertEqual(set(merged.idsWithAtLeast(2)), set(counts.idsWithAtLeast(2)))
+
+    def testSameWinners(self):
+        with mock.patch.object(sharding, 'ProcessPoolExecutor', ThreadPoolExecutor), mock.patch.object(sharding, 'workerDatabase', dict):
+            for draw in self.draws:
+                d = Draw.objects.get(pk=draw.pk)
+                d.winning_combo, d.shards = draw.winning_combo, 4
+                d._matchcounts = d._shardMatches()
+                d.lotterytype.findWinners(d)
+                expected = Draw.objects.get(pk=draw.pk)
+                expected.winning_combo = draw.winning_combo
+                expected.lotterytype.findWinners(expected)
+                self.assertEqual((d.maxMatches, d.winners, d.spotprize_winners), (expected.maxMatches, expected.winners, expected.spotprize_winners))
+            self.draws[0].winning_combo = ''
+            self.draws[0].makeDraw(*LotteryNumberSet(self.draws[1].winning_combo), shards=3)
+            self.assertEqual(Win.objects.filter(entry__draw=self.draws[0]).count(), len(self.draws[0].winners) + len(self.draws[0].spotprize_winners))
+
+    @skipIf(six.PY2, "python 2's sqlite3 module cant open uris")
+    def testProcesses(self):
+        '''test that worker processes read a SQLite file (whose path needs quoting in a uri) read only, and find the same candidates'''
+        self.assertRaises(RuntimeError, sharding.workerDatabase, connection.settings_dict) # the in-memory test database
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'draws?#%20.sqlite3')
+        benchmark.concurrency.copyDatabase(path)
+        database = sharding.workerDatabase(dict(connection.settings_dict, NAME=path))
+        self.assertEqual(database['NAME'], 'file:{}/draws%3F%23%2520.sqlite3?mode=ro'.format(directory))
+        draw = self.draws[0]
+        draw.shards = 3
+        self.assertEqual(draw._shardMatches(database).max(), draw.matchCounts().max())
+        self.assertEqual(set(draw._shardMatches(database).idsWithAtLeast(2)), set(draw.matchCounts().idsWithAtLeast(2)))
+        worker = sqlite3.connect(database['NAME'], uri=True)
+        self.addCleanup(worker.close)
+        self.assertRaises(sqlite3.OperationalError, worker.execute, "update lotto_entry set entry = '1,2,3'")
+
+    def testShardRanges(self):
+        self.assertEqual(sharding.shardRanges(1, 10, 3), [(1, 4), (5, 8), (9, 10)])
+        self.assertEqual(sharding.shardRanges(5, 6, 4), [(5, 5), (6, 6)])
+
+class ResolutionTestCase(TransactionTestCase):
+    '''Check that all the due draws are made, those of each lottery type in draw date order, and those of different types at the same time'''
+
+    def setUp(self):
+        self.types = [SimpleLottery.objects.create(name = "Lottery {}".format(i), number_of_numbers = 3, max_val = 10, min_matches=3) for i in range(3)]
+        self.punter = Punter.objects.create(name = 'Punter 1', email='a@b.cd')
+        self.draws = {}
+        for lt in self.types:
+            self.draws[lt.pk] = []
+            for day in 4, 1, 3, 2: # saved out of order, and the last is in the future
+                draw = Draw(lotterytype = lt, drawdate = datetime.datetime(2016,2,day,10,00,tzinfo=timezone.utc), prize = decimal.Decimal('100.00'))
+                draw.save()
+                Entry.objects.create(punter=self.punter, draw=draw, entry=(1,2,3))
+                self.draws[lt.pk].append(draw)
+            self.draws[lt.pk].sort(key=lambda d: d.drawdate)
+        self.now = datetime.datetime(2016,2,3,12,00,tzinfo=timezone.utc)
+
+    def results(self, **numbers):
+        '''Winning numbers for all the draws, which roll over unless given'''
+        return dict((d.pk, numbers.get(str(d.pk), [7,8,9])) for draws in self.draws.values() for d in draws)
+
+    def testResolve(self):
+        first = self.draws[self.types[0].pk]
+        numbers = self.results(**{str(first[1].pk): [1,2,3]}) # the first rolls over, and the second is won with its rollover
+        results = resolution.resolveDue(self.now, numbers, workers=3)
+        self.assertEqual(len(results), 9)
+        for lt in self.types:
+            made = [r for r in results if r['lotterytype'] == lt.pk]
+            self.assertEqual([r['draw'] for r in made], [d.pk for d in self.draws[lt.pk][:3]])
+            for r in made: self.assertTrue(set(('started', 'store', 'findWinners', 'allocatePrize', 'total')) <= set(r), r)
+            self.assertEqual(Draw.objects.get(pk=self.draws[lt.pk][3].pk).status, Draw.OPEN)
+        self.assertEqual(Win.objects.get(entry__draw=first[1]).prize, decimal.Decimal('200.00'))
+        self.assertEqual(resolution.dueDraws(self.now), [])
+
+    def testFailure(self):
+        '''test that the draws of a lottery type after one which fails are left unmade, while other types carry on'''
+        failing = self.draws[self.types[1].pk]
+        results = resolution.resolveDue(self.now, self.results(**{str(failing[1].pk): [1,2,99]}))
+        self.assertEqual([r['draw'] for r in results if 'error' in r], [failing[1].pk, failing[2].pk])
+        self.assertEqual([Draw.objects.get(pk=d.pk).status for d in failing], [Draw.DRAWN, Draw.OPEN, Draw.OPEN, Draw.OPEN])
+        self.assertEqual(Draw.objects.filter(status=Draw.DRAWN).count(), 7)
+
+    def testPartialResults(self):
+        '''test that a draw missing from the results given fails, rather than being made with random numbers'''
+        missing = self.draws[self.types[2].pk][0]
+        path = os.path.join(tempfile.mkdtemp(), 'results.csv')
+        self.addCleanup(shutil.rmtree, os.path.dirname(path))
+        with io.open(path, 'w') as f: f.write('draw,numbers\n' + ''.join('{},"{}"\n'.format(draw, ','.join(map(str, n))) for draw, n in self.results().items() if draw != missing.pk))
+        out = io.StringIO()
+        with self.assertRaises(CommandError): call_command('resolve_draws', '--now', '2016-02-03T12:00', '--results', path, stdout=out)
+        self.assertIn('6 draws made, 3 failed', out.getvalue())
+        self.assertIn('No winning numbers given for draw {}'.format(missing.pk), out.getvalue())
+        self.assertFalse(Draw.objects.filter(lotterytype=self.types[2], status=Draw.DRAWN).exists())
+
+    def testCommand(self):
+        out = io.StringIO()
+        call_command('resolve_draws', '--now', '2016-02-03T12:00', '--dry-run', stdout=out)
+        self.assertEqual(len(out.getvalue().splitlines()), 9)
+        self.assertFalse(Draw.objects.filter(status=Draw.DRAWN).exists())
+        call_command('resolve_draws', '--now', '2016-02-03T12:00', '--workers', '2', stdout=out)
+        self.assertIn('9 draws made, 0 failed', out.getvalue())
+
+class ImportEntriesTestCase(TestCase):
+    '''Check the import_entries management command'''
+
+    def setUp(self):
+        lt = SimpleLottery(name = "Test Lottery", number_of_numbers = 3, max_val = 10, min_matches=1)
+        lt.save()
+        self.draw = Draw(lotterytype = lt, drawdate = datetime.datetime(2016,2,5,10,00), prize = decimal.Decimal('100.00'))
+        self.draw.save()
+        self.made = Draw(lotterytype = lt, drawdate = datetime.datetime(2016,2,6,10,00), prize = decimal.Decimal('100.00'), winning_combo=(1,2,3))
+        self.made.save()
+        Punter.objects.bulk_create([Punter(name = 'Punter {}'.format(i), email='p{}@b.cd'.format(i)) for i in range(4)])
+        self.p = list(Punter.objects.order_by('pk'))
+        Entry(punter=self.p[3], draw=self.draw, entry=(1,2,3)).save()
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+
+    def runImport(self, name, text, *args):
+        path = os.path.join(self.dir, name)
+        with io.open(path, 'w') as f: f.write(text)
+        call_command('import_entries', path, *args, stdout=io.StringIO())
+        with io.open(path + '.rejects.csv') as f: return [(int(r['row']), r['reason']) for r in csv.DictReader(f)]
+
+    def testCsv(self):
+        rows = ['punter,draw,entry', '{},{},"3,2,1"', '{},{},4 5 6', '{},{},1-2-3', '{},{},"1,2"', '{},{},"1,2,11"', '{},{},"1,1,2"',
+                '{},{},"a,b,c"', '{},{},"1,2,3"', '9999,{},"1,2,3"', '{},9999,"1,2,3"', '{},{},"1,2,3"']
+        ids = [(), (self.p[0].pk, self.draw.pk), (self.p[1].pk, self.draw.pk), (self.p[1].pk, self.draw.pk), (self.p[2].pk, self.draw.pk),
+               (self.p[2].pk, self.draw.pk), (self.p[2].pk, self.draw.pk), (self.p[2].pk, self.draw.pk), (self.p[3].pk, self.draw.pk),
+               (self.draw.pk,), (self.p[2].pk,), (self.p[2].pk, self.made.pk)]
+        rejects = self.runImport('sales.csv', '\n'.join(r.format(*i) for r, i in zip(rows, ids)), '--batch-size', '4')
+        self.assertEqual(rejects, [(3, 'duplicate_entry'), (4, 'wrong_count'), (5, 'out_of_range'), (6, 'duplicate_number'), (7, 'not_a_number'),
+                                   (8, 'duplicate_entry'), (9, 'unknown_punter'), (10, 'unknown_draw'), (11, 'draw_made')])
+        self.assertEqual(Entry.objects.get(punter=self.p[0]).entry, [1,2,3])
+        self.assertEqual(Entry.objects.get(punter=self.p[1]).entry, [4,5,6])
+        self.assertEqual(Entry.objects.get(punter=self.p[1]).entry_mask, 0b111000)
+
+    def testJsonl(self):
+        lines = [json.dumps({'punter': self.p[0].pk, 'draw': self.draw.pk, 'entry': [7,8,9]}), 'not json', json.dumps({'punter': self.p[1].pk})]
+        self.assertEqual(self.runImport('sales.jsonl', '\n'.join(lines)), [(2, 'bad_row'), (3, 'bad_row')])
+        self.assertEqual(Entry.objects.get(punter=self.p[0]).entry, [7,8,9])
+
+class SubTestCase(TestCase):
+    '''Check that a lottery type is downcast to its actual type with at most one query'''
+
+    def setUp(self):
+        self.simple = SimpleLottery(name = "Simple", number_of_numbers = 3, max_val = 10)
+        self.simple.save()
+        self.complex = MoreComplexLottery(name = "Complex", number_of_numbers = 3, max_val = 10, spotprize_nummatches=1, spotprize_value=decimal.Decimal('10.00'))
+        self.complex.save()
+
+    def testSubtype(self):
+        self.assertEqual(set(LotteryType.objects.values_list('subtype', flat=True)), {'simplelottery', 'morecomplexlottery'})
+        self.assertEqual(LotteryType.subclasses, {'simplelottery': SimpleLottery, 'morecomplexlottery': MoreComplexLottery, 'tieredlottery': TieredLottery})
+
+    def testSub(self):
+        with self.assertNumQueries(0): self.assertIs(self.complex.sub, self.complex)
+        lt = LotteryType.objects.get(pk=self.complex.pk)
+        with self.assertNumQueries(1):
+            self.assertEqual(lt.sub, self.complex)
+            self.assertIsInstance(lt.sub, MoreComplexLottery)
+            self.assertEqual(lt.sub.spotprize_value, decimal.Decimal('10.00'))
+
+    def testLegacySub(self):
+        '''test that lottery types saved without a subtype are still downcast'''
+        LotteryType.objects.update(subtype='')
+        self.assertIsInstance(LotteryType.objects.get(pk=self.simple.pk).sub, SimpleLottery)
+        self.assertIsInstance(LotteryType.objects.get(pk=self.complex.pk).sub, MoreComplexLottery)
+
+class TieredLotteryTestCase(TestCase):
+    '''Check the allocation of prizes for each tier of a tiered lottery'''
+
+    def setUp(self):
+        lt = TieredLottery(name = "Tiered", number_of_numbers = 4, max_val = 10, min_matches=4)
+        lt.save()
+        PrizeTier(lotterytype=lt, matches=2, value=decimal.Decimal('1.00')).save()
+        PrizeTier(lotterytype=lt, matches=3, value=decimal.Decimal('10.00')).save()
+        self.draw = Draw(lotterytype = lt, drawdate = datetime.datetime(2016,2,5,10,00), prize = decimal.Decimal('100.00'))
+        self.draw.save()
+        numbers = (1,2,3,4), (1,2,3,5), (1,2,5,6), (1,5,6,7), (5,6,7,8), (1,2,3,4)
+        Punter.objects.bulk_create([Punter(name = 'Punter {}'.format(i), email='p{}@b.cd'.format(i)) for i in range(len(numbers))])
+        self.entries = [Entry(punter=p, draw=self.draw, entry=n) for p, n in zip(Punter.objects.order_by('pk'), numbers)]
+        for e in self.entries: e.save()
+
+    def won(self):
+        return [(w.wintype, w.prize) if w else None for w in [Win.objects.filter(entry=e).first() for e in self.entries]]
+
+    def testDraw(self):
+        self.draw.makeDraw(1,2,3,4)
+        self.assertEqual(self.draw.histogram, [1, 1, 1, 1, 2])
+        self.assertEqual(self.won(), [(Win.MAIN, decimal.Decimal('50.00')), (Win.TIER, decimal.Decimal('10.00')), (Win.TIER, decimal.Decimal('1.00')), 
+                                      None, None, (Win.MAIN, decimal.Decimal('50.00'))])
+
+    def testNoMainWinner(self):
+        '''test that the tier prizes are paid when the main prize is rolled over'''
+        self.draw.makeDraw(1,2,3,9)
+        self.assertEqual(self.won(), [(Win.TIER, decimal.Decimal('10.00')), (Win.TIER, decimal.Decimal('10.00')), (Win.TIER, decimal.Decimal('1.00')), 
+                                      None, None, (Win.TIER, decimal.Decimal('10.00'))])
+        self.assertEqual(self.draw.lotterytype.rollover, self.draw.prize)
+        r = self.draw.result
+        self.assertEqual((r.main_winners, r.tier_winners, r.paid, r.rollover_out), (0, 4, decimal.Decimal('31.00'), self.draw.prize))
+
+    def testStreaming(self):
+        self.draw.makeDraw(1,2,5,6, chunk_size=2)
+        self.assertEqual(self.draw.histogram, [0, 0, 3, 2, 1])
+        self.assertEqual(self.won(), [(Win.TIER, decimal.Decimal('1.00')), (Win.TIER, decimal.Decimal('10.00')), (Win.MAIN, decimal.Decimal('100.00')), 
+                                      (Win.TIER, decimal.Decimal('10.00')), (Win.TIER, decimal.Decimal('1.00')), (Win.TIER, decimal.Decimal('1.00'))])
+
+    @skipIf(matching.numpy is None, 'numpy is not installed')
+    def testVectorised(self):
+        with self.settings(LOTTO_MATCH_ENGINE='numpy'): self.draw.makeDraw(1,2,3,4)
+        self.assertEqual(self.draw.histogram, [1, 1, 1, 1, 2])
+        self.assertEqual(self.won(), [(Win.MAIN, decimal.Decimal('50.00')), (Win.TIER, decimal.Decimal('10.00')), (Win.TIER, decimal.Decimal('1.00')), 
+                                      None, None, (Win.MAIN, decimal.Decimal('50.00'))])
+
+class BenchmarkTestCase(TestCase):
+    '''Check the benchmarks run (on a tiny draw), without leaving any changes behind'''
+
+    def testParseSize(self):
+        self.assertEqual([benchmark.data.parseSize(s) for s in ('500', '10k', '1M', '10M')], [500, 10000, 1000000, 10000000])
+
+    def testRun(self):
+        results = benchmark.scenarios.run([50], repeat=2)
+        self.assertEqual([r['scenario'] for r in results['results']], [name for name, s, skip in benchmark.scenarios.SCENARIOS])
+        for r in results['results']:
+            if 'skipped' not in r: self.assertEqual(len(r['timings']), 2)
+        self.assertEqual(json.loads(json.dumps(results)), results)
+        # the draw is left unmade, and is reused by the next run
+        draw = benchmark.data.draw(50)
+        self.assertFalse(draw.winning_combo)
+        self.assertEqual((draw.entry_set.count(), Win.objects.count(), DrawResult.objects.count()), (50, 0, 0))
+        self.assertEqual(len(list(benchmark.scenarios.compare(results, benchmark.scenarios.run([50], ['makeDraw'], memory=False)))), 1)
+        self.assertEqual(Draw.objects.count(), 1)
+
+    def testConcurrency(self):
+        results = benchmark.concurrency.run(punters=20, draws=2, readers=1, writers=2, seconds=0.2)
+        self.assertEqual([r['profile'] for r in results], [name for name, settings in benchmark.concurrency.PROFILES])
+        for r in results: self.assertTrue(r['reads'] and r['writes'])
+        self.assertEqual(results[1]['failed_writes'], 0)
+
+    def testTunedBackend(self):
+        directory = tempfile.mkdtemp()
+        try:
+            benchmark.concurrency.copyDatabase(os.path.join(directory, 'tuned.sqlite3'))
+            with benchmark.concurrency.database('tuned', 'tuned', os.path.join(directory, 'tuned.sqlite3')) as db:
+                with db.cursor() as cursor:
+                    for pragma, value in ('journal_mode', 'wal'), ('busy_timeout', 5000), ('synchronous', 1):
+                        cursor.execute('PRAGMA ' + pragma)
+                        self.assertEqual(cursor.fetchone()[0], value)
+                with CaptureQueriesContext(db) as queries:
+                    with transaction.atomic(using='tuned'): Entry.objects.using('tuned').count() # readers dont take the write lock
+                    with writeTransaction(using='tuned'):
+                        with transaction.atomic(using='tuned'): Entry.objects.using('tuned').count()
+                    with transaction.atomic(using='tuned'): pass
+                self.assertEqual([q['sql'] for q in queries if q['sql'].startswith('BEGIN')], ['BEGIN DEFERRED', 'BEGIN IMMEDIATE', 'BEGIN DEFERRED'])
+            # the workers of a sharded draw open it read only
+            worker = sharding.workerDatabase(dict(connection.settings_dict, NAME=os.path.join(directory, 'tuned.sqlite3')))
+            self.assertEqual(worker['NAME'], 'file:{}?mode=ro'.format(os.path.join(directory, 'tuned.sqlite3')))
+            with benchmark.concurrency.database('worker', 'tuned', worker['NAME']) as db:
+                db.settings_dict['OPTIONS'] = worker['OPTIONS']
+                self.assertEqual(Entry.objects.using('worker').count(), Entry.objects.count())
+                with self.assertRaises(OperationalError): Entry.objects.using('worker').update(entry='1,2,3')
+        finally: shutil.rmtree(directory)
+
+class EntriesViewTestCase(TestCase):
+    '''Check that a punter's entries are shown a page at a time, with a fixed number of queries per page'''
+
+    def setUp(self):
+        lt = SimpleLottery(name = "Test Lottery", number_of_numbers = 3, max_val = 10, rollover = decimal.Decimal('0.00'), min_matches=1)
+        lt.save()
+        Draw.objects.bulk_create([Draw(lotterytype=lt, drawdate=datetime.datetime(2016,2,5,10,00,tzinfo=timezone.utc) + datetime.timedelta(days=i), 
+                                       prize=decimal.Decimal('100.00'), winning_combo=(1,2,3) if i % 2 else '', status=Draw.DRAWN if i % 2 else Draw.OPEN) 
+                                  for i in range(EntriesView.page_size * 2 + 5)])
+        self.punter = Punter(name = 'Punter 1', email='a@b.cd')
+        self.punter.save()
+        Entry.objects.bulk_create([Entry(punter=self.punter, draw=d, entry=(1,2,4)) for d in Draw.objects.all()])
+        Win.createMany(Entry.objects.filter(draw__winning_combo='1,2,3'), decimal.Decimal('5.00'))
+        signIn(self.client, self.punter)
+
+    def testPages(self):
+        page_url = '/entries/{}/'.format(self.punter.pk)
+        url, seen = page_url, []
+        while url:
+            with self.assertNumQueries(2): response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            page = response.context['object_list']
+            self.assertLessEqual(len(page), EntriesView.page_size)
+            seen.extend(page)
+            url = '{}?before={}'.format(page_url, response.context['next_page']) if response.context['next_page'] else None
+        self.assertEqual([e.pk for e in seen], list(Entry.objects.order_by('-pk').values_list('pk', flat=True)))
+        self.assertEqual(len(seen), EntriesView.page_size * 2 + 5)
+        with self.assertNumQueries(0): won = sum(1 for e in seen if hasattr(e, 'win')) # the wins were read with the entries
+        self.assertEqual(won, Win.objects.count())
+
+    def testInvalidPage(self):
+        self.assertEqual(self.client.get('/entries/{}/?before=x'.format(self.punter.pk)).status_code, 404)
+
+    def testQueryBudget(self):
+        view = querybudget.queryBudget(1)(lambda request: list(Punter.objects.all()) + list(Draw.objects.all()) and HttpResponse())
+        request = RequestFactory().get('/')
+        with mock.patch.object(querybudget.logger, 'warning') as warning:
+            with self.settings(LOTTO_QUERY_BUDGET_FAIL=False): view(request)
+            self.assertEqual(warning.call_count, 1)
+        with self.settings(LOTTO_QUERY_BUDGET_FAIL=True): self.assertRaises(querybudget.QueryBudgetExceeded, view, request)
+        with self.settings(LOTTO_QUERY_BUDGET_FAIL=True): querybudget.queryBudget(2)(view.__wrapped__)(request)
+        logged = len(connection.queries_log)
+        with self.settings(LOTTO_QUERY_BUDGET_FAIL=True): self.assertRaises(querybudget.QueryBudgetExceeded, querybudget.queryBudget(1)(view), request)
+        self.assertEqual(len(connection.queries_log), logged) # counted without the debug cursor, which keeps every query
+        self.assertNotIn('cursor', connections['default'].__dict__)
+        with CaptureQueriesContext(connection) as queries, querybudget.countQueries() as counted: list(Punter.objects.all())
+        self.assertEqual(counted, [len(queries)])
+
+class DrawAdminTestCase(TestCase):
+    '''Check that the draw change page and entry browser dont load the entries of the draw one at a time'''
+
+    def setUp(self):
+        lt = MoreComplexLottery(name = "Test Lottery", number_of_numbers = 3, max_val = 10, rollover = decimal.Decimal('0.00'), min_matches=2, spotprize_nummatches=1, spotprize_value=decimal.Decimal('10.00'))
+        lt.save()
+        self.draw = Draw(lotterytype = lt, drawdate = datetime.datetime(2016,2,5,10,00,tzinfo=timezone.utc), prize = decimal.Decimal('100.00'))
+        self.draw.save()
+        Punter.objects.bulk_create([Punter(name = 'Punter {}'.format(i), email='p{}@b.cd'.format(i)) for i in range(250)])
+        r = random.Random(1)
+        Entry.objects.bulk_create([Entry(punter=p, draw=self.draw, entry=r.sample(range(1, 11), 3)) for p in Punter.objects.all()])
+        User.objects.create_superuser('admin', 'admin@b.cd', 'pw')
+        self.client.login(username='admin', password='pw')
+        self.change = '/admin/lotto/draw/{}/change/'.format(self.draw.pk)
+        self.entries = '/admin/lotto/draw/{}/entries/'.format(self.draw.pk)
+
+    def testAllocate(self):
+        response = self.client.get(self.change)
+        self.assertContains(response, 'Draw not made yet, 250 entries')
+        self.assertContains(response, 'Determine Winners and Allocate Prizes')
+        self.assertRedirects(self.client.post('/admin/allocateDraw/{}/'.format(self.draw.pk), {'winning_combo': '1,2,3'}), self.change)
+        result = DrawResult.objects.get(draw=self.draw)
+        self.assertEqual(result.entries, 250)
+        self.assertContains(self.client.get(self.change), 'Paid {}'.format(result.paid))
+
+    def testEntries(self):
+        self.draw.makeDraw(1,2,3)
+        with self.assertNumQueries(3): response = self.client.get(self.entries) # user, draw, and the entries with their wins
+        url, seen = self.entries, []
+        while url:
+            response = self.client.get(url)
+            seen.extend(response.context['rows'])
+            next_page = response.context['next_page']
+            url = '{}?before={}'.format(self.entries, next_page) if next_page else None
+        self.assertEqual(len(seen), 250)
+        self.assertEqual(sorted(e.pk for e, matches, win in seen if win), sorted(Win.objects.values_list('entry', flat=True)))
+        for e, matches, win in seen: self.assertEqual(matches, self.draw._checkMatches(e))
+
+    def testSearch(self):
+        response = self.client.get(self.entries, {'q': 'p17@'})
+        self.assertEqual([e.punter.email for e, matches, win in response.context['rows']], ['p17@b.cd'])
+        e = Entry.objects.first()
+        self.assertEqual([r[0] for r in self.client.get(self.entries, {'q': e.pk}).context['rows']], [e])
+        # entries containing some numbers, from the mask before the draw is made, and from the number index after it
+        expected = sorted((e.pk for e in Entry.objects.all() if {1,2} <= set(e.entry)), reverse=True)
+        self.assertEqual([r[0].pk for r in self.client.get(self.entries, {'q': '1, 2'}).context['rows']], expected)
+        self.draw.makeDraw(1,2,3) # with the python engine, so the index is built by the first search
+        response = self.client.get(self.entries, {'q': '1,2'})
+        self.assertEqual([r[0].pk for r in response.context['rows']], expected)
+        self.assertContains(response, '{} entries contain all of 1,2'.format(len(expected)))
+
+    def testSearchBigNumbers(self):
+        '''test that entries with numbers too big for a bitmask are found in a draw which hasnt been made'''
+        lt = SimpleLottery.objects.create(name='Big Lottery', number_of_numbers=3, max_val=80)
+        draw = Draw.objects.create(lotterytype=lt, drawdate=datetime.datetime(2016,2,6,10,00,tzinfo=timezone.utc), prize=decimal.Decimal('100.00'))
+        punters = list(Punter.objects.all()[:5])
+        entries = [Entry.objects.create(punter=p, draw=draw, entry=e) for p, e in zip(punters, ['1,2,70', '2,12,70', '1,12,65', '2,21,12', '7,70,72'])]
+        url = '/admin/lotto/draw/{}/entries/'.format(draw.pk)
+        for q, expected in (('2,70', [1, 0]), ('1,2', [0]), ('12, 2', [3, 1]), ('70', [4, 1, 0]), ('7,70', [4])):
+            response = self.client.get(url, {'q': q} if ',' in q else {'q': q + ','})
+            self.assertEqual([r[0] for r in response.context['rows']], [entries[i] for i in expected])
+
+    def testExport(self):
+        self.draw.makeDraw(1,2,3)
+        wins = list(Win.objects.filter(entry__draw=self.draw).select_related('entry__punter').order_by('pk'))
+        self.assertTrue(len(wins) > 100)
+        url = '/admin/lotto/draw/{}/exportWinners/'.format(self.draw.pk)
+        self.assertContains(self.client.get(self.change), 'href="{}?format=jsonl"'.format(url))
+        self.assertNotContains(self.client.get('/admin/lotto/draw/add/'), 'Export Winners')
+        with mock.patch('lotto.admin.EXPORT_BATCH_SIZE', 100):
+            response = self.client.get(url)
+            self.assertTrue(response.streaming)
+            self.assertEqual(response['Content-Disposition'], 'attachment; filename="draw-{}-winners.csv"'.format(self.draw.pk))
+            with CaptureQueriesContext(connection) as queries: content = b''.join(response.streaming_content).decode()
+        self.assertEqual(len(queries), len(wins) // 100 + 1) # one query for each batch of winners
+        rows = list(csv.reader(io.StringIO(content)))
+        self.assertEqual(rows[0], ['win', 'wintype', 'prize', 'entry', 'numbers', 'punter', 'name', 'email', 'address'])
+        self.assertEqual([(int(r[0]), r[2], int(r[3]), r[7]) for r in rows[1:]], [(w.pk, str(w.prize), w.entry.pk, w.entry.punter.email) for w in wins])
+        lines = b''.join(self.client.get(url, {'format': 'jsonl'}).streaming_content).decode().splitlines()
+        self.assertEqual([json.loads(l)['email'] for l in lines], [w.entry.punter.email for w in wins])
+        self.assertEqual(self.client.get(url, {'format': 'xml'}).status_code, 404)
+        self.client.logout()
+        self.assertEqual(self.client.get(url).status_code, 302) # to the admin login
+        User.objects.create_user('staff', 'staff@b.cd', 'pw', is_staff=True) # without permission to change draws
+        self.client.login(username='staff', password='pw')
+        self.assertEqual(self.client.get(url).status_code, 403)
+
+class ChangelistTestCase(TestCase):
+    '''Check that the entry, punter and win changelists run the same number of queries however many rows there are'''
+
+    def setUp(self):
+        lt = SimpleLottery(name = "Test Lottery", number_of_numbers = 3, max_val = 10, rollover = decimal.Decimal('0.00'), min_matches=1)
+        lt.save()
+        Draw.objects.bulk_create([Draw(lotterytype=lt, drawdate=datetime.datetime(2016,2,5,10,00,tzinfo=timezone.utc) + datetime.timedelta(days=i), 
+                                       prize=decimal.Decimal('100.00')) for i in range(30)])
+        User.objects.create_superuser('admin', 'admin@b.cd', 'pw')
+        self.client.login(username='admin', password='pw')
+
+    def addEntries(self, n):
+        start = Punter.objects.count()
+        Punter.objects.bulk_create([Punter(name = 'Punter {}'.format(i), email='p{}@b.cd'.format(i)) for i in range(start, start + n)])
+        r, draws = random.Random(n), list(Draw.objects.all())
+        Entry.objects.bulk_create([Entry(punter=p, draw=r.choice(draws), entry=r.sample(range(1, 11), 3)) for p in Punter.objects.all()[start:]])
+        Win.createMany(Entry.objects.filter(pk__gt=Win.objects.aggregate(n=models.Max('entry'))['n'] or 0)[::2], decimal.Decimal('1.00'))
+
+    def queries(self, url):
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries: self.assertEqual(self.client.get(url).status_code, 200)
+        return len(queries)
+
+    def testConstantQueries(self):
+        urls = ['/admin/lotto/entry/', '/admin/lotto/entry/?result=won&draw__drawdate__gte=2016-01-01', '/admin/lotto/punter/', 
+                '/admin/lotto/punter/?result=haswon', '/admin/lotto/punter/?draw={}'.format(Draw.objects.first().pk), '/admin/lotto/win/']
+        self.addEntries(5)
+        small = [self.queries(url) for url in urls]
+        self.addEntries(120)
+        self.assertEqual([self.queries(url) for url in urls], small)
+
+    def testFilterChoicesCached(self):
+        self.addEntries(5)
+        self.queries('/admin/lotto/punter/')
+        with CaptureQueriesContext(connection) as queries: self.client.get('/admin/lotto/punter/')
+        self.assertFalse([q for q in queries if 'lotto_draw' in q['sql']])
+
+    def testEstimatedCount(self):
+        self.addEntries(30)
+        with mock.patch.object(pagination.EstimatedCountPaginator, 'limit', 10):
+            self.assertEqual(pagination.EstimatedCountPaginator(Entry.objects.all(), 5).count, Entry.objects.aggregate(n=models.Max('pk'))['n'])
+            self.assertEqual(pagination.EstimatedCountPaginator(Entry.objects.filter(pk__gt=0), 5).count, 10)
+            self.assertEqual(pagination.EstimatedCountPaginator(Entry.objects.filter(pk__lt=Entry.objects.first().pk + 3), 5).count, 3)
+            self.assertEqual(pagination.EstimatedCountPaginator(Entry.objects.filter(pk__gt=0), 5, number=3).count, 20) # counted from page 3
+            self.assertEqual(pagination.EstimatedCountPaginator(Entry.objects.filter(pk__gt=0), 5, number=7).count, Entry.objects.count())
+
+    def testPastCappedCount(self):
+        '''test that the pages of a filtered list past the limit of its count can be reached, and that the count is shown as capped'''
+        self.addEntries(60)
+        with mock.patch.object(pagination.EstimatedCountPaginator, 'limit', 10), mock.patch.object(EntryAdmin, 'list_per_page', 5):
+            response = self.client.get('/admin/lotto/entry/?p=4&result=won')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(list(response.context['cl'].result_list), list(Entry.objects.filter(win__isnull=False).order_by('-pk')[20:25]))
+            self.assertContains(response, 'at least 30 Entries')
+            self.assertContains(response, '?p=5&amp;result=won') # the next page
+            self.assertNotContains(response, 'class="showall"') # which would read the whole list
+
+@skipIf(connection.vendor != 'sqlite', 'EXPLAIN QUERY PLAN is specific to SQLite')
+class IndexPlanTestCase(TestCase):
+    '''Check that SQLite plans each of the queries the app runs most often with an index, rather than by scanning a table'''
+
+    def plan(self, queryset):
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+            return [row[-1] for row in cursor.fetchall()]
+
+    def assertUsesIndexes(self, queryset):
+        plan = self.plan(queryset)
+        self.assertFalse([step for step in plan if step.startswith('SCAN') and 'INDEX' not in step], plan)
+        return plan
+
+    def testHotQueries(self):
+        draw = punter = 1
+        self.assertIn('status', ' '.join(self.assertUsesIndexes(Draw.objects.filter(status=Draw.OPEN).exclude(entry__punter__pk=punter))))
+        self.assertUsesIndexes(Draw.objects.filter(status=Draw.DRAWN).order_by('-drawdate')[:20])
+        self.assertUsesIndexes(Entry.objects.filter(punter=punter).order_by('-pk')[:51])
+        self.assertUsesIndexes(Entry.objects.filter(draw=draw, pk__gt=0).order_by('pk').values_list('pk', 'entry'))
+        self.assertUsesIndexes(Entry.objects.filter(draw=draw, win__isnull=False))
+        self.assertUsesIndexes(Entry.objects.filter(draw=draw, win__isnull=True))
+        self.assertUsesIndexes(Win.objects.filter(entry__draw=draw).values_list('wintype').annotate(models.Count('pk')))
+        self.assertUsesIndexes(Punter.objects.filter(pk__in=Win.objects.values('entry__punter')))
+        self.assertUsesIndexes(Punter.objects.filter(pk__in=Win.objects.filter(entry__draw=draw).values('entry__punter')))
+
+    def testStatus(self):
+        lt = SimpleLottery(name = "Test Lottery", number_of_numbers = 3, max_val = 10, rollover = decimal.Decimal('0.00'), min_matches=1)
+        lt.save()
+        draw = Draw(lotterytype = lt, drawdate = datetime.datetime(2016,2,5,10,00,tzinfo=timezone.utc), prize = decimal.Decimal('100.00'))
+        draw.save()
+        self.assertEqual(Draw.objects.get().status, Draw.OPEN)
+        draw.makeDraw(1,2,3)
+        self.assertEqual(Draw.objects.get().status, Draw.DRAWN)
+        self.assertRaises(RuntimeError, draw.makeDraw, 4,5,6)
+
+class EntryFormTestCase(TestCase):
+    '''Check that the entry form offers the cached open draws which the punter hasnt entered'''
+
+    def setUp(self):
+        cache.clear()
+        lt = SimpleLottery(name = "Test Lottery", number_of_numbers = 3, max_val = 10, rollover = decimal.Decimal('0.00'), min_matches=1)
+        lt.save()
+        self.draws = [Draw(lotterytype = lt, drawdate = datetime.datetime(2016,2,5+i,10,00,tzinfo=timezone.utc), prize = decimal.Decimal('100.00')) for i in range(3)]
+        for d in self.draws: d.save()
+        self.punter = Punter(name = 'Punter 1', email='a@b.cd')
+        self.punter.save()
+        Entry(punter=self.punter, draw=self.draws[1], entry=(1,2,3)).save()
+        self.url = '/entry/{}/'.format(self.punter.pk)
+        signIn(self.client, self.punter)
+
+    def offered(self):
+        return [d for d in self.client.get(self.url).context['form'].fields['draw'].draws.values()]
+
+    def testCached(self):
+        with self.assertNumQueries(3): self.client.get(self.url) # the punter, the open draws, and the draws the punter has entered
+        with self.assertNumQueries(2): response = self.client.get(self.url)
+        self.assertEqual(sorted(response.context['form'].fields['draw'].draws.values(), key=lambda d: d.pk), [self.draws[0], self.draws[2]])
+        self.assertContains(response, str(self.draws[0]))
+
+    def testInvalidated(self):
+        self.offered()
+        self.draws[0].makeDraw(1,2,3)
+        self.assertEqual(self.offered(), [self.draws[2]])
+        new = Draw(lotterytype = self.draws[0].lotterytype, drawdate = datetime.datetime(2016,3,1,10,00,tzinfo=timezone.utc), prize = decimal.Decimal('1.00'))
+        new.save()
+        self.assertEqual(sorted(self.offered(), key=lambda d: d.pk), [self.draws[2], new])
+
+    def testEnter(self):
+        response = self.client.post(self.url, {'punter': self.punter.pk, 'draw': self.draws[2].pk, 'entry': '4,5,6'})
+        entry = Entry.objects.get(punter=self.punter, draw=self.draws[2])
+        self.assertRedirects(response, '/goodluck/{}/{}/'.format(self.punter.pk, entry.pk))
+        self.assertEqual(self.offered(), [self.draws[0]])
+        # a draw which isnt offered (because it has been entered) cant be chosen
+        response = self.client.post(self.url, {'punter': self.punter.pk, 'draw': self.draws[1].pk, 'entry': '4,5,6'})
+        self.assertFalse(response.context['form'].is_valid())
+
+class EntrySubmissionTestCase(TransactionTestCase):
+    '''Check that an accepted entry is inserted with a single query, and that the database rejects those which cant be made'''
+
+    def setUp(self):
+        cache.clear()
+        lt = SimpleLottery(name = "Test Lottery", number_of_numbers = 3, max_val = 10, rollover = decimal.Decimal('0.00'), min_matches=1)
+        lt.save()
+        self.draw = Draw(lotterytype = lt, drawdate = datetime.datetime(2016,2,5,10,00,tzinfo=timezone.utc), prize = decimal.Decimal('100.00'))
+        self.draw.save()
+        self.punter = Punter(name = 'Punter 1', email='a@b.cd')
+        self.punter.save()
+        self.url = '/entry/{}/'.format(self.punter.pk)
+        signIn(self.client, self.punter)
+        Draw.openDraws()
+
+    def testOneQuery(self):
+        with self.assertNumQueries(1): response = self.client.post(self.url, {'draw': self.draw.pk, 'entry': '7, 3,5'})
+        entry = Entry.objects.get()
+        self.assertRedirects(response, '/goodluck/{}/{}/'.format(self.punter.pk, entry.pk))
+        self.assertEqual((entry.punter, entry.draw, entry.entry, entry.entry_mask), (self.punter, self.draw, [3,5,7], LotteryNumberMaskField.mask('3,5,7')))
+
+    def testRejected(self):
+        for numbers, error in ('1,2', "Incorrect number of numbers"), ('1,2,11', "Number out of range"), ('1,x,2', "Enter whole numbers separated by commas"):
+            self.assertEqual(self.client.post(self.url, {'draw': self.draw.pk, 'entry': numbers}).context['form'].errors, {'entry': [error]})
+        self.client.post(self.url, {'draw': self.draw.pk, 'entry': '1,2,3'})
+        response = self.client.post(self.url, {'draw': self.draw.pk, 'entry': '4,5,6'})
+        self.assertEqual(response.context['form'].errors, {'draw': ["You have already entered this draw"]})
+        self.assertEqual(list(response.context['form'].fields['draw'].draws), []) # the draw isnt offered again
+        self.assertEqual(Entry.objects.count(), 1)
+
+    def testClosed(self):
+        '''test that an entry isnt made in a draw which has been made since the open draws were cached'''
+        Draw.objects.filter(pk=self.draw.pk).update(status=Draw.DRAWN)
+        response = self.client.post(self.url, {'draw': self.draw.pk, 'entry': '1,2,3'})
+        self.assertEqual(response.context['form'].errors, {'draw': ["This draw is no longer open"]})
+        self.assertIsNone(Entry.objects.enter(self.punter.pk + 1, self.draw.pk, [1,2,3]))
+        self.assertFalse(Entry.objects.exists())
+
+class EntryBufferTestCase(TestCase):
+    '''Check that in write-behind mode entries are queued and acknowledged at once, and flushed to the database in batches'''
+
+    def setUp(self):
+        cache.clear()
+        self.dir = tempfile.mkdtemp()
+        self.settings = self.settings(LOTTO_ENTRY_BUFFER=os.path.join(self.dir, 'entries.sqlite3'))
+        self.settings.enable()
+        lt = SimpleLottery(name = "Test Lottery", number_of_numbers = 3, max_val = 10, rollover = decimal.Decimal('0.00'), min_matches=1)
+        lt.save()
+        self.draw = Draw(lotterytype = lt, drawdate = datetime.datetime(2016,2,5,10,00,tzinfo=timezone.utc), prize = decimal.Decimal('100.00'))
+        self.draw.save()
+        self.punters = [Punter.objects.create(name = 'Punter {}'.format(i), email='{}@b.cd'.format(i)) for i in range(3)]
+        self.buffer = entrybuffer.entryBuffer()
+
+    def tearDown(self):
+        self.settings.disable()
+        shutil.rmtree(self.dir)
+
+    def testQueued(self):
+        punter = self.punters[0]
+        signIn(self.client, punter)
+        response = self.client.post('/entry/{}/'.format(punter.pk), {'draw': self.draw.pk, 'entry': '7,3,5'})
+        self.assertRedirects(response, '/goodluck/{}/q1/'.format(punter.pk))
+        self.assertFalse(Entry.objects.exists())
+        self.assertEqual(self.buffer.pending(self.draw.pk), 1)
+        response = self.client.post('/entry/{}/'.format(punter.pk), {'draw': self.draw.pk, 'entry': '1,2,3'})
+        self.assertEqual(response.context['form'].errors, {'draw': ["You have already entered this draw"]})
+        self.assertEqual(self.buffer.pending(), 1)
+
+    def testFlush(self):
+        for i, p in enumerate(self.punters): self.buffer.add(p.pk, self.draw.pk, [i+1, i+2, i+3])
+        accepted = self.buffer.take(1)[0][4]
+        Entry.objects.enter(self.punters[2].pk, self.draw.pk, [7,8,9]) # entered since it was queued
+        self.assertEqual(entrybuffer.flush(self.buffer, batch_size=2), (2, 1))
+        self.assertEqual(self.buffer.pending(), 0)
+        self.assertEqual([r[5] for r in self.buffer.rejected()], [entrybuffer.DUPLICATE_ENTRY])
+        entry = Entry.objects.get(punter=self.punters[0])
+        self.assertEqual((entry.entry, entry.time.isoformat()), ([1,2,3], accepted)) # the entry keeps the time it was accepted
+        self.draw.makeDraw(1,2,3)
+        self.assertEqual(Draw.objects.get().status, Draw.DRAWN)
+
+    def testMakeDraw(self):
+        '''test that making a draw closes it to queued entries, and flushes those already queued before the winners are found'''
+        punter = self.punters[0]
+        signIn(self.client, punter)
+        self.client.post('/entry/{}/'.format(punter.pk), {'draw': self.draw.pk, 'entry': '1,2,3'})
+        self.draw.makeDraw(1,2,3)
+        self.assertEqual((self.buffer.pending(), self.draw.result.entries, self.draw.result.main_winners), (0, 1, 1))
+        self.assertRaises(entrybuffer.DrawClosed, self.buffer.add, self.punters[1].pk, self.draw.pk, [1,2,3])
+        draw = Draw.objects.create(lotterytype=self.draw.lotterytype, drawdate=datetime.datetime(2016,2,12,10,00,tzinfo=timezone.utc), prize=decimal.Decimal('100.00'))
+        self.buffer.close(draw.pk) # being made
+        response = self.client.post('/entry/{}/'.format(punter.pk), {'draw': draw.pk, 'entry': '1,2,3'})
+        self.assertEqual(response.context['form'].errors, {'draw': ["This draw is no longer open"]})
+
+    def testFailedDraw(self):
+        '''test that a draw which cant be made (as its numbers are invalid) is opened to queued entries again'''
+        self.assertRaises(ValueError, self.draw.makeDraw, 1,2,99)
+        self.buffer.add(self.punters[0].pk, self.draw.pk, [1,2,3])
+
+    def testReplay(self):
+        '''test that entries flushed by a flush which stopped before removing them from the queue arent rejected when they are flushed again'''
+        for i, p in enumerate(self.punters): self.buffer.add(p.pk, self.draw.pk, [i+1, i+2, i+3])
+        with mock.patch.object(self.buffer, 'remove', side_effect=RuntimeError("crash")):
+            self.assertRaises(RuntimeError, entrybuffer.flush, self.buffer)
+        self.assertEqual((Entry.objects.count(), self.buffer.pending()), (3, 3))
+        Entry.objects.filter(punter=self.punters[2]).delete()
+        Entry.objects.enter(self.punters[2].pk, self.draw.pk, [7,8,9]) # entered since it was queued
+        self.assertEqual(entrybuffer.flush(self.buffer), (2, 1))
+        self.assertEqual([r[1] for r in self.buffer.rejected()], [self.punters[2].pk])
+
+    def testClosed(self):
+        self.buffer.add(self.punters[0].pk, self.draw.pk, [1,2,3])
+        Draw.objects.filter(pk=self.draw.pk).update(status=Draw.DRAWN)
+        out = io.StringIO()
+        call_command('flush_entries', stdout=out)
+        self.assertEqual(out.getvalue(), '0 entries flushed, 1 rejected\n')
+        self.assertEqual([r[5] for r in self.buffer.rejected()], [entrybuffer.DRAW_CLOSED])
+        self.assertFalse(Entry.objects.exists())
+
+class NotificationTestCase(TestCase):
+
+    def setUp(self):
+        lt = MoreComplexLottery.objects.create(name="Test Lottery", number_of_numbers=3, max_val=10, min_matches=3, spotprize_nummatches=2, spotprize_value=decimal.Decimal('10.00'))
+        self.draw = Draw.objects.create(lotterytype=lt, drawdate=datetime.datetime(2016,2,5,10,00), prize=decimal.Decimal('100.00'))
+        for i, numbers in enumerate(['1,2,3', '1,2,4', '1,2,5', '7,8,9']):
+            Entry.objects.create(punter=Punter.objects.create(name='Punter {}'.format(i), email='{}@b.cd'.format(i)), draw=self.draw, entry=numbers)
+
+    class FailingBackend(object):
+        def __init__(self, fail): self.fail, self.sent = fail, []
+        def open(self): pass
+        def close(self): pass
+        def send_messages(self, messages):
+            if messages[0].to[0] in self.fail: raise IOError('mailbox unavailable')
+            self.sent.extend(messages)
+            return len(messages)
+
+    def testSend(self):
+        '''test that a notification is queued for each win when the draw is made, and sent in batches without waiting for the draw'''
+        with self.settings(EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend'):
+            self.draw.makeDraw(1,2,3)
+            self.assertEqual(len(mail.outbox), 0)
+            self.assertEqual(WinNotification.objects.filter(status=WinNotification.PENDING).count(), 3)
+            self.assertEqual(notifications.send(batch_size=2), (3, 0))
+        self.assertEqual(sorted(m.to[0] for m in mail.outbox), ['0@b.cd', '1@b.cd', '2@b.cd'])
+        first = [m for m in mail.outbox if m.to == ['0@b.cd']][0]
+        self.assertIn('main prize of 100.00', first.body)
+        self.assertEqual(set(WinNotification.objects.values_list('status', 'attempts')), set([(WinNotification.SENT, 1)]))
+        self.assertEqual(notifications.send(), (0, 0))
+
+    def testRetry(self):
+        '''test that a failed notification is retried after a delay, and given up after MAX_ATTEMPTS'''
+        self.draw.makeDraw(1,2,3)
+        backend = self.FailingBackend(['1@b.cd'])
+        self.assertEqual(notifications.send(connection=backend), (2, 1))
+        n = WinNotification.objects.get(entry__punter__email='1@b.cd')
+        self.assertEqual((n.status, n.attempts), (WinNotification.PENDING, 1))
+        self.assertTrue(n.error.endswith('Error: mailbox unavailable'), n.error)
+        self.assertGreater(n.next_attempt, timezone.now())
+        self.assertEqual(notifications.send(connection=backend), (0, 0)) # not due yet
+        for attempt in range(2, notifications.MAX_ATTEMPTS + 1):
+            WinNotification.objects.filter(pk=n.pk).update(next_attempt=timezone.now())
+            self.assertEqual(notifications.send(connection=backend), (0, 1))
+        self.assertEqual(WinNotification.objects.get(pk=n.pk).status, WinNotification.FAILED)
+        backend.fail = []
+        self.assertEqual(notifications.send(connection=backend), (0, 0))
+        self.assertEqual(len(backend.sent), 2)
+
+    def testClaim(self):
+        '''test that each notification is leased to only one worker at a time'''
+        self.draw.makeDraw(1,2,3)
+        first, second = notifications.claim(2), notifications.claim(10)
+        self.assertEqual((len(first), len(second), notifications.claim(10)), (2, 1, []))
+        self.assertNotEqual(first[0].claim, second[0].claim)
+        self.assertEqual(set(WinNotification.objects.values_list('status', 'attempts')), set([(WinNotification.SENDING, 1)]))
+        # a lease which runs out on the last attempt isnt sent again
+        WinNotification.objects.update(attempts=notifications.MAX_ATTEMPTS, next_attempt=timezone.now())
+        self.assertEqual(notifications.send(connection=self.FailingBackend([])), (0, 0))
+        self.assertEqual(set(WinNotification.objects.values_list('status', flat=True)), set([WinNotification.FAILED]))
+
+    def testStopped(self):
+        '''test that if the worker stops while sending, only the message it was sending is sent again, once its lease has run out'''
+        self.draw.makeDraw(1,2,3)
+        class StoppingBackend(self.FailingBackend):
+            def send_messages(self, messages):
+                if len(self.sent) == 1: raise KeyboardInterrupt
+                return super(StoppingBackend, self).send_messages(messages)
+        with self.assertRaises(KeyboardInterrupt): notifications.send(connection=StoppingBackend([]))
+        self.assertEqual(list(WinNotification.objects.order_by('pk').values_list('status', flat=True)), [WinNotification.SENT, WinNotification.SENDING, WinNotification.SENDING])
+        backend = self.FailingBackend([])
+        self.assertEqual(notifications.send(connection=backend), (0, 0)) # still leased
+        WinNotification.objects.filter(status=WinNotification.SENDING).update(next_attempt=timezone.now())
+        self.assertEqual(notifications.send(connection=backend), (2, 0))
+        self.assertEqual(set(WinNotification.objects.values_list('status', 'attempts')), set([(WinNotification.SENT, 1), (WinNotification.SENT, 2)]))
+
+    def testThrottle(self):
+        '''test that the throttle sleeps to keep to its rate'''
+        now, slept = [0.0], []
+        def sleep(t): slept.append(t); now[0] += t
+        throttle = notifications.Throttle(4, clock=lambda: now[0], sleep=sleep)
+        for i in range(5): throttle.wait()
+        self.assertEqual(slept, [0.25] * 4)
+        self.assertEqual(now[0], 1.0)
+
+    def testDisabled(self):
+        with self.settings(LOTTO_NOTIFY_WINNERS=False):
+            self.draw.makeDraw(1,2,3)
+        self.assertEqual((Win.objects.count(), WinNotification.objects.count()), (3, 0))
+
+    def testCommand(self):
+        self.draw.makeDraw(1,2,3)
+        out = io.StringIO()
+        call_command('send_notifications', '--rate', '1000', stdout=out)
+        self.assertEqual(out.getvalue().strip(), '3 notifications sent, 0 failed')
+        self.assertEqual(len(mail.outbox), 3)
+
+class PunterSessionTestCase(TestCase):
+    '''Check that passwords are hashed once, and checked once a session'''
+
+    def testHashOnce(self):
+        p = Punter(name = 'Punter 1', email='a@b.cd', password='secret')
+        p.save()
+        hashed = p.password
+        self.assertTrue(p.checkPassword('secret'))
+        p.name = 'Punter One'
+        p.save()
+        self.assertEqual(Punter.objects.get().password, hashed)
+        p.setPassword('other')
+        p.save()
+        self.assertFalse(p.checkPassword('secret'))
+        self.assertTrue(Punter.objects.get().checkPassword('other'))
+
+    def testHashLookalike(self):
+        '''test that a password which looks like a hash is still hashed, when it is set directly or in the admin'''
+        lookalike = 'pbkdf2_sha256$1000$salt$aGFzaA=='
+        p = Punter(name = 'Punter 1', email='a@b.cd', password=lookalike)
+        p.save()
+        self.assertNotEqual(p.password, lookalike)
+        self.assertTrue(Punter.objects.get().checkPassword(lookalike))
+        form = PunterAdminForm(instance=Punter.objects.get(), data={'name': 'Punter 1', 'email': 'a@b.cd', 'password': lookalike, 'address': 'here'})
+        self.assertTrue(form.is_valid(), form.errors)
+        self.assertNotEqual(form.save().password, lookalike)
+        self.assertTrue(Punter.objects.get().checkPassword(lookalike))
+
+    def testProfiles(self):
+        '''test that the secure profile doesnt accept a password hashed with the fast profile, while the fast one accepts both'''
+        with self.settings(PASSWORD_HASHERS=settings.PASSWORD_PROFILES['fast']):
+            fast = Punter.objects.create(name = 'Punter 1', email='a@b.cd', password='secret')
+        self.assertTrue(fast.password.startswith('pbkdf2_sha256_fast$'))
+        with self.settings(PASSWORD_HASHERS=settings.PASSWORD_PROFILES['secure']):
+            self.assertFalse(Punter.objects.get(pk=fast.pk).checkPassword('secret'))
+            secure = Punter.objects.create(name = 'Punter 2', email='b@b.cd', password='secret')
+        self.assertTrue(secure.password.startswith('pbkdf2_sha256$'))
+        with self.settings(PASSWORD_HASHERS=settings.PASSWORD_PROFILES['fast']):
+            self.assertRedirects(signIn(self.client, secure, 'secret'), '/entry/{}/'.format(secure.pk), fetch_redirect_response=False)
+            self.assertTrue(Punter.objects.get(pk=secure.pk).password.startswith('pbkdf2_sha256_fast$')) # rehashed with the preferred hasher
+
+    def testSession(self):
+        self.client.post('/punter/', {'name': 'Punter 1', 'email': 'a@b.cd', 'password': 'secret', 'address': 'here'})
+        p, other = Punter.objects.get(), Punter(name = 'Punter 2', email='b@b.cd')
+        other.save()
+        entries = '/entries/{}/'.format(p.pk)
+        with mock.patch('lotto.models.check_password') as check:
+            self.assertEqual(self.client.get(entries).status_code, 200) # signed in when registering
+            self.assertEqual(self.client.get('/').url, '/entry/{}/'.format(p.pk))
+            self.assertEqual(check.call_count, 0)
+        self.assertRedirects(self.client.get('/entries/{}/'.format(other.pk)), '/', fetch_redirect_response=False)
+        self.client.get('/signout/')
+        self.assertRedirects(self.client.get(entries), '/', fetch_redirect_response=False)
+        self.assertEqual(signIn(self.client, p, 'wrong').status_code, 200)
+        self.assertRedirects(self.client.get(entries), '/', fetch_redirect_response=False)
+        signIn(self.client, p, 'secret')
+        self.assertEqual(self.client.get(entries).status_code, 200)
@@ -1,10 +1,31 @@
 from __future__ import unicode_literals
+import functools
 from django.shortcuts import render
 from .forms import PunterForm, EntryForm, SigninForm
+from .querybudget import queryBudget
+from .pagination import keysetPage
 from .models import Punter, Draw, Entry
 from django.views.generic import View, TemplateView, ListView
-from django.http import HttpResponseRedirect
-from django.contrib.auth.hashers import check_password
+from django.http import HttpResponseRedirect, Http404
+from django.utils.decorators import method_decorator
+
+def signIn(request, punter):
+    '''Remember in the session that the punter has signed in, so that the password only needs to be checked once a session'''
+    request.session.cycle_key()
+    request.session['punter'] = punter.pk
+
+def signOut(request):
+    request.session.flush()
+    return HttpResponseRedirect('/')
+
+def punterRequired(view):
+    '''Decorator for a view with a punterid argument, which redirects to the landing page unless that punter has signed in this session.
+       (For a class based view use method_decorator(punterRequired, name='dispatch').)'''
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if str(request.session.get('punter')) != kwargs['punterid']: return HttpResponseRedirect('/')
+        return view(request, *args, **kwargs)
+    return wrapper
 
 class LandingPage(View):
     '''Page directs user to either register or sign in'''
@@ -12,6 +33,7 @@ class LandingPage(View):
     template = 'landing.html'
 
     def get(self, request):
+        if request.session.get('punter'): return HttpResponseRedirect('/entry/{}/'.format(request.session['punter'])) # already signed in
         form = self.fclass()
         print(form.Meta)
         return render(request, self.template, {'form': form, 'title':"Welcome to our Lotteries"})
@@ -21,7 +43,8 @@ class LandingPage(View):
             form = self.fclass(request.POST)
             try: 
                 punter = Punter.objects.get(email=request.POST.get('email'))
-                if check_password(request.POST.get('password'), punter.password):
+                if punter.checkPassword(request.POST.get('password')):
+                    signIn(request, punter)
                     return HttpResponseRedirect('/entry/{}/'.format(punter.pk))
             except Punter.DoesNotExist: pass
         else:
@@ -42,45 +65,60 @@ class PunterView(View):
         form = self.fclass(data = request.POST)
         if form.is_valid(): 
              punter = form.save()
+             signIn(request, punter)
              return HttpResponseRedirect('/entry/{}/'.format(punter.pk))
         else: return render(request, self.template, {'form':form, 'title':"Sign up to enter our Lotteries"})
 
+@method_decorator(punterRequired, name='dispatch')
 class EntryView(View):
     '''Form to make an entry in a draw'''
     fclass = EntryForm
     template = 'entry.html'
 
     def get(self, request, punterid):
-        form = self.fclass(initial = {'punter': punterid})
-        # restrict choice of draws to those that have not taken place, and which the punter has not already entered
-        form.fields['draw'].queryset = Draw.objects.filter(winning_combo='').exclude(entry__punter__pk=punterid)
+        # the choice of draws is restricted to those that have not taken place, and which the punter has not already entered
+        form = self.fclass(punter=punterid)
         punter = Punter.objects.get(pk=punterid)
         return render(request, self.template, {'form':form, 'punter': punter, 'title':"Enter the lottery"})
 
     def post(self, request, punterid):
-        form = self.fclass(data = request.POST)
-        # restrict choice of draws to those that have not taken place, and which the punter has not already entered
-        form.fields['draw'].queryset = Draw.objects.filter(winning_combo='').exclude(entry__punter__pk=punterid)
+        form = self.fclass(data = request.POST, punter=punterid)
+        entry = form.save() if form.is_valid() else None # an accepted entry takes just the one query which inserts it
+        if entry: return HttpResponseRedirect('/goodluck/{}/{}/'.format(punterid, entry.pk or 'q{}'.format(entry.ticket))) # a queued entry has a ticket number
+        form.hideEntered()
         punter = Punter.objects.get(pk=punterid)
-        if form.is_valid(): 
-             entry = form.save()
-             return HttpResponseRedirect('/goodluck/{}/{}/'.format(punterid, entry.pk))
         return render(request, self.template, {'form':form, 'punter': punter, 'title':"Enter the lottery"})
 
 class EntriesView(ListView):
+    '''A punter's entries, newest first, a page at a time.
+       The pages are found by keyset pagination: each page after the first starts before the id of the last entry on the previous page
+       (given as ?before=id), so a page costs the same however many entries the punter has. 
+       The draws, lottery types and wins shown are read in the same query as the entries.'''
     template_name = "entries.html"
+    page_size = 50
+
+    @method_decorator(queryBudget(2))
+    @method_decorator(punterRequired)
+    def dispatch(self, *args, **kwargs):
+        return super(EntriesView, self).dispatch(*args, **kwargs)
 
     def get_queryset(self):
         self.punter = Punter.objects.get(pk=self.kwargs['punterid'])
-        return Entry.objects.filter(punter=self.punter)
+        entries = Entry.objects.filter(punter=self.punter).select_related('draw__lotterytype', 'win')
+        self.before = self.request.GET.get('before')
+        try: page, self.next_page = keysetPage(entries, self.before, self.page_size)
+        except ValueError: raise Http404("Invalid page")
+        return page
 
     def get_context_data(self, **kwargs):
         # Call the base implementation first to get a context
         context = super(EntriesView, self).get_context_data(**kwargs)
         context['punter'] = self.punter
+        context['next_page'], context['first_page'] = self.next_page, not self.before
         return context
 
 
+@method_decorator(punterRequired, name='dispatch')
 class GoodluckView(TemplateView):
     '''Page to be shown after the user has entered a draw'''
     template_name = "goodluck.html"